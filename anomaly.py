@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+
+# Robust z-score above which an amount is unusual for its store or category
+Z_THRESHOLD = 3.5
+# Groups smaller than this don't have enough history for robust statistics
+MIN_GROUP_SIZE = 5
+# MAD floor as a fraction of the median, so groups of identical amounts still flag outliers
+MAD_FLOOR_FRACTION = 0.05
+
+# Round amounts (e.g. 5000.00) are a common sign of made-up reimbursement claims
+ROUND_AMOUNT_STEP = 500
+# A weekday on which a store has issued less than this share of its invoices is unusual
+RARE_WEEKDAY_SHARE = 0.05
+RARE_WEEKDAY_MIN_HISTORY = 20
+# A week with at least SPIKE_MIN_COUNT invoices and SPIKE_RATIO times the store's average weekly rate
+SPIKE_MIN_COUNT = 5
+SPIKE_RATIO = 3.0
+
+# Strong signals flag an invoice on their own, weak ones only in combination
+STRONG_SIGNALS = {
+    "store_outlier": "Unusual amount for this store",
+    "category_outlier": "Unusual amount for this category",
+    "vendor_spike": "Sudden spike in invoices from this store",
+}
+WEAK_SIGNALS = {
+    "round_amount": "Round amount",
+    "rare_weekday": "Unusual weekday for this store",
+}
+FLAG_SCORE = 2
+
+
+def build_anomaly_frame(invoices):
+    """Build the numeric frame the anomaly engine works on from invoice dicts."""
+    invoice_df = pd.DataFrame(invoices)
+    for column in ["id", "store_name", "category", "date", "total_amount"]:
+        if column not in invoice_df:
+            invoice_df[column] = None
+    return pd.DataFrame({
+        "id": invoice_df["id"],
+        "store_name": invoice_df["store_name"].fillna("N/A").astype(str),
+        "category": invoice_df["category"].fillna("Others").astype(str),
+        "date": pd.to_datetime(invoice_df["date"].astype(str), format="%d/%m/%Y", errors="coerce"),
+        "total_amount": pd.to_numeric(invoice_df["total_amount"], errors="coerce").fillna(0.0).astype(float),
+    })
+
+
+def group_stats(frame, key):
+    """Per-group count, median and median absolute deviation of the invoice amounts."""
+    codes, groups = pd.factorize(frame[key])
+    amounts = pd.Series(frame["total_amount"].to_numpy())
+    median = amounts.groupby(codes).median().to_numpy()
+    mad = (amounts - median[codes]).abs().groupby(codes).median().to_numpy()
+    return pd.DataFrame({
+        "count": np.bincount(codes, minlength=len(groups)),
+        "median": median,
+        "mad": mad,
+    }, index=pd.Index(groups, name=key))
+
+
+def robust_z(frame, key, stats):
+    """Robust z-score (0.6745 * (x - median) / MAD) of each amount within its group."""
+    positions = stats.index.get_indexer(frame[key])
+    median = stats["median"].to_numpy()[positions]
+    mad = np.maximum(stats["mad"].to_numpy()[positions], MAD_FLOOR_FRACTION * np.abs(median))
+    count = stats["count"].to_numpy()[positions]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = 0.6745 * (frame["total_amount"].to_numpy() - median) / mad
+    return np.where((positions >= 0) & (count >= MIN_GROUP_SIZE) & np.isfinite(z), z, 0.0)
+
+
+def _day_numbers(frame):
+    """Days since the epoch for each invoice date, and a mask of the rows that have a date."""
+    dates = frame["date"].to_numpy(dtype="datetime64[D]")
+    dated = ~np.isnat(dates)
+    return np.where(dated, dates.astype(np.int64), 0), dated
+
+
+def store_signals(frame, store_stats):
+    """
+    Signals that only depend on each store's own history: the store z-score, rare
+    weekdays and weekly frequency spikes. The frame must hold whole stores.
+    """
+    codes, stores = pd.factorize(frame["store_name"])
+    days, dated = _day_numbers(frame)
+    n_stores = len(stores)
+    store_z = robust_z(frame, "store_name", store_stats)
+
+    # Share of the store's dated invoices that fall on the same weekday (1970-01-01 was a Thursday)
+    weekday = (days + 3) % 7
+    weekday_key = codes * 7 + weekday
+    weekday_counts = np.bincount(weekday_key[dated], minlength=n_stores * 7)
+    history = np.bincount(codes[dated], minlength=n_stores)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = weekday_counts[weekday_key] / history[codes]
+    rare_weekday = dated & (history[codes] >= RARE_WEEKDAY_MIN_HISTORY) & (share < RARE_WEEKDAY_SHARE)
+
+    # Invoices in the same store and week against the store's average weekly rate over its active span
+    week = days // 7
+    first = week[dated].min() if dated.any() else 0
+    weeks = week[dated].max() - first + 1 if dated.any() else 1
+    week_key = codes.astype(np.int64) * weeks + (week - first)
+    _, inverse, week_counts = np.unique(week_key[dated], return_inverse=True, return_counts=True)
+    in_week = np.zeros(len(frame))
+    in_week[dated] = week_counts[inverse]
+    first_week = np.full(n_stores, np.iinfo(np.int64).max)
+    last_week = np.full(n_stores, np.iinfo(np.int64).min)
+    np.minimum.at(first_week, codes[dated], week[dated])
+    np.maximum.at(last_week, codes[dated], week[dated])
+    span = np.maximum(last_week - first_week + 1, 1)
+    weekly_rate = history / span
+    vendor_spike = dated & (in_week >= SPIKE_MIN_COUNT) & (in_week >= SPIKE_RATIO * weekly_rate[codes])
+
+    return pd.DataFrame({
+        "store_z": store_z,
+        "store_outlier": store_z > Z_THRESHOLD,
+        "rare_weekday": rare_weekday,
+        "vendor_spike": vendor_spike,
+    }, index=frame.index)
+
+
+def combine_signals(scored):
+    """Fill in the combined score, the flagged column and human-readable reasons."""
+    strong = scored[list(STRONG_SIGNALS)].to_numpy(dtype=bool)
+    weak = scored[list(WEAK_SIGNALS)].to_numpy(dtype=bool)
+    scored["score"] = 2 * strong.sum(axis=1) + weak.sum(axis=1)
+    scored["flagged"] = scored["score"].to_numpy() >= FLAG_SCORE
+
+    reasons = np.full(len(scored), "", dtype=object)
+    for name, label in {**STRONG_SIGNALS, **WEAK_SIGNALS}.items():
+        hit = scored[name].to_numpy(dtype=bool)
+        reasons[hit] = reasons[hit] + (label + ", ")
+    scored["reasons"] = pd.Series([reason[:-2] for reason in reasons], index=scored.index, dtype=object)
+    return scored
+
+
+def score_anomalies(frame, store_stats=None, category_stats=None):
+    """
+    Score every invoice in the frame. Returns the frame with one boolean column per
+    signal, the robust z-scores, a combined score, a flagged column and the reasons.
+    """
+    if store_stats is None:
+        store_stats = group_stats(frame, "store_name")
+    if category_stats is None:
+        category_stats = group_stats(frame, "category")
+
+    scored = pd.concat([frame, store_signals(frame, store_stats)], axis=1)
+    scored["category_z"] = robust_z(frame, "category", category_stats)
+    scored["category_outlier"] = scored["category_z"] > Z_THRESHOLD
+    amounts = frame["total_amount"].to_numpy()
+    scored["round_amount"] = (amounts >= ROUND_AMOUNT_STEP) & (np.mod(amounts, ROUND_AMOUNT_STEP) == 0)
+    return combine_signals(scored)
+
+
+def init_anomaly_state(invoices):
+    """Score a full invoice set from scratch and keep the statistics for incremental updates."""
+    frame = build_anomaly_frame(invoices)
+    store_stats = group_stats(frame, "store_name")
+    category_stats = group_stats(frame, "category")
+    return {
+        "frame": frame,
+        "store_stats": store_stats,
+        "category_stats": category_stats,
+        "scores": score_anomalies(frame, store_stats, category_stats),
+    }
+
+
+def update_anomaly_state(engine, invoice):
+    """
+    Add one saved invoice to the engine. Only the statistics of the invoice's store and
+    category are recomputed, and only the invoices in those two groups are re-scored.
+    """
+    row = build_anomaly_frame([invoice])
+    row.index = [len(engine["frame"])]
+    frame = pd.concat([engine["frame"], row])
+    store, category = row["store_name"].iat[0], row["category"].iat[0]
+    in_store = (frame["store_name"] == store).to_numpy()
+    in_category = (frame["category"] == category).to_numpy()
+
+    store_stats = engine["store_stats"].drop(index=store, errors="ignore")
+    category_stats = engine["category_stats"].drop(index=category, errors="ignore")
+    store_stats = pd.concat([store_stats, group_stats(frame[in_store], "store_name")])
+    category_stats = pd.concat([category_stats, group_stats(frame[in_category], "category")])
+
+    scores = pd.concat([engine["scores"], score_anomalies(row, store_stats, category_stats)])
+    store_rows = frame[in_store]
+    signals = store_signals(store_rows, store_stats)
+    scores.loc[store_rows.index, signals.columns] = signals
+    category_rows = frame[in_category]
+    category_z = robust_z(category_rows, "category", category_stats)
+    scores.loc[category_rows.index, "category_z"] = category_z
+    scores.loc[category_rows.index, "category_outlier"] = category_z > Z_THRESHOLD
+
+    affected = in_store | in_category
+    signal_columns = list(STRONG_SIGNALS) + list(WEAK_SIGNALS)
+    combined = combine_signals(scores.loc[affected, signal_columns].copy())
+    scores.loc[affected, ["score", "flagged", "reasons"]] = combined[["score", "flagged", "reasons"]]
+    engine.update(frame=frame, store_stats=store_stats, category_stats=category_stats, scores=scores)
+    return engine
+
+
+def flagged_invoices(engine):
+    """Flagged invoices, highest score first, with the columns shown in the Dashboard."""
+    scores = engine["scores"]
+    flagged = scores[scores["flagged"].astype(bool)].sort_values(["score", "total_amount"], ascending=False)
+    return flagged[["id", "store_name", "category", "date", "total_amount", "store_z", "category_z", "reasons"]]
+
+
+def sync_anomaly_state(state, invoices):
+    """Return the session's anomaly engine, rebuilding it if it no longer matches the invoices."""
+    engine = state.get("anomaly_engine")
+    if engine is None or len(engine["frame"]) != len(invoices):
+        engine = state["anomaly_engine"] = init_anomaly_state(invoices)
+    return engine
+
+
+def record_saved_invoice(state, invoices, invoice):
+    """Score a newly saved invoice incrementally if the session already has an up-to-date engine."""
+    engine = state.get("anomaly_engine")
+    if engine is not None and len(engine["frame"]) == len(invoices) - 1:
+        update_anomaly_state(engine, invoice)
+    else:
+        state.pop("anomaly_engine", None)
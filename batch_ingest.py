@@ -0,0 +1,235 @@
+"""
+Headless batch ingestion of archived invoices.
+
+    python batch_ingest.py receipts/ invoices.parquet
+    python batch_ingest.py receipts.tar.gz invoices.parquet --workers 8 --concurrency 32
+
+Reads PNG/JPG/JPEG/PDF files from a directory (recursively) or a tarball, decodes images in
+a process pool and PDFs page by page, runs OCR and entity extraction with bounded concurrency
+against the configured providers (see providers.py) and marks duplicates as Home.py does.
+Every finished file is appended to a JSONL checkpoint next to the output, so an interrupted
+run picks up where it stopped and files that failed are retried; the columnar output
+(Parquet, or CSV by extension) is written from the checkpoint at the end.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from duplicates import DuplicateIndex
+from extraction import (decode_upload, extract_entities, extract_text_adaptive, has_key_fields, ocr_payloads, page_order,
+                        pdf_page_count, pdf_page_payloads)
+from providers import get_providers
+from templates import TemplateRegistry
+from vendors import VendorRegistry
+
+SUPPORTED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".pdf")
+DEFAULT_CONCURRENCY = 16
+# Decoded images waiting for OCR, per decode worker; bounds memory when the API is the bottleneck
+QUEUE_PER_WORKER = 4
+ENTITY_COLUMNS = ["store_name", "gstin", "date", "bill_no", "total_amount", "category"]
+OUTPUT_COLUMNS = ["id", "source"] + ENTITY_COLUMNS + ["extracted_by", "duplicate_of", "similarity_score", "error",
+                                                       "extracted_text"]
+
+
+def iter_sources(path):
+    """Yield (name, bytes) for every supported file in a directory tree or tarball, in a stable order."""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                if file_name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    full_path = os.path.join(root, file_name)
+                    with open(full_path, "rb") as f:
+                        yield os.path.relpath(full_path, path), f.read()
+    elif tarfile.is_tarfile(path):
+        # Streaming mode reads the archive once, front to back
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise ValueError(f"{path} is neither a directory nor a tar archive")
+
+
+def decode_invoice(name, data):
+    """Process-pool worker: decode an image file and return the OCR payloads (see extraction.ocr_payloads)."""
+    return ocr_payloads(decode_upload(name, data))
+
+
+async def read_pdf(data, decode_pool, api_pool, providers):
+    """
+    extraction.extract_pdf_text for the batch pools: pages are rasterized in the decode
+    processes and OCRed on the API threads, first and last page first, and pages not yet
+    read are dropped once the first page is in and the text has a total and a GSTIN.
+    """
+    loop = asyncio.get_running_loop()
+    page_count = await loop.run_in_executor(decode_pool, pdf_page_count, data)
+
+    async def read_page(page):
+        low_png, low_size, full_png = await loop.run_in_executor(decode_pool, pdf_page_payloads, data, page)
+        return page, await loop.run_in_executor(api_pool, extract_text_adaptive, low_png, low_size, full_png, providers)
+
+    tasks = [asyncio.ensure_future(read_page(page)) for page in page_order(page_count)]
+    texts = {}
+    try:
+        for next_page in asyncio.as_completed(tasks):
+            page, texts[page] = await next_page
+            if 1 in texts and has_key_fields("\n".join(texts.values())):
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+    return "\n".join(texts[page] for page in sorted(texts))
+
+
+def checkpoint_path(output):
+    return output + ".checkpoint.jsonl"
+
+
+def load_checkpoint(path):
+    """Latest record per source written by earlier runs, skipping a torn last line."""
+    records = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                records[record["source"]] = record
+    return list(records.values())
+
+
+def write_output(records, output):
+    """Write the records as Parquet (needs pyarrow) or CSV, depending on the output extension."""
+    # A file that failed and was retried later keeps only its latest record
+    latest = {record["source"]: record for record in records}
+    frame = pd.DataFrame(sorted(latest.values(), key=lambda record: record["id"]), columns=OUTPUT_COLUMNS)
+    if output.lower().endswith(".csv"):
+        frame.to_csv(output, index=False)
+    else:
+        frame.to_parquet(output, index=False)
+
+
+async def ingest(source, output, workers=None, concurrency=DEFAULT_CONCURRENCY, limit=None, providers=None):
+    """
+    Ingest every file under source into output, resuming from the checkpoint. Returns
+    (processed this run, skipped from the checkpoint, failed this run).
+    """
+    providers = providers or get_providers()
+    workers = workers or os.cpu_count() or 1
+    checkpoint = checkpoint_path(output)
+    records = load_checkpoint(checkpoint)
+    # Failed files are tried again
+    done = {record["source"] for record in records if not record["error"]}
+    duplicates = DuplicateIndex({"id": r["id"], "extracted_text": r["extracted_text"]}
+                                for r in records if not r["error"])
+    vendors = VendorRegistry(r for r in records if not r["error"])
+    templates = TemplateRegistry(r for r in records if not r["error"])
+    next_id = max((record["id"] for record in records), default=0) + 1
+
+    loop = asyncio.get_running_loop()
+    decode_pool = ProcessPoolExecutor(max_workers=workers)
+    # API calls are blocking client calls; the thread pool bounds how many are in flight
+    api_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-api")
+    queue = asyncio.Queue(maxsize=workers * QUEUE_PER_WORKER)
+    processed = failed = 0
+
+    with open(checkpoint, "a", encoding="utf-8") as checkpoint_file:
+
+        def save(record):
+            nonlocal next_id, processed, failed
+            record["id"] = next_id
+            next_id += 1
+            if record["error"]:
+                failed += 1
+            else:
+                duplicate_id, score = duplicates.find(record["extracted_text"])
+                record["duplicate_of"], record["similarity_score"] = duplicate_id, score
+                duplicates.add(record["id"], record["extracted_text"])
+                vendors.add(record)
+                templates.add(record)
+            records.append(record)
+            checkpoint_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            checkpoint_file.flush()
+            processed += 1
+            if processed % 100 == 0:
+                print(f"{processed} processed, {failed} failed", file=sys.stderr, flush=True)
+
+        async def produce():
+            # Reading is sequential (tarballs can only be streamed); decoding fans out to the pool
+            count = 0
+            for name, data in iter_sources(source):
+                if name in done:
+                    continue
+                if limit is not None and count >= limit:
+                    break
+                count += 1
+                if name.lower().endswith(".pdf"):
+                    # Pages are rasterized in the decode pool, and only as far as needed, by read_pdf
+                    await queue.put((name, data, None))
+                else:
+                    await queue.put((name, None, loop.run_in_executor(decode_pool, decode_invoice, name, data)))
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                name, pdf_data, decoded = item
+                record = {"source": name, "error": None, "duplicate_of": None, "similarity_score": 0}
+                try:
+                    if decoded is None:
+                        text = await read_pdf(pdf_data, decode_pool, api_pool, providers)
+                    else:
+                        low_png, low_size, full_png = await decoded
+                        text = await loop.run_in_executor(api_pool, extract_text_adaptive, low_png, low_size,
+                                                          full_png, providers)
+                    entities = await loop.run_in_executor(api_pool, extract_entities, text, providers,
+                                                          vendors, templates)
+                    record.update({column: entities.get(column) for column in ENTITY_COLUMNS})
+                    record["extracted_by"] = entities.get("extracted_by", "llm")
+                    record["extracted_text"] = text
+                except Exception as e:
+                    record.update(extracted_text="", error=f"{type(e).__name__}: {e}")
+                save(record)
+
+        try:
+            await asyncio.gather(produce(), *(consume() for _ in range(concurrency)))
+        finally:
+            decode_pool.shutdown(cancel_futures=True)
+            api_pool.shutdown(wait=False, cancel_futures=True)
+
+    write_output(records, output)
+    return processed, len(done), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="directory or tar archive of invoice images and PDFs")
+    parser.add_argument("output", help="output file (.parquet or .csv); the checkpoint is written next to it")
+    parser.add_argument("--workers", type=int, default=None, help="decode processes (default: CPU count)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="OCR/LLM calls in flight; size it to the provider quota")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many new files")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    processed, skipped, failed = asyncio.run(
+        ingest(args.source, args.output, args.workers, args.concurrency, args.limit))
+    elapsed = time.perf_counter() - started
+    print(f"{processed} processed ({failed} failed), {skipped} already done, "
+          f"{processed / elapsed if elapsed else 0:.1f} files/s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Entity-extraction latency with one LLM against routed and hedged LLMs (routing.py).
+
+    python -m benchmarks.hedging --calls 1000 --workers 4
+
+Both providers are local stand-ins with log-normal latency and occasional stalls (the slow
+tail of a real API); each mode gets fresh stand-ins with the same seeds, so runs compare
+like with like. "extra" is the share of calls that also went to a second provider, and
+"cancelled" how many of those losing calls were stopped early.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic import generate_invoices
+from extraction import extract_entities
+from providers import LocalLLM, LocalOCR, Providers
+from routing import RoutedLLM
+
+
+def stand_ins(args):
+    gemini = LocalLLM(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, stall_rate=args.stall_rate,
+                      stall_ms=args.stall_ms, seed=args.seed)
+    groq = LocalLLM(latency_ms=args.alt_latency_ms, latency_sigma=args.latency_sigma, stall_rate=args.stall_rate,
+                    stall_ms=args.stall_ms, seed=args.seed + 1)
+    return {"gemini": gemini, "groq": groq}
+
+
+def run_mode(label, llm, stand_ins, texts, workers):
+    providers = Providers(LocalOCR(), llm)
+    latencies = []
+
+    def call(text):
+        started = time.perf_counter()
+        extract_entities(text, providers)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = sorted(pool.map(call, texts))
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    calls = sum(stand_in.calls for stand_in in stand_ins.values())
+    cancelled = sum(stand_in.cancelled for stand_in in stand_ins.values())
+    print(f"{label:<12} {pick(0.5):8.1f} {pick(0.9):8.1f} {pick(0.99):8.1f} {latencies[-1] * 1000:8.1f} "
+          f"{calls / len(texts) - 1:7.1%} {cancelled:10d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=60.0, help="median latency of the primary (Gemini) stand-in")
+    parser.add_argument("--alt-latency-ms", type=float, default=80.0, help="median latency of the alternative (Groq)")
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--stall-rate", type=float, default=0.05, help="share of calls that stall")
+    parser.add_argument("--stall-ms", type=float, default=1000.0, help="added latency of a stalled call")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Unknown vendors and no keyword hits, so every call reaches the LLM
+    texts = [invoice["extracted_text"] for invoice in generate_invoices(args.calls, seed=args.seed)]
+    print(f"{args.calls} extractions, {args.workers} workers, stalls {args.stall_rate:.0%} x {args.stall_ms:.0f} ms")
+    print(f"{'mode':<12} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'extra':>7} {'cancelled':>10}")
+    llms = stand_ins(args)
+    run_mode("gemini only", llms["gemini"], {"gemini": llms["gemini"]}, texts, args.workers)
+    llms = stand_ins(args)
+    run_mode("routed", RoutedLLM(llms, hedge=False), llms, texts, args.workers)
+    llms = stand_ins(args)
+    run_mode("hedged", RoutedLLM(llms), llms, texts, args.workers)
+
+
+if __name__ == "__main__":
+    main()
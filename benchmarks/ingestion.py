@@ -0,0 +1,103 @@
+"""
+Offline load test of the ingestion path (OCR, duplicate check, entity extraction) against
+the local Vision and Gemini stand-ins.
+
+    python -m benchmarks.ingestion --uploads 200 --workers 8 --latency-ms 300 --rate-limit-rate 0.05
+    python -m benchmarks.ingestion --image-side 2400 --ms-per-mb 400   # scanned-page sized uploads
+
+Runs are repeatable for a given --seed: the stand-ins draw latencies, failures and 429s
+from seeded generators.
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from benchmarks.synthetic import generate_invoices
+from extraction import extract_entities, extract_text
+from providers import LocalLLM, LocalOCR, ProviderError, Providers, set_providers
+from utils import check_duplicate
+
+
+def upload_image(index, seed, side=64):
+    """
+    A distinct image standing in for an uploaded invoice; larger sides get a photographed
+    page of text-like lines (with sensor noise, which is what makes real uploads big).
+    """
+    rng = random.Random(seed * 1000003 + index)
+    if side <= 64:
+        return Image.frombytes("L", (side, side), bytes(rng.getrandbits(8) for _ in range(side * side)))
+    width, height = side * 5 // 7, side
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    line_height = max(4, side // 60)
+    for top in range(line_height * 2, height - line_height * 2, line_height * 2):
+        left = rng.randrange(width // 20, width // 4)
+        draw.rectangle((left, top, rng.randrange(width // 2, width - width // 20), top + line_height), fill="black")
+    noise = Image.merge("RGB", [Image.effect_noise((width, height), 24) for _ in range(3)])
+    return Image.blend(image, noise, 0.2)
+
+
+def ingest(image, invoices, providers):
+    started = time.perf_counter()
+    text = extract_text(image, providers)
+    check_duplicate(text, invoices=invoices)
+    extract_entities(text, providers)
+    return time.perf_counter() - started
+
+
+def run(uploads, workers, corpus_size, seed, image_side=64, ms_per_mb=0.0, **stand_in):
+    ocr = LocalOCR(texts=[invoice["extracted_text"] for invoice in generate_invoices(50, seed=seed + 1)],
+                   seed=seed, ms_per_mb=ms_per_mb, **stand_in)
+    llm = LocalLLM(seed=seed + 1, **stand_in)
+    providers = Providers(ocr, llm)
+    previous = set_providers(providers)
+    invoices = generate_invoices(corpus_size, seed=seed)
+    images = [upload_image(i, seed, image_side) for i in range(uploads)]
+
+    latencies, failures = [], 0
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(ingest, image, invoices, providers) for image in images]
+            for future in futures:
+                try:
+                    latencies.append(future.result())
+                except ProviderError:
+                    failures += 1
+    finally:
+        set_providers(previous)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else float("nan")
+    print(f"uploads {uploads}, workers {workers}, corpus {corpus_size:,}")
+    print(f"throughput      {uploads / elapsed:8.1f} uploads/s ({elapsed:.2f} s)")
+    print(f"latency p50     {pick(0.5) * 1000:8.1f} ms")
+    print(f"latency p95     {pick(0.95) * 1000:8.1f} ms")
+    print(f"failed uploads  {failures:8d}")
+    print(f"provider calls  {ocr.calls:8d} OCR, {llm.calls} LLM (retries included)")
+    print(f"OCR payload     {ocr.bytes_received / uploads / 1024:8.1f} KB per upload")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--corpus", type=int, default=1000, help="invoices already saved (duplicate check)")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="median simulated latency per call")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls failing with a 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of calls answered with a 429")
+    parser.add_argument("--image-side", type=int, default=64, help="height in pixels of the uploaded images")
+    parser.add_argument("--ms-per-mb", type=float, default=0.0, help="simulated upload time per MB sent to OCR")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.uploads, args.workers, args.corpus, args.seed, args.image_side, args.ms_per_mb, latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Stand-in extraction accuracy against prompt size for OCR text pruning (text_pruning.py).
+
+    python -m benchmarks.pruning --invoices 500 --budgets 0,800,400,200,100,60
+
+The corpus is fixed for a given --seed: synthetic invoices padded with the kind of text that
+inflates real prompts (ticket and bill boilerplate, repeated disclaimers, contact lines),
+in the layout Vision returns, with labels and values on separate lines for some invoices.
+Fields are extracted by the local Gemini stand-in, a regex extractor, not by Gemini: the
+accuracy here only measures whether pruning kept the lines the fields are on, not how well
+Gemini reads the pruned prompt. Budget 0 is the unpruned text.
+"""
+import argparse
+import random
+import string
+import time
+from datetime import date, timedelta
+
+from benchmarks.synthetic import invoice_text, make_stores
+from providers import LocalLLM
+from text_pruning import estimate_tokens, prune_text
+
+FIELDS = ["store_name", "gstin", "date", "bill_no", "total_amount", "category"]
+# Boilerplate goes after the store name, where the stand-in (and Gemini) look for it
+HEADER_SAFE = 1
+# Lines from real tickets and bills that carry no field we extract
+BOILERPLATE = [
+    "IRCTC Convenience Fee is charged per e-ticket irrespective of number of passengers on the ticket.",
+    "* The printed Departure and Arrival Times are liable to change. Please Check correct departure, arrival "
+    "from Railway Station Enquiry or Dial 139 or SMS RAIL to 139.",
+    "This ticket is booked on a personal User ID, its sale/purchase is an offence u/s 143 of the Railways Act, 1989.",
+    "Prescribed original ID proof is required while travelling along with SMS/ VRM/ERS otherwise will be treated "
+    "as without ticket and penalized as per Railway Rules.",
+    "Terms & Conditions: Goods once sold will not be taken back or exchanged.",
+    "This is a computer generated invoice and does not require a signature.",
+    "All disputes are subject to Delhi jurisdiction only.",
+    "Customer care: 1800 180 1234 (toll free), 9 AM to 9 PM on all working days",
+    "Visit us at www.example.in for offers and to track your orders and returns online.",
+    "E. & O.E.",
+]
+
+
+def padded_invoice(store, category, gstin, rng):
+    """An invoice text with boilerplate around it, and its true fields."""
+    bill_no = f"{rng.choice(string.ascii_uppercase)}{rng.randint(1000, 999999)}"
+    invoice_date = date(2023, 1, 1) + timedelta(days=rng.randrange(730))
+    text, total = invoice_text(store, gstin, category, bill_no, invoice_date, rng)
+    lines = text.splitlines()
+    if rng.random() < 0.3:
+        # Vision's layout for columns: each label on its own line, the value below it
+        lines = [part for line in lines for part in (line.split(": ", 1) if ": " in line else [line])]
+    padding = rng.choices(BOILERPLATE, k=rng.randint(3, 12))
+    for line in padding:
+        lines.insert(rng.randint(HEADER_SAFE, len(lines)), line)
+    truth = {"store_name": store, "gstin": gstin, "date": f"{invoice_date:%d/%m/%Y}", "bill_no": bill_no,
+             "total_amount": f"{total:.2f}", "category": category}
+    return "\n".join(lines), truth
+
+
+def corpus(count, seed):
+    rng = random.Random(seed)
+    stores = make_stores(rng, 100)
+    return [padded_invoice(*rng.choice(stores), rng) for _ in range(count)]
+
+
+def matches(field, extracted, expected):
+    if field == "total_amount":
+        try:
+            return abs(float(extracted) - float(expected)) < 0.005
+        except (TypeError, ValueError):
+            return False
+    return str(extracted).strip() == expected
+
+
+def run(count, budgets, seed):
+    invoices = corpus(count, seed)
+    llm = LocalLLM()
+    print(f"{count} invoices, seed {seed}; accuracy of the local regex stand-in, not Gemini")
+    print(f"{'budget':>8} {'tokens':>8} {'max':>6} {'prune ms':>9}  " + " ".join(f"{f[:10]:>10}" for f in FIELDS)
+          + f" {'all':>6}")
+    for budget in budgets:
+        tokens, correct, all_correct, pruning = [], dict.fromkeys(FIELDS, 0), 0, 0.0
+        for text, truth in invoices:
+            started = time.perf_counter()
+            pruned = prune_text(text, budget)
+            pruning += time.perf_counter() - started
+            tokens.append(estimate_tokens(pruned))
+            entities = llm.entities(pruned)
+            hits = [field for field in FIELDS if matches(field, entities.get(field), truth[field])]
+            for field in hits:
+                correct[field] += 1
+            all_correct += len(hits) == len(FIELDS)
+        print(f"{budget or 'none':>8} {sum(tokens) / count:8.0f} {max(tokens):6d} {pruning / count * 1000:9.3f}  "
+              + " ".join(f"{correct[f] / count:10.1%}" for f in FIELDS) + f" {all_correct / count:6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=500)
+    parser.add_argument("--budgets", default="0,800,400,200,100,60",
+                        help="comma-separated token budgets; 0 sends the whole text")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.invoices, [int(b) for b in args.budgets.split(",")], args.seed)
+
+
+if __name__ == "__main__":
+    main()
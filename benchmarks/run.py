@@ -0,0 +1,132 @@
+"""
+Benchmarks for the invoice hot paths on synthetic corpora.
+
+Run from the repository root:
+
+    python -m benchmarks.run                      # 100, 10k and 100k invoices
+    python -m benchmarks.run --sizes 100 10000 --cases check_duplicate pdf_report
+    python -m benchmarks.run --json results.json  # keep a run to compare against later
+
+Each case is timed once on its own and then run again under tracemalloc for its peak
+memory, so the timings don't include tracing overhead.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from benchmarks.synthetic import generate_invoices
+from categories import classify_all
+from report import SpooledPDF, _row_data, build_invoice_report, layout_rows
+from utils import calculate_total_amount, check_duplicate, invoice_kpis, invoice_table, spending_trends
+
+DEFAULT_SIZES = [100, 10000, 100000]
+# check_duplicate is timed per uploaded invoice: a few lookups, averaged
+DUPLICATE_QUERIES = 3
+
+
+def bench_check_duplicate(invoices, queries):
+    for query in queries:
+        check_duplicate(query["extracted_text"], invoices=invoices)
+
+
+def bench_calculate_total_amount(invoices, queries):
+    calculate_total_amount(invoices)
+
+
+def bench_spending_trends(invoices, queries):
+    for path in spending_trends(silent=True, invoices=invoices):
+        os.remove(path)
+
+
+def bench_wrap_text(invoices, queries):
+    pdf = SpooledPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=10)
+    layout_rows(pdf, (_row_data(invoice) for invoice in invoices))
+
+
+def bench_pdf_report(invoices, queries):
+    build_invoice_report(invoices, {}).close()
+
+
+def bench_dashboard_frames(invoices, queries):
+    invoice_kpis(invoices)
+    invoice_table(invoices)
+
+
+def bench_classify_categories(invoices, queries):
+    classify_all(invoices)
+
+
+CASES = {
+    "check_duplicate": bench_check_duplicate,
+    "calculate_total_amount": bench_calculate_total_amount,
+    "spending_trends": bench_spending_trends,
+    "wrap_text": bench_wrap_text,
+    "pdf_report": bench_pdf_report,
+    "dashboard_frames": bench_dashboard_frames,
+    "classify_categories": bench_classify_categories,
+}
+
+
+def measure(case, invoices, queries, memory=True):
+    """Run one case; returns (seconds, peak traced memory in MiB or None)."""
+    gc.collect()
+    started = time.perf_counter()
+    case(invoices, queries)
+    seconds = time.perf_counter() - started
+    if not memory:
+        return seconds, None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        case(invoices, queries)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / (1024 * 1024)
+
+
+def run(sizes, cases, memory=True, seed=0):
+    results = []
+    for size in sizes:
+        corpus = generate_invoices(size + DUPLICATE_QUERIES, seed=seed)
+        # The last few invoices play the part of new uploads checked against the rest
+        invoices, queries = corpus[:size], corpus[size:]
+        for name in cases:
+            seconds, peak = measure(CASES[name], invoices, queries, memory)
+            if name == "check_duplicate":
+                seconds /= len(queries)
+            results.append({"case": name, "invoices": size, "seconds": seconds, "peak_mib": peak})
+            print(f"{name:<24}{size:>9,}{seconds * 1000:>14.1f} ms"
+                  + (f"{peak:>12.1f} MiB" if peak is not None else ""), flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="corpus sizes to run")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES), help="cases to run")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic corpus")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    print(f"{'case':<24}{'invoices':>9}{'time':>17}" + ("" if args.no_memory else f"{'peak memory':>16}"))
+    results = run(args.sizes, args.cases, memory=not args.no_memory, seed=args.seed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "cpus": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import random
+import string
+from datetime import date, timedelta
+
+from vendors import gstin_checksum
+
+# Store names per category, combined with the city suffixes below for a few hundred distinct stores
+STORES = {
+    "Food": ["Haldiram's", "Sagar Ratna", "Big Bazaar", "Reliance Fresh", "Cafe Coffee Day", "Domino's Pizza",
+             "Barbeque Nation", "More Supermarket", "Theobroma Bakery", "Paradise Biryani"],
+    "Travel": ["IRCTC", "IndiGo Airlines", "Uber India", "Ola Cabs", "Indian Oil Petrol Pump", "Taj Hotels",
+               "MakeMyTrip", "Air India", "RedBus", "HP Petrol Pump"],
+    "Office Supplies": ["Staples India", "Croma", "Reliance Digital", "Classmate Stationery", "Vijay Sales",
+                        "Canon Printer Store", "HP World", "Camlin Stationers"],
+    "Utilities": ["BSES Rajdhani Power", "Tata Power", "Airtel Broadband", "Jio Fiber", "Delhi Jal Board",
+                  "Indraprastha Gas", "BSNL Mobile", "Vodafone Idea"],
+    "Others": ["Apollo Pharmacy", "Lenskart", "Decathlon", "Shoppers Stop", "Urban Company", "Cult Fit"],
+}
+CITIES = ["Delhi", "Mumbai", "Bengaluru", "Chennai", "Kolkata", "Hyderabad", "Pune", "Jaipur"]
+ITEMS = {
+    "Food": ["Veg Thali", "Masala Dosa", "Paneer Tikka", "Cold Coffee", "Bread Loaf", "Basmati Rice 5kg"],
+    "Travel": ["Ticket Fare", "Base Fare", "Fuel Surcharge", "Convenience Fee", "Room Tariff", "Petrol 10L"],
+    "Office Supplies": ["A4 Paper Ream", "Ink Cartridge", "Ball Pen Box", "USB Mouse", "Keyboard", "Stapler"],
+    "Utilities": ["Energy Charges", "Fixed Charges", "Broadband Plan", "Water Charges", "Gas Units", "Late Fee"],
+    "Others": ["Medicines", "Spectacle Frame", "Running Shoes", "Service Charge", "Membership Fee", "Shirt"],
+}
+# Typical invoice size per category (rupees); amounts are drawn log-normally around these
+AMOUNT_SCALE = {"Food": 600, "Travel": 2500, "Office Supplies": 1800, "Utilities": 1500, "Others": 1200}
+
+# Characters OCR commonly confuses
+OCR_CONFUSIONS = {"0": "O", "O": "0", "1": "l", "l": "1", "5": "S", "S": "5", "8": "B", "B": "8", "rn": "m", ",": "."}
+
+
+def random_gstin(rng):
+    """A well-formed GSTIN: state code, PAN, entity number, 'Z' and the check character."""
+    body = (f"{rng.randint(1, 37):02d}"
+            + "".join(rng.choices(string.ascii_uppercase, k=5))
+            + "".join(rng.choices(string.digits, k=4))
+            + rng.choice(string.ascii_uppercase)
+            + rng.choice("123456789")
+            + "Z")
+    return body + gstin_checksum(body)
+
+
+def ocr_noise(text, rng, rate=0.02):
+    """Apply OCR-style errors to text: confused characters, dropped characters and stray spaces."""
+    out = []
+    i = 0
+    while i < len(text):
+        pair = text[i:i + 2]
+        if pair in OCR_CONFUSIONS and rng.random() < rate:
+            out.append(OCR_CONFUSIONS[pair])
+            i += 2
+            continue
+        char = text[i]
+        roll = rng.random()
+        if roll < rate and char in OCR_CONFUSIONS:
+            out.append(OCR_CONFUSIONS[char])
+        elif roll < rate * 1.5:
+            pass
+        elif roll < rate * 2:
+            out.append(char + " ")
+        else:
+            out.append(char)
+        i += 1
+    return "".join(out)
+
+
+def make_stores(rng, count=200):
+    """(store name, category, GSTIN) for a pool of distinct stores."""
+    stores = []
+    for _ in range(count):
+        category = rng.choice(list(STORES))
+        name = f"{rng.choice(STORES[category])} {rng.choice(CITIES)}"
+        stores.append((name, category, random_gstin(rng)))
+    return stores
+
+
+def invoice_text(store, gstin, category, bill_no, invoice_date, rng):
+    """Plain-text body of an invoice as OCR would return it, and its total amount."""
+    lines = [store, f"GSTIN: {gstin}", f"Bill No: {bill_no}", f"Date: {invoice_date:%d/%m/%Y}", ""]
+    total = 0.0
+    for item in rng.sample(ITEMS[category], rng.randint(1, 4)):
+        quantity = rng.randint(1, 5)
+        rate = round(rng.lognormvariate(0, 0.6) * AMOUNT_SCALE[category] / 3, 2)
+        total += quantity * rate
+        lines.append(f"{item}  {quantity} x {rate:,.2f}  {quantity * rate:,.2f}")
+    tax = round(total * 0.18, 2)
+    total = round(total + tax, 2)
+    lines += ["", f"GST 18%  {tax:,.2f}", f"Total Amount  ₹{total:,.2f}", "Thank you for your visit!"]
+    return "\n".join(lines), total
+
+
+def generate_invoices(count, seed=0, duplicate_share=0.02, start=date(2023, 1, 1), days=730):
+    """
+    Generate count synthetic invoices in the shape Home.py saves them (id, store_name, gstin,
+    date, bill_no, total_amount, category, extracted_text). A duplicate_share of them are
+    resubmissions of an earlier invoice with fresh OCR noise. Deterministic for a given seed.
+    """
+    rng = random.Random(seed)
+    stores = make_stores(rng, min(200, max(10, count // 20)))
+    invoices = []
+    for invoice_id in range(1, count + 1):
+        if invoices and rng.random() < duplicate_share:
+            original = rng.choice(invoices)
+            invoice = dict(original, id=invoice_id, extracted_text=ocr_noise(original["clean_text"], rng))
+            invoices.append(invoice)
+            continue
+        store, category, gstin = rng.choice(stores)
+        invoice_date = start + timedelta(days=rng.randrange(days))
+        bill_no = f"{rng.choice(string.ascii_uppercase)}{rng.randint(1000, 999999)}"
+        text, total = invoice_text(store, gstin, category, bill_no, invoice_date, rng)
+        invoices.append({
+            "id": invoice_id,
+            "store_name": store,
+            "gstin": gstin,
+            "date": f"{invoice_date:%d/%m/%Y}",
+            "bill_no": bill_no,
+            "total_amount": f"{total:.2f}",
+            "category": category,
+            "extracted_text": ocr_noise(text, rng),
+            "clean_text": text,
+        })
+    for invoice in invoices:
+        invoice.pop("clean_text", None)
+    return invoices
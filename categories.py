@@ -0,0 +1,99 @@
+"""
+Local invoice category classifier: the keyword table from the extraction prompt compiled into
+one regular expression. The LLM only decides the category when the keywords are ambiguous
+(no hits, or two categories equally likely).
+"""
+import re
+
+import numpy as np
+
+CATEGORY_KEYWORDS = {
+    "Food": ["restaurant", "cafe", "grocery", "food", "beverage", "bakery", "supermarket"],
+    "Travel": ["flight", "airline", "hotel", "taxi", "fuel", "petrol", "Uber", "Ola", "bus", "train"],
+    "Office Supplies": ["stationery", "printer", "ink", "paper", "pen", "laptop", "computer", "mouse", "keyboard"],
+    "Utilities": ["electricity", "water", "internet", "mobile bill", "phone bill", "broadband", "gas"],
+}
+FALLBACK_CATEGORY = "Others"
+# A keyword in the store name counts this many times one in the rest of the text
+STORE_NAME_WEIGHT = 3
+# The winning category needs this share of the keyword weight to be decided locally
+MIN_SHARE = 0.6
+
+
+def compile_keywords(keywords=None):
+    """
+    One alternation with a capture group per category, in table order, matched against
+    lowercased text. The leading lookahead on the keywords' first letters lets the regex
+    engine skip most positions cheaply; it's several times faster than IGNORECASE and \\b alone.
+    """
+    keywords = keywords or CATEGORY_KEYWORDS
+    words = [word.lower() for category_words in keywords.values() for word in category_words]
+    first_letters = re.escape("".join(sorted({word[0] for word in words})))
+    groups = ["(" + "|".join(re.escape(word.lower()) for word in sorted(category_words, key=len, reverse=True)) + ")"
+              for category_words in keywords.values()]
+    return re.compile(r"(?=[" + first_letters + r"])(?<!\w)(?:" + "|".join(groups) + r")\b")
+
+
+_PATTERN = compile_keywords()
+
+
+def keyword_weights(text, store_name="", pattern=_PATTERN):
+    """Keyword hits per category (in table order), store-name hits weighted by STORE_NAME_WEIGHT."""
+    weights = [0] * pattern.groups
+    for source, weight in ((text or "", 1), (store_name or "", STORE_NAME_WEIGHT)):
+        for match in pattern.finditer(source.lower()):
+            weights[match.lastindex - 1] += weight
+    return weights
+
+
+def decide(weights, categories):
+    """The category with at least MIN_SHARE of the weight, else None (ambiguous)."""
+    total = sum(weights)
+    if not total:
+        return None
+    best = max(range(len(weights)), key=weights.__getitem__)
+    return categories[best] if weights[best] >= MIN_SHARE * total else None
+
+
+def classify_category(text, store_name=""):
+    """The invoice's category from its keywords, or None when the LLM should decide."""
+    return decide(keyword_weights(text, store_name), list(CATEGORY_KEYWORDS))
+
+
+def classify_all(invoices, keywords=None):
+    """
+    classify_category for many stored invoices at once: the texts are lowercased and scanned
+    as one string in a single regex pass, matches are mapped back to invoices by offset and
+    the weights summed with NumPy. Returns an object array of categories, None where the
+    keywords don't decide.
+    """
+    keywords = keywords or CATEGORY_KEYWORDS
+    pattern = compile_keywords(keywords)
+    categories = np.array(list(keywords), dtype=object)
+    count = len(invoices)
+    weights = np.zeros((count, len(categories)))
+    for field, weight in (("extracted_text", 1), ("store_name", STORE_NAME_WEIGHT)):
+        texts = [str(invoice.get(field) or "") for invoice in invoices]
+        # Each text is followed by a newline, so no keyword can span two invoices
+        ends = np.cumsum([len(text) + 1 for text in texts])
+        hits = [(match.start(), match.lastindex) for match in pattern.finditer("\n".join(texts).lower())]
+        if hits:
+            starts, groups = np.array(hits).T
+            np.add.at(weights, (np.searchsorted(ends, starts, side="right"), groups - 1), weight)
+    total = weights.sum(axis=1)
+    best = weights.argmax(axis=1)
+    decided = (total > 0) & (weights[np.arange(count), best] >= MIN_SHARE * total)
+    return np.where(decided, categories[best], None)
+
+
+def reclassify_invoices(invoices, keywords=None):
+    """
+    Re-run the keyword rules (e.g. after editing CATEGORY_KEYWORDS) over stored invoices, in
+    place. Invoices the rules can't decide keep their category. Returns how many changed.
+    """
+    changed = 0
+    for invoice, category in zip(invoices, classify_all(invoices, keywords)):
+        if category is not None and invoice.get("category") != category:
+            invoice["category"] = category
+            changed += 1
+    return changed
@@ -0,0 +1,65 @@
+import re
+
+from fuzzywuzzy import fuzz
+
+# Numbers with at least this many digits (amounts, bill numbers, GSTIN digits) block candidates
+MIN_NUMBER_DIGITS = 3
+NUMBER_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+# Numbers on more than this share of invoices (years, tax rates, phone numbers) don't narrow anything down
+COMMON_NUMBER_SHARE = 0.01
+COMMON_NUMBER_MIN = 50
+
+
+def number_tokens(text):
+    """Distinct numbers in an invoice text, commas removed; a re-scan of the same invoice shares most of them."""
+    tokens = set()
+    for match in NUMBER_PATTERN.findall(text or ""):
+        token = match.replace(",", "")
+        if sum(c.isdigit() for c in token) >= MIN_NUMBER_DIGITS:
+            tokens.add(token)
+    return tokens
+
+
+class DuplicateIndex:
+    """
+    Duplicate detection for large invoice sets, with the same similarity test as
+    utils.check_duplicate (fuzz.ratio of the extracted texts). Instead of comparing against
+    every stored invoice, only invoices sharing at least one distinctive number with the new
+    text are compared; texts without any are compared against everything.
+    """
+
+    def __init__(self, invoices=()):
+        self.texts = {}
+        self._order = {}
+        self._by_number = {}
+        for invoice in invoices:
+            self.add(invoice["id"], invoice.get("extracted_text", ""))
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, invoice_id, text):
+        self._order.setdefault(invoice_id, len(self._order))
+        self.texts[invoice_id] = text or ""
+        for token in number_tokens(text):
+            self._by_number.setdefault(token, []).append(invoice_id)
+
+    def candidates(self, text):
+        common = max(COMMON_NUMBER_MIN, COMMON_NUMBER_SHARE * len(self.texts))
+        postings = [self._by_number.get(token, ()) for token in number_tokens(text)]
+        postings = [ids for ids in postings if len(ids) <= common]
+        if not postings:
+            return list(self.texts)
+        ids = set()
+        for posting in postings:
+            ids.update(posting)
+        # Earliest invoice first, as in check_duplicate
+        return sorted(ids, key=self._order.__getitem__)
+
+    def find(self, text, threshold=90):
+        """(invoice id, similarity score) of the first stored invoice at least threshold similar, else (None, 0)."""
+        for invoice_id in self.candidates(text):
+            similarity_score = fuzz.ratio(text, self.texts[invoice_id])
+            if similarity_score >= threshold:
+                return invoice_id, similarity_score
+        return None, 0
@@ -0,0 +1,126 @@
+"""
+Structured output for entity extraction: the JSON response schema Gemini is asked to follow,
+and a validator built from the same field table that coerces the answer into the stored
+formats (DD/MM/YYYY dates, amounts as "1234.50", one of the known categories, an upper-case
+GSTIN). Fields that fail validation are re-asked on their own instead of discarding the answer.
+"""
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
+
+from categories import CATEGORY_KEYWORDS, FALLBACK_CATEGORY
+from vendors import GSTIN_FORMAT
+
+# What the model may answer for a field the invoice doesn't have
+MISSING = "N/A"
+MISSING_VALUES = {"", "n/a", "na", "none", "null", "not found", "not available", "-"}
+CATEGORIES = [*CATEGORY_KEYWORDS, FALLBACK_CATEGORY]
+DATE_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%Y/%m/%d", "%d/%m/%y", "%d-%m-%y",
+                "%d %b %Y", "%d-%b-%Y", "%d %B %Y", "%d-%B-%Y", "%b %d, %Y", "%B %d, %Y", "%d-%b-%y")
+
+FIELD_SCHEMAS = {
+    "store_name": {"type": "string"},
+    "date": {"type": "string", "description": "DD/MM/YYYY"},
+    "bill_no": {"type": "string"},
+    "total_amount": {"type": "number"},
+    "category": {"type": "string", "enum": CATEGORIES},
+    "gstin": {"type": "string"},
+}
+
+
+def response_schema(fields):
+    """Gemini response schema (OpenAPI subset) for a JSON object with the given fields."""
+    return {"type": "object", "properties": {field: FIELD_SCHEMAS[field] for field in fields}, "required": list(fields)}
+
+
+def _missing(value):
+    return value is None or (isinstance(value, str) and value.strip().lower() in MISSING_VALUES)
+
+
+def _text(value):
+    if _missing(value):
+        return MISSING
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError("expected text")
+    return str(value).strip()
+
+
+def _date(value):
+    if _missing(value):
+        return MISSING
+    text = re.sub(r"(\d)(?:st|nd|rd|th)\b", r"\1", str(value).strip())
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime("%d/%m/%Y")
+        except ValueError:
+            continue
+    raise ValueError("not a date")
+
+
+def _amount(value):
+    # A missing total is re-asked: a saved invoice needs a number here
+    if isinstance(value, bool) or value is None:
+        raise ValueError("not an amount")
+    if isinstance(value, str):
+        value = re.sub(r"(?i)₹|rs\.?|inr|,|\s", "", value)
+    amount = float(value)
+    if not 0 <= amount < 1e9:
+        raise ValueError("amount out of range")
+    return f"{amount:.2f}"
+
+
+def _category(value):
+    matches = [category for category in CATEGORIES if category.lower() == str(value).strip().lower()]
+    if not matches:
+        raise ValueError("unknown category")
+    return matches[0]
+
+
+def _gstin(value):
+    if _missing(value):
+        return MISSING
+    gstin = re.sub(r"[\s-]", "", str(value)).upper()
+    if not GSTIN_FORMAT.fullmatch(gstin):
+        raise ValueError("not a GSTIN")
+    return gstin
+
+
+COERCERS = {"store_name": _text, "date": _date, "bill_no": _text, "total_amount": _amount, "category": _category,
+            "gstin": _gstin}
+
+
+@lru_cache(maxsize=64)
+def compile_validator(fields):
+    """
+    Validator for a tuple of fields: takes the model's parsed answer (None if it wasn't JSON)
+    and returns (valid fields coerced to their stored form, {invalid field: value the model
+    gave}). A field missing from the answer is invalid; an explicit "N/A" is not.
+    """
+    coercers = [(field, COERCERS[field]) for field in fields]
+
+    def validate(data):
+        entities, invalid = {}, {}
+        for field, coerce in coercers:
+            if not isinstance(data, dict) or field not in data:
+                # No answer for the field at all (not "N/A"): ask again
+                invalid[field] = None
+                continue
+            value = data[field]
+            try:
+                entities[field] = coerce(value)
+            except (TypeError, ValueError):
+                invalid[field] = value
+        return entities, invalid
+
+    return validate
+
+
+def load_answer(response_text):
+    """The JSON object in the model's answer, or None if there isn't one."""
+    match = re.search(r"\{.*\}", response_text or "", re.DOTALL)
+    try:
+        data = json.loads(match.group(0)) if match else None
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
@@ -0,0 +1,315 @@
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from entity_schema import compile_validator, load_answer, response_schema
+from instrumentation import count, span
+from providers import call_with_retry, get_providers
+from categories import CATEGORY_KEYWORDS, FALLBACK_CATEGORY, classify_category
+from templates import record_audit
+from text_pruning import prune_text
+from vendors import find_gstin
+
+# Fields asked of the LLM and how the prompt describes them
+ENTITY_FIELDS = {
+    "store_name": "Store Name",
+    "date": "Date (if the date is in a different format, convert it to DD/MM/YYYY format)",
+    "bill_no": "Bill Number",
+    "total_amount": "Total Amount",
+    "category": f"Category (choose from: {', '.join([*CATEGORY_KEYWORDS, FALLBACK_CATEGORY])})",
+    "gstin": "GSTIN",
+}
+
+# Returned when the model's answer isn't valid JSON (per field in structured mode, after the re-asks)
+DEFAULT_ENTITIES = {
+    "store_name": "N/A",
+    "date": "N/A",
+    "bill_no": "N/A",
+    "total_amount": "0",
+    "category": "Others",
+    "gstin": "N/A"
+}
+
+# Structured output: a JSON response schema and field-level validation, re-asking only invalid
+# fields (see entity_schema); INVOICE_STRUCTURED_OUTPUT=0 parses free-form JSON answers instead
+STRUCTURED_OUTPUT = os.environ.get("INVOICE_STRUCTURED_OUTPUT", "1") != "0"
+# Re-asks for the fields still invalid before they fall back to DEFAULT_ENTITIES
+REPAIR_ATTEMPTS = 1
+
+# Pages of one PDF rasterized and OCRed at the same time on the shared page pool (Streamlit
+# sessions); the ingestion service and batch CLI size their own from their worker settings
+PDF_PAGE_WORKERS = int(os.environ.get("INVOICE_PDF_PAGE_WORKERS", 4))
+# OCR texts of PDF pages kept across uploads, keyed by document hash and page number
+PAGE_CACHE_SIZE = 256
+# Adaptive OCR: a downscaled grayscale pass first, full resolution only when its text looks incomplete
+ADAPTIVE_OCR = os.environ.get("INVOICE_ADAPTIVE_OCR", "1") != "0"
+LOW_RES_MAX_SIDE = 1600
+# Characters read per megapixel of the low-res pass below which it's treated as a failed read
+MIN_TEXT_DENSITY = 60
+GSTIN_PATTERN = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][0-9A-Z]Z[0-9A-Z]\b")
+TOTAL_PATTERN = re.compile(r"\btotal\b\D{0,40}\d[\d,]*(?:\.\d+)?", re.IGNORECASE)
+DATE_PATTERN = re.compile(r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b|\b\d{4}-\d{2}-\d{2}\b"
+                          r"|\b\d{1,2}(?:st|nd|rd|th)?[ -](?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*[ ,-]+\d{2,4}\b",
+                          re.IGNORECASE)
+
+_page_pool = ThreadPoolExecutor(max_workers=PDF_PAGE_WORKERS, thread_name_prefix="pdf-page")
+_page_cache = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+def rasterize_pdf(data, page=1):
+    """Render one page (the first by default) of a PDF to an image, without rendering the others."""
+    from pdf2image import convert_from_bytes
+    with span("pdf_rasterize"):
+        return convert_from_bytes(data, first_page=page, last_page=page)[0]
+
+
+def pdf_page_count(data):
+    from pdf2image import pdfinfo_from_bytes
+    return pdfinfo_from_bytes(data)["Pages"]
+
+
+def decode_upload(file_name, data):
+    """Image for an uploaded file: the first page of a PDF, otherwise the decoded image."""
+    if file_name.lower().endswith(".pdf"):
+        return rasterize_pdf(data)
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def encode_png(image):
+    """PNG bytes of an image, as sent to the OCR provider."""
+    with span("png_encode"):
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='PNG')
+        return img_byte_arr.getvalue()
+
+
+def extract_text_from_png(png_bytes, providers=None, stage="vision"):
+    """Extract text from an already encoded invoice image."""
+    providers = providers or get_providers()
+    with span(stage):
+        return call_with_retry(providers.ocr.extract_text, png_bytes)
+
+
+def low_res_image(image):
+    """Grayscale copy for the first OCR pass, at most LOW_RES_MAX_SIDE pixels wide or tall; None if already that small."""
+    if max(image.size) <= LOW_RES_MAX_SIDE:
+        return None
+    from PIL import Image
+    low = image.convert("L")
+    low.thumbnail((LOW_RES_MAX_SIDE, LOW_RES_MAX_SIDE), Image.LANCZOS)
+    return low
+
+
+def ocr_looks_complete(text, size):
+    """Whether a low-res read can be trusted: a total and a date were found and the text isn't sparse for the page."""
+    megapixels = size[0] * size[1] / 1e6
+    return bool(TOTAL_PATTERN.search(text) and DATE_PATTERN.search(text)
+                and len(text) >= MIN_TEXT_DENSITY * megapixels)
+
+
+def ocr_payloads(image):
+    """(low-res PNG or None, low-res size, full-resolution PNG) for extract_text_adaptive."""
+    low = low_res_image(image) if ADAPTIVE_OCR else None
+    return (encode_png(low) if low else None), (low.size if low else None), encode_png(image)
+
+
+def pdf_page_payloads(data, page):
+    """Process-pool worker: rasterize one PDF page and return its OCR payloads (see ocr_payloads)."""
+    return ocr_payloads(rasterize_pdf(data, page))
+
+
+def extract_text_adaptive(low_png, low_size, full_png, providers=None):
+    """
+    OCR the low-res payload and fall back to the full-resolution one only when the result
+    fails ocr_looks_complete. full_png may be a function, so it's only encoded when needed.
+    """
+    if low_png is not None:
+        text = extract_text_from_png(low_png, providers, stage="vision_low_res")
+        if ocr_looks_complete(text, low_size):
+            return text
+    return extract_text_from_png(full_png() if callable(full_png) else full_png, providers)
+
+
+def extract_text(image, providers=None, png_bytes=None):
+    """
+    Extract text from an invoice image with the OCR provider (Google Vision by default),
+    adaptively unless INVOICE_ADAPTIVE_OCR=0. png_bytes is the full-resolution PNG if the
+    caller has already encoded it.
+    """
+    low = low_res_image(image) if ADAPTIVE_OCR else None
+    return extract_text_adaptive(encode_png(low) if low else None, low.size if low else None,
+                                 png_bytes or (lambda: encode_png(image)), providers)
+
+
+def has_key_fields(text):
+    """Whether OCR text already shows both a total and a GSTIN, the fields that decide when to stop reading pages."""
+    return bool(TOTAL_PATTERN.search(text) and GSTIN_PATTERN.search(text))
+
+
+def page_order(page_count):
+    """Pages in the order they're read: the first and last (GSTIN and totals live there), then the rest."""
+    return list(dict.fromkeys([1, page_count, *range(2, page_count)]))
+
+
+def _page_text(data, digest, page, providers):
+    """OCR text of one PDF page, rasterized only on a cache miss; the first page's image is always returned."""
+    key = (digest, page)
+    with _page_cache_lock:
+        text = _page_cache.get(key)
+        if text is not None:
+            _page_cache.move_to_end(key)
+    image = None
+    if text is None or page == 1:
+        image = rasterize_pdf(data, page)
+    if text is None:
+        text = extract_text(image, providers)
+        with _page_cache_lock:
+            _page_cache[key] = text
+            while len(_page_cache) > PAGE_CACHE_SIZE:
+                _page_cache.popitem(last=False)
+    return text, image
+
+
+def extract_pdf_text(data, providers=None, page_pool=None):
+    """
+    OCR a PDF of any length. Pages are rasterized and OCRed concurrently on page_pool (the
+    shared page pool by default), first and last page first; pages not started yet are skipped
+    once the first page is in and the text read so far has both a total and a GSTIN. Returns
+    the page texts merged in page order and the first page's image (the one shown and saved
+    with the invoice).
+    """
+    providers = providers or get_providers()
+    digest = hashlib.sha256(data).hexdigest()
+    page_pool = page_pool or _page_pool
+    with span("pdf_pages"):
+        futures = {page_pool.submit(_page_text, data, digest, page, providers): page
+                   for page in page_order(pdf_page_count(data))}
+        texts = {}
+        first_image = None
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = futures[future]
+                    texts[page], image = future.result()
+                    if page == 1:
+                        first_image = image
+                if 1 in texts and has_key_fields("\n".join(texts.values())):
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+    return "\n".join(texts[page] for page in sorted(texts)), first_image
+
+
+def entity_prompt(text, fields=None, rejected=None):
+    """
+    The extraction prompt for the given fields (all of ENTITY_FIELDS by default). rejected
+    maps fields to unusable values from an earlier answer, which the prompt points out.
+    """
+    fields = list(fields or ENTITY_FIELDS)
+    prompt = "\n    Extract the following details from this invoice text:\n"
+    prompt += "".join(f"    - {ENTITY_FIELDS[field]}\n" for field in fields)
+    if "category" in fields:
+        prompt += "\n    Use the following **keywords for category classification**:\n"
+        prompt += "".join(f"    - **{category}**: {', '.join(words)}\n" for category, words in CATEGORY_KEYWORDS.items())
+        prompt += f"    - **{FALLBACK_CATEGORY}**: (use this if no relevant category is found)\n"
+    if rejected:
+        prompt += "\n    An earlier answer had unusable values for these fields; read them from the text again:\n"
+        prompt += "".join(f"    - {field}: {json.dumps(value, ensure_ascii=False)}\n" for field, value in rejected.items())
+    keys = ", ".join(f'"{field}"' for field in fields)
+    return (f"{prompt}\n    Provide ONLY a JSON response with these keys: {keys}.\n"
+            "    Do NOT include any additional text, explanation, or formatting outside of the JSON object.\n\n"
+            f"    Invoice text:\n    {text}\n    ")
+
+
+def parse_entities(response_text):
+    """Pull the JSON object out of the model's answer; falls back to DEFAULT_ENTITIES."""
+    try:
+        json_text = response_text.strip()
+        json_match = re.search(r'\{.*\}', json_text, re.DOTALL)
+        if json_match:
+            json_text = json_match.group(0)
+        return json.loads(json_text)
+    except json.JSONDecodeError:
+        return dict(DEFAULT_ENTITIES)
+
+
+def generate(providers, prompt, **options):
+    """One LLM call (with retries), timed under the LLM's stage: gemini, groq, or llm when routed."""
+    with span(getattr(providers.llm, "stage", "llm")):
+        return call_with_retry(providers.llm.generate, prompt, **options)
+
+
+def request_entities(text, fields, providers):
+    """
+    Ask for the fields with a response schema and validate the answer field by field. Invalid
+    fields (all of them if the answer isn't JSON) are re-asked on their own, up to
+    REPAIR_ATTEMPTS times, and then get their DEFAULT_ENTITIES value.
+    """
+    entities, invalid, rejected = {}, list(fields), None
+    for attempt in range(REPAIR_ATTEMPTS + 1):
+        if attempt:
+            count("entity_repair")
+        answer = generate(providers, entity_prompt(text, invalid, rejected), json_output=True,
+                          schema=response_schema(invalid))
+        valid, rejected = compile_validator(tuple(invalid))(load_answer(answer))
+        entities.update(valid)
+        invalid = list(rejected)
+        if not invalid:
+            break
+    for field in invalid:
+        count("entity_field_fallback")
+        entities[field] = DEFAULT_ENTITIES[field]
+    return entities
+
+
+def extract_entities(text, providers=None, vendors=None, templates=None):
+    """
+    Extract structured invoice data including GSTIN and category prediction with the LLM
+    provider (Gemini by default). The OCR text is pruned to the prompt budget first (see
+    text_pruning). Fields known without the LLM aren't asked for: a known vendor's store name,
+    GSTIN and category when the text has a GSTIN in the vendors registry (see vendors), else
+    the category when the keyword classifier can decide it (see categories). When the vendor's
+    learned template also finds the other fields (see templates), the LLM isn't called at all.
+    With several LLMs configured the call is routed and hedged across them (see routing).
+    In structured mode (the default) the answer is validated per field and only the invalid
+    fields are asked again (see request_entities).
+    """
+    providers = providers or get_providers()
+    known = {}
+    vendor = vendors.lookup(find_gstin(text)) if vendors is not None else None
+    if vendor:
+        known = {"store_name": vendor["store_name"], "gstin": vendor["gstin"]}
+    category = (vendor and vendor["category"]) or classify_category(text)
+    if category:
+        known["category"] = category
+
+    template_fields = None
+    if vendor and templates is not None:
+        # Timed on its own, so the LLM stage only holds real LLM calls
+        with span("template_match"):
+            template_fields = templates.apply(vendor["gstin"], text)
+    if template_fields and "category" in known and not templates.should_audit():
+        return {**known, **template_fields, "extracted_by": "template"}
+
+    fields = [field for field in ENTITY_FIELDS if field not in known]
+    if STRUCTURED_OUTPUT:
+        entities = request_entities(prune_text(text), fields, providers)
+    else:
+        answer = generate(providers, entity_prompt(prune_text(text), fields), json_output=True)
+        entities = parse_entities(answer)
+    if template_fields:
+        record_audit(template_fields, entities)
+    entities.update(known)
+    return entities
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+# Defaults for the daily spending series plotted by utils.spending_trends
+DEFAULT_FREQ = "D"
+DEFAULT_SEASON_LENGTH = 7
+DEFAULT_HORIZON = 30
+# Rolling-origin backtest: number of forecast origins stepped back from the end of the history
+DEFAULT_FOLDS = 3
+# Smoothing levels tried for exponential smoothing; the best one is picked per series
+SES_ALPHAS = np.array([0.1, 0.2, 0.3, 0.5, 0.8])
+# Width of the forecast band in backtest RMSEs (~95% for normal errors)
+BAND_Z = 1.96
+
+
+def series_matrix(invoices_df, by=None, freq=DEFAULT_FREQ):
+    """
+    Turn cleaned invoices (parsed dates, numeric total_amount) into a matrix of spending
+    series on a regular calendar: one row per group (or a single "Total" row when by is None)
+    and one column per period, with zero spending where nothing was invoiced.
+    Returns (labels, periods, values).
+    """
+    dated = invoices_df.dropna(subset=["date"])
+    if dated.empty:
+        return [], pd.DatetimeIndex([]), np.zeros((0, 0))
+    keys = dated[by].astype(str) if by else pd.Series("Total", index=dated.index)
+    table = (dated.groupby([keys, pd.Grouper(key="date", freq=freq)])["total_amount"]
+             .sum()
+             .unstack(fill_value=0.0))
+    periods = pd.date_range(table.columns.min(), table.columns.max(), freq=freq)
+    table = table.reindex(columns=periods, fill_value=0.0)
+    return list(table.index), periods, table.to_numpy(dtype=float)
+
+
+def seasonal_naive(history, horizon, season_length=DEFAULT_SEASON_LENGTH):
+    """Repeat the last full season of every series."""
+    season_length = min(season_length, history.shape[1])
+    last_season = history[:, -season_length:]
+    reps = -(-horizon // season_length)
+    return np.tile(last_season, reps)[:, :horizon]
+
+
+def exponential_smoothing(history, horizon, alphas=SES_ALPHAS):
+    """
+    Simple exponential smoothing for every series at once. The level recursion is run for
+    all smoothing levels in parallel and each series keeps the alpha with the lowest
+    one-step-ahead squared error. Forecasts are flat at the final level.
+    """
+    alphas = alphas[:, None]
+    level = np.repeat(history[None, :, 0], len(alphas), axis=0)
+    sse = np.zeros_like(level)
+    for t in range(1, history.shape[1]):
+        error = history[None, :, t] - level
+        sse += error ** 2
+        level = level + alphas * error
+    best = np.argmin(sse, axis=0)
+    final = level[best, np.arange(history.shape[0])]
+    return np.repeat(final[:, None], horizon, axis=1)
+
+
+def linear_trend(history, horizon):
+    """Least-squares straight line through every series, extrapolated horizon steps ahead."""
+    n = history.shape[1]
+    t = np.arange(n, dtype=float)
+    t_centered = t - t.mean()
+    denominator = (t_centered ** 2).sum() or 1.0
+    slope = (history - history.mean(axis=1, keepdims=True)) @ t_centered / denominator
+    intercept = history.mean(axis=1) - slope * t.mean()
+    future = np.arange(n, n + horizon, dtype=float)
+    return intercept[:, None] + slope[:, None] * future[None, :]
+
+
+MODELS = {
+    "seasonal_naive": lambda history, horizon, season_length: seasonal_naive(history, horizon, season_length),
+    "exponential_smoothing": lambda history, horizon, season_length: exponential_smoothing(history, horizon),
+    "linear_trend": lambda history, horizon, season_length: linear_trend(history, horizon),
+}
+
+
+def backtest(values, horizon, season_length=DEFAULT_SEASON_LENGTH, folds=DEFAULT_FOLDS):
+    """
+    Rolling-origin evaluation: for each origin stepped back from the end of the history,
+    fit every model on the data before it and score the next horizon periods.
+    Returns {model: (mae per series, rmse per series)}; models that can't be evaluated are skipped.
+    """
+    n = values.shape[1]
+    results = {}
+    for name, model in MODELS.items():
+        abs_errors, sq_errors, count = 0.0, 0.0, 0
+        for fold in range(folds, 0, -1):
+            origin = n - fold * horizon
+            if origin < max(season_length, 2):
+                continue
+            actual = values[:, origin:origin + horizon]
+            predicted = np.maximum(model(values[:, :origin], actual.shape[1], season_length), 0.0)
+            abs_errors = abs_errors + np.abs(actual - predicted).sum(axis=1)
+            sq_errors = sq_errors + ((actual - predicted) ** 2).sum(axis=1)
+            count += actual.shape[1]
+        if count:
+            results[name] = (abs_errors / count, np.sqrt(sq_errors / count))
+    return results
+
+
+def forecast_spending(values, horizon=DEFAULT_HORIZON, season_length=DEFAULT_SEASON_LENGTH, folds=DEFAULT_FOLDS):
+    """
+    Forecast every row of a series matrix. The model with the lowest backtest MAE is chosen per
+    series and its backtest RMSE sets the band. Returns a dict with "forecast", "lower" and
+    "upper" arrays (series x horizon), the chosen "model" per series and the backtest "mae".
+    Falls back to exponential smoothing with an in-sample band when the history is too short.
+    """
+    n_series = values.shape[0]
+    scores = backtest(values, horizon, season_length, folds)
+    if scores:
+        names = list(scores)
+        mae = np.vstack([scores[name][0] for name in names])
+        rmse = np.vstack([scores[name][1] for name in names])
+        best = np.argmin(mae, axis=0)
+        rows = np.arange(n_series)
+        chosen = np.array(names, dtype=object)[best]
+        best_mae, best_rmse = mae[best, rows], rmse[best, rows]
+    else:
+        chosen = np.full(n_series, "exponential_smoothing", dtype=object)
+        best_mae = np.full(n_series, np.nan)
+        best_rmse = values.std(axis=1)
+
+    point = np.zeros((n_series, horizon))
+    for name in set(chosen):
+        rows = chosen == name
+        point[rows] = MODELS[name](values[rows], horizon, season_length)
+    point = np.maximum(point, 0.0)
+    band = BAND_Z * best_rmse[:, None]
+    return {
+        "forecast": point,
+        "lower": np.maximum(point - band, 0.0),
+        "upper": point + band,
+        "model": chosen,
+        "mae": best_mae,
+    }
+
+
+def forecast_frame(invoices_df, by=None, freq=DEFAULT_FREQ, horizon=DEFAULT_HORIZON,
+                   season_length=DEFAULT_SEASON_LENGTH, folds=DEFAULT_FOLDS):
+    """
+    Forecast spending per group (e.g. by="store_name" or by="category") or in total.
+    Returns a long DataFrame with one row per group and future period.
+    """
+    labels, periods, values = series_matrix(invoices_df, by, freq)
+    if not labels:
+        return pd.DataFrame(columns=["group", "date", "forecast", "lower", "upper", "model"])
+    result = forecast_spending(values, horizon, season_length, folds)
+    future = pd.date_range(periods[-1], periods=horizon + 1, freq=freq)[1:]
+    return pd.DataFrame({
+        "group": np.repeat(labels, horizon),
+        "date": np.tile(future, len(labels)),
+        "forecast": result["forecast"].ravel(),
+        "lower": result["lower"].ravel(),
+        "upper": result["upper"].ravel(),
+        "model": np.repeat(result["model"], horizon),
+    })
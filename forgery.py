@@ -0,0 +1,225 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# Images are screened at this size; tampering shows up in block statistics long before full resolution
+SCREEN_MAX_SIDE = 1024
+# Error-level analysis: recompress at this JPEG quality and look at what changes
+ELA_QUALITY = 90
+# Statistics are computed over square blocks of this many pixels
+BLOCK_SIZE = 16
+# Blocks with less texture than this (mean gradient, 0-255 scale) are blank paper and skipped by ELA
+MIN_TEXTURE = 2.0
+# Pixels with a gradient above this multiple of the image's median gradient are edges (text, lines)
+# and don't count towards the noise level
+FLAT_GRADIENT_FACTOR = 1.5
+# Blocks with fewer flat pixels than this share have no reliable noise level
+MIN_FLAT_SHARE = 0.25
+# A block whose noise level differs from the image's by this factor either way is inconsistent
+NOISE_RATIO = 2.0
+# Added to noise levels (grey levels) so near-noiseless scans don't divide by zero
+NOISE_FLOOR = 0.25
+# Robust z-score above which a block's compression error level is inconsistent with the image
+BLOCK_Z = 3.5
+# MAD floor as a fraction of the median, so very uniform scans don't turn every wobble into an outlier
+MAD_FLOOR_FRACTION = 0.1
+# Regions are measured in windows of REGION_BLOCKS x REGION_BLOCKS blocks
+REGION_BLOCKS = 4
+# Share of inconsistent blocks in the densest region above which an invoice is flagged / sent for a second opinion
+FORGED_REGION_SHARE = 0.6
+ESCALATE_REGION_SHARE = 0.35
+# Perceptual fingerprints: difference hash of an (N+1) x N thumbnail, and the largest
+# Hamming distance at which two images count as the same invoice
+FINGERPRINT_SIZE = 8
+DUPLICATE_MAX_DISTANCE = 6
+# Mean intensity (0-255) of a remote ManTra-Net heatmap above which an invoice is flagged
+HEATMAP_THRESHOLD = 150
+
+REPLICATE_MODEL = "highwaywu/image-forgery-detection:ab6f81afdf0de95354d44b61c18f4dfe31dc0ad83da8b0406d57afff8f6ace08"
+
+
+def _screen_image(image, mode="L"):
+    """Copy of the image in the given mode, downscaled so its longest side is at most SCREEN_MAX_SIDE."""
+    image = image.convert(mode)
+    scale = SCREEN_MAX_SIDE / max(image.size)
+    if scale < 1:
+        # Box filtering averages the scan noise the same way everywhere, which is all screening needs
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BOX)
+    return image
+
+
+def ela_map(image, quality=ELA_QUALITY):
+    """Per-pixel error level: how much a grayscale image changes after one more round of JPEG compression."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    buffer.seek(0)
+    original = np.asarray(image, dtype=np.int16)
+    recompressed = np.asarray(Image.open(buffer), dtype=np.int16)
+    return np.abs(original - recompressed).astype(np.float32)
+
+
+def noise_map(gray):
+    """Per-pixel noise residual: the grayscale image minus its 3x3 box blur."""
+    padded = np.pad(gray, 1, mode="edge")
+    blurred = sum(padded[dy:dy + gray.shape[0], dx:dx + gray.shape[1]] for dy in range(3) for dx in range(3)) / 9.0
+    return np.abs(gray - blurred)
+
+
+def gradient_map(gray):
+    """Per-pixel gradient magnitude (sum of absolute horizontal and vertical differences)."""
+    gradient = np.zeros_like(gray)
+    gradient[:, :-1] += np.abs(np.diff(gray, axis=1))
+    gradient[:-1, :] += np.abs(np.diff(gray, axis=0))
+    return gradient
+
+
+def _tiles(values, block):
+    # (rows, cols, block * block) view; partial tiles at the right and bottom edges are dropped
+    rows, cols = values.shape[0] // block, values.shape[1] // block
+    tiles = values[:rows * block, :cols * block].reshape(rows, block, cols, block)
+    return tiles.transpose(0, 2, 1, 3).reshape(rows, cols, block * block)
+
+
+def block_means(values, block=BLOCK_SIZE):
+    """Mean of each block x block tile."""
+    return _tiles(values, block).mean(axis=2)
+
+
+def block_noise(residual, gradient, block=BLOCK_SIZE):
+    """
+    Noise level of each block: the median residual over its flat pixels, so text strokes
+    and their halos don't count. Returns (levels, mask of blocks with enough flat pixels to measure).
+    """
+    flat = _tiles(gradient, block) <= FLAT_GRADIENT_FACTOR * np.median(gradient)
+    flat_count = flat.sum(axis=2)
+    # Edge pixels sort to the end, so the flat median sits at flat_count // 2 in every block
+    values = np.sort(np.where(flat, _tiles(residual, block), np.inf), axis=2)
+    levels = np.take_along_axis(values, (flat_count // 2)[:, :, None], axis=2)[:, :, 0]
+    measurable = flat_count >= MIN_FLAT_SHARE * block * block
+    return np.where(measurable, levels, 0.0), measurable
+
+
+def robust_z(values, mask):
+    """Robust z-score of each block against the median and MAD of the masked blocks."""
+    if not mask.any():
+        return np.zeros_like(values)
+    median = np.median(values[mask])
+    mad = max(np.median(np.abs(values[mask] - median)), MAD_FLOOR_FRACTION * abs(median), 1e-6)
+    return np.where(mask, 0.6745 * (values - median) / mad, 0.0)
+
+
+def noise_heat(levels, mask):
+    """Inconsistency of each block's noise level on the BLOCK_Z scale: NOISE_RATIO times off scores BLOCK_Z."""
+    if not mask.any():
+        return np.zeros_like(levels)
+    ratio = np.log((levels + NOISE_FLOOR) / (np.median(levels[mask]) + NOISE_FLOOR))
+    return np.where(mask, BLOCK_Z * np.abs(ratio) / np.log(NOISE_RATIO), 0.0)
+
+
+def densest_region(suspicious, size=REGION_BLOCKS):
+    """Largest share of suspicious blocks in any size x size window, and that window's (row, col)."""
+    rows, cols = suspicious.shape
+    size = min(size, rows, cols)
+    if size == 0:
+        return 0.0, (0, 0)
+    # Integral image: every window sum in one vectorized expression
+    integral = np.pad(suspicious.astype(np.int32).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    sums = integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+    row, col = np.unravel_index(np.argmax(sums), sums.shape)
+    return sums[row, col] / (size * size), (int(row), int(col))
+
+
+def screen_invoice(image):
+    """
+    Screen an invoice image for local tampering. Compression error levels (ELA) are averaged
+    over textured blocks and normalised by the block's texture, so text compares fairly with
+    text; the noise level (median residual over flat pixels) is compared over every block, since paper grain
+    should be the same across a scan. Blocks inconsistent with the rest of the image in either
+    measure are marked, and a pasted or edited area shows up as a tight cluster of them.
+
+    Returns a dict with the block "heatmap" (0-255 uint8), the "suspicious_share" of textured
+    blocks, the "region_share" and "region" (block row, col) of the densest cluster, and the
+    verdicts "forged" and "escalate" (worth a second opinion from the remote model).
+    """
+    image = _screen_image(image)
+    gray = np.asarray(image, dtype=np.float32)
+    gradient = gradient_map(gray)
+    texture = block_means(gradient)
+    textured = texture >= MIN_TEXTURE
+    ela = block_means(ela_map(image)) / np.maximum(texture, MIN_TEXTURE)
+    noise, measurable = block_noise(noise_map(gray), gradient)
+
+    # Too little noise is as suspicious as too much: a clean patch pasted onto a grainy scan
+    heat = np.maximum(robust_z(ela, textured), noise_heat(noise, measurable))
+    suspicious = heat > BLOCK_Z
+    region_share, region = densest_region(suspicious)
+    return {
+        "heatmap": np.clip(heat / (2 * BLOCK_Z) * 255, 0, 255).astype(np.uint8),
+        "suspicious_share": float(suspicious.sum() / max(textured.sum(), 1)),
+        "region_share": float(region_share),
+        "region": region,
+        "forged": region_share >= FORGED_REGION_SHARE,
+        "escalate": ESCALATE_REGION_SHARE <= region_share < FORGED_REGION_SHARE,
+    }
+
+
+def heatmap_image(result, size):
+    """Block heatmap from screen_invoice scaled up to the given (width, height) for display."""
+    if result["heatmap"].size == 0:
+        return Image.new("L", size, 0)
+    return Image.fromarray(result["heatmap"], mode="L").resize(size, Image.NEAREST)
+
+
+def heatmap_intensity(heatmap):
+    """Mean grayscale intensity (0-255) of a heatmap image."""
+    return float(np.asarray(heatmap.convert("L"), dtype=np.float32).mean())
+
+
+def image_fingerprint(image, size=FINGERPRINT_SIZE):
+    """Difference hash: one bit per neighbouring pixel pair of a small grayscale thumbnail."""
+    thumbnail = np.asarray(image.convert("L").resize((size + 1, size), Image.BOX), dtype=np.int16)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def find_duplicate_image(image, fingerprints, max_distance=DUPLICATE_MAX_DISTANCE):
+    """
+    Closest stored invoice by fingerprint, given {invoice_id: fingerprint}.
+    Returns (invoice_id, distance), or (None, None) if none is within max_distance.
+    """
+    fingerprint = image_fingerprint(image)
+    best_id, best_distance = None, None
+    for invoice_id, other in fingerprints.items():
+        distance = bin(fingerprint ^ other).count("1")
+        if distance <= max_distance and (best_distance is None or distance < best_distance):
+            best_id, best_distance = invoice_id, distance
+    return best_id, best_distance
+
+
+def load_heatmap(output):
+    """Turn a Replicate output (file-like, URL or PIL image) into a PIL image, downloading it at most once."""
+    if isinstance(output, Image.Image):
+        return output
+    if hasattr(output, "read"):
+        return Image.open(io.BytesIO(output.read()))
+    import requests
+    response = requests.get(str(output), timeout=30)
+    response.raise_for_status()
+    return Image.open(io.BytesIO(response.content))
+
+
+def detect_forgery_replicate(image, api_token, model=REPLICATE_MODEL):
+    """
+    Second opinion from the ManTra-Net model on Replicate. Returns (heatmap image, mean intensity).
+    Sends a JPEG of the screening-size image rather than a full-resolution PNG.
+    """
+    import base64
+    import replicate
+
+    buffered = io.BytesIO()
+    _screen_image(image, "RGB").save(buffered, format="JPEG", quality=95)
+    data_url = "data:image/jpeg;base64," + base64.b64encode(buffered.getvalue()).decode("utf-8")
+    output = replicate.Client(api_token=api_token).run(model, input={"image": data_url})
+    heatmap = load_heatmap(output)
+    return heatmap, heatmap_intensity(heatmap)
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from providers import call_with_retry, get_providers
+
+# Revised prompt: provide insights and recommendations relevant to the client's spending patterns.
+INSIGHTS_PROMPT = (
+    "Analyze the following invoice data and provide 5 to 10 bullet-point insights along with actionable recommendations for the client. "
+    "Focus on identifying key spending trends, anomalies, and cost drivers, and include only those insights that are directly useful for "
+    "making financial decisions (e.g., high spending areas, opportunities for vendor negotiation, unusual spikes in costs). "
+    "Exclude suggestions about internal data standardization, invoice formatting issues, or unclear notations unless they significantly impact "
+    "the spending or payment process. Output only bullet points.\n\n"
+    "Invoice Data:\n"
+)
+
+# Map step: condense one slice of a large invoice set into notes for the final analysis
+CHUNK_SUMMARY_PROMPT = (
+    "Summarize the following invoice statistics for one period of a larger invoice history in at most 8 short bullet points. "
+    "Keep concrete figures (amounts, stores, categories, dates) for the biggest cost drivers, spikes and outliers.\n\n"
+    "Invoice Data:\n"
+)
+
+# Reduce step: merge the per-period notes with the overall statistics
+MERGE_PROMPT_HEADER = "Period summaries:\n"
+
+# Incremental update: refresh the previous analysis with only what changed since it was written
+DELTA_PROMPT = (
+    "Below is your previous analysis of a client's invoices, followed by the invoices added or changed since it was written. "
+    "Update the analysis so it covers all of the data: keep insights that still hold, revise figures the new invoices affect, "
+    "and add any new trends, anomalies or cost drivers they reveal. Output only 5 to 10 bullet points with actionable recommendations.\n\n"
+)
+
+# Rough upper bound on prompt tokens spent on invoice statistics (about 4 characters per token)
+DEFAULT_TOKEN_BUDGET = 3000
+CHARS_PER_TOKEN = 4
+
+# Above this many invoices the statistics are summarized per period in parallel and then merged
+MAP_REDUCE_THRESHOLD = 5000
+MAX_CHUNKS = 8
+
+# Deltas larger than this are cheaper to analyze from fresh statistics than row by row
+MAX_DELTA_INVOICES = 200
+
+# Gemini calls run here so the Dashboard can render KPIs and charts without waiting on them
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ai-insights")
+# Separate pool for map-step calls so an insights job never waits on its own pool
+_map_executor = ThreadPoolExecutor(max_workers=MAX_CHUNKS, thread_name_prefix="ai-insights-map")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate used to keep prompts inside the budget."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def prepare_invoice_frame(invoices):
+    """Build a DataFrame with parsed dates and numeric amounts, without the raw OCR text."""
+    invoice_df = pd.DataFrame(invoices)
+    for column in ["store_name", "category", "date", "total_amount"]:
+        if column not in invoice_df:
+            invoice_df[column] = None
+    invoice_df = invoice_df.drop(columns=["extracted_text"], errors="ignore")
+    invoice_df["store_name"] = invoice_df["store_name"].fillna("N/A").astype(str)
+    invoice_df["category"] = invoice_df["category"].fillna("Others").astype(str)
+    invoice_df["date"] = pd.to_datetime(invoice_df["date"].astype(str), format="%d/%m/%Y", errors="coerce")
+    invoice_df["total_amount"] = pd.to_numeric(invoice_df["total_amount"], errors="coerce").fillna(0.0)
+    return invoice_df
+
+
+def _group_table(invoice_df, column, limit):
+    table = (invoice_df.groupby(column)["total_amount"]
+             .agg(invoices="count", total="sum", average="mean")
+             .sort_values("total", ascending=False))
+    return table.head(limit).round(2)
+
+
+def build_statistics_tables(invoice_df, row_limit=20):
+    """
+    Aggregate invoices into the tables sent to Gemini, most important first.
+    Returns a list of (title, DataFrame) pairs; row_limit caps the longer tables.
+    """
+    amounts = invoice_df["total_amount"]
+    overview = pd.DataFrame([{
+        "invoices": len(invoice_df),
+        "total": round(amounts.sum(), 2),
+        "average": round(amounts.mean(), 2) if len(invoice_df) else 0.0,
+        "median": round(amounts.median(), 2) if len(invoice_df) else 0.0,
+        "first_date": invoice_df["date"].min(),
+        "last_date": invoice_df["date"].max(),
+    }])
+
+    dated = invoice_df.dropna(subset=["date"])
+    monthly = (dated.groupby(dated["date"].dt.to_period("M"))["total_amount"]
+               .agg(invoices="count", total="sum")
+               .round(2)
+               .tail(row_limit))
+
+    # Outliers relative to the typical invoice in the same category
+    category_median = invoice_df.groupby("category")["total_amount"].transform("median")
+    outliers = invoice_df.assign(times_category_median=(amounts / category_median.where(category_median > 0)).round(1))
+    outliers = (outliers.sort_values("total_amount", ascending=False)
+                .head(row_limit)[["date", "store_name", "category", "total_amount", "times_category_median"]])
+    outliers["date"] = outliers["date"].dt.strftime("%d/%m/%Y")
+    outliers = outliers.round({"total_amount": 2}).reset_index(drop=True)
+
+    return [
+        ("Overview", overview),
+        ("Spending by category", _group_table(invoice_df, "category", row_limit)),
+        ("Spending by month", monthly),
+        ("Spending by store", _group_table(invoice_df, "store_name", row_limit)),
+        ("Largest invoices", outliers),
+    ]
+
+
+def render_statistics(invoice_df, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Render the statistics tables as text, trimming table rows until they fit the token budget."""
+    row_limit = 20
+    while True:
+        sections = [f"{title}:\n{table.to_string()}" for title, table in build_statistics_tables(invoice_df, row_limit)]
+        text = "\n\n".join(sections)
+        if estimate_tokens(text) <= token_budget or row_limit <= 1:
+            break
+        row_limit //= 2
+
+    # Drop trailing (least important) sections if even the smallest tables don't fit
+    while estimate_tokens(text) > token_budget and len(sections) > 1:
+        sections.pop()
+        text = "\n\n".join(sections)
+    return text
+
+
+def build_insights_prompt(invoices, prompt=INSIGHTS_PROMPT, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Build a statistics-first insights prompt whose size does not grow with the invoice count."""
+    return prompt + render_statistics(prepare_invoice_frame(invoices), token_budget)
+
+
+def split_into_chunks(invoice_df, max_chunks=MAX_CHUNKS):
+    """Split a large invoice frame into at most max_chunks consecutive date ranges."""
+    invoice_df = invoice_df.sort_values("date", na_position="last")
+    chunk_size = math.ceil(len(invoice_df) / max_chunks)
+    return [invoice_df.iloc[start:start + chunk_size] for start in range(0, len(invoice_df), chunk_size)]
+
+
+def _generate(prompt):
+    return call_with_retry(get_providers().llm.generate, prompt).strip()
+
+
+def insights_cache_key(invoices, prompt=INSIGHTS_PROMPT):
+    """Return a stable hash of the invoice data and the prompt used to analyze it."""
+    digest = hashlib.sha256(prompt.encode("utf-8"))
+    digest.update(json.dumps(invoices, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def generate_ai_insights(invoices, prompt=INSIGHTS_PROMPT, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Ask Gemini for bullet-point insights on the given invoices (blocking).
+    Large invoice sets are summarized per period in parallel and the summaries merged.
+    """
+    if not invoices:
+        return "No data available for insights."
+
+    invoice_df = prepare_invoice_frame(invoices)
+    if len(invoice_df) <= MAP_REDUCE_THRESHOLD:
+        return _generate(prompt + render_statistics(invoice_df, token_budget))
+
+    # Map: each period gets an equal share of the budget, so the merge prompt stays bounded
+    chunks = split_into_chunks(invoice_df)
+    chunk_budget = max(token_budget // len(chunks), 200)
+    chunk_prompts = [CHUNK_SUMMARY_PROMPT + render_statistics(chunk, chunk_budget) for chunk in chunks]
+    summaries = list(_map_executor.map(_generate, chunk_prompts))
+
+    # Reduce: overall statistics plus the period notes in date order
+    period_notes = "\n\n".join(
+        f"Period {i + 1} ({_date_range(chunk)}):\n{summary}" for i, (chunk, summary) in enumerate(zip(chunks, summaries))
+    )
+    return _generate(prompt + render_statistics(invoice_df, token_budget) + "\n\n" + MERGE_PROMPT_HEADER + period_notes)
+
+
+def _date_range(invoice_df):
+    dates = invoice_df["date"].dropna()
+    if dates.empty:
+        return "undated"
+    return f"{dates.min():%d/%m/%Y} - {dates.max():%d/%m/%Y}"
+
+
+def invoice_versions(invoices):
+    """Map each invoice ID to a hash of its contents; this is the data version an analysis covers."""
+    return {
+        str(invoice.get("id", index)): hashlib.sha256(
+            json.dumps(invoice, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        for index, invoice in enumerate(invoices)
+    }
+
+
+def diff_versions(previous, invoices):
+    """Return (new or changed invoices, number of removed invoices) relative to a previous data version."""
+    current = invoice_versions(invoices)
+    changed = [invoice for invoice, (invoice_id, version) in zip(invoices, current.items())
+               if previous.get(invoice_id) != version]
+    removed = len(previous.keys() - current.keys())
+    return changed, removed
+
+
+def generate_incremental_insights(previous_summary, invoices, changed, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Ask Gemini to update a previous analysis given only the new or changed invoices (blocking)."""
+    changed_df = prepare_invoice_frame(changed)
+    changed_df["date"] = changed_df["date"].dt.strftime("%d/%m/%Y")
+    changed_text = changed_df[["date", "store_name", "category", "total_amount"]].round(2).to_string(index=False)
+    overview = build_statistics_tables(prepare_invoice_frame(invoices), row_limit=1)[0][1]
+    prompt = (
+        DELTA_PROMPT
+        + f"Previous analysis:\n{previous_summary}\n\n"
+        + f"Current overview of all invoices:\n{overview.to_string(index=False)}\n\n"
+        + f"New or changed invoices ({len(changed)}):\n{changed_text}"
+    )
+    return _generate(prompt)
+
+
+def delta_applies(changed, removed, invoices):
+    """
+    True when the previous analysis can be patched: nothing it covered is gone (an update can't
+    reliably take removed invoices back out of it) and a small, non-empty share changed.
+    """
+    return not removed and 0 < len(changed) <= MAX_DELTA_INVOICES and len(changed) < len(invoices)
+
+
+def insights_scope(**filters):
+    """
+    Stable name for a Dashboard filter selection (unset filters left out, so no filters is
+    ALL_INVOICES). Each scope keeps its own baseline: a filtered view is only ever compared
+    with an earlier analysis of the same view.
+    """
+    return json.dumps({name: value for name, value in filters.items() if value is not None}, sort_keys=True, default=str)
+
+
+ALL_INVOICES = insights_scope()
+
+
+def _run_insights_job(invoices, baseline, scope):
+    """Background job: update the baseline analysis when only a small delta was added or changed, otherwise start over."""
+    if baseline and invoices:
+        changed, removed = diff_versions(baseline["versions"], invoices)
+        if delta_applies(changed, removed, invoices):
+            summary = generate_incremental_insights(baseline["summary"], invoices, changed)
+            return {"summary": summary, "versions": invoice_versions(invoices), "scope": scope}
+    return {"summary": generate_ai_insights(invoices), "versions": invoice_versions(invoices), "scope": scope}
+
+
+def pending_changes(state, invoices, scope=ALL_INVOICES):
+    """
+    Describe how the current invoices differ from the scope's last analysis.
+    Returns (previous summary, new or changed count, removed count), or None if nothing was analyzed yet.
+    """
+    baseline = state.get("insights_baselines", {}).get(scope)
+    if not baseline:
+        return None
+    changed, removed = diff_versions(baseline["versions"], invoices)
+    return baseline["summary"], len(changed), removed
+
+
+def request_insights(state, invoices, scope=ALL_INVOICES):
+    """
+    Start generating insights for the invoices in the background unless a cached
+    result or a running job already exists for the same data. scope names the filter
+    selection the invoices come from (see insights_scope). Returns the cache key.
+    """
+    cache = state.setdefault("insights_cache", {})
+    jobs = state.setdefault("insights_jobs", {})
+    key = insights_cache_key(invoices)
+    if key not in cache and key not in jobs:
+        # Snapshot the invoices so later uploads don't change what the job sees
+        snapshot = [dict(inv) for inv in invoices]
+        baseline = state.get("insights_baselines", {}).get(scope)
+        jobs[key] = _executor.submit(_run_insights_job, snapshot, baseline, scope)
+    return key
+
+
+def get_insights(state, key):
+    """
+    Look up insights for a cache key, collecting finished background jobs.
+    Returns (status, result) where status is "ready", "pending", "error" or "missing".
+    """
+    cache = state.setdefault("insights_cache", {})
+    jobs = state.setdefault("insights_jobs", {})
+    if key in cache:
+        return "ready", cache[key]
+    future = jobs.get(key)
+    if future is None:
+        return "missing", None
+    if not future.done():
+        return "pending", None
+    del jobs[key]
+    try:
+        result = future.result()
+    except Exception as e:
+        return "error", str(e)
+    cache[key] = result["summary"]
+    # Later requests for the same view only send what changed since this analysis
+    state.setdefault("insights_baselines", {})[result["scope"]] = result
+    return "ready", cache[key]
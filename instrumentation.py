@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Set INVOICE_METRICS=1 to record stage timings; INVOICE_METRICS_PORT also serves them over HTTP
+ENV_ENABLED = "INVOICE_METRICS"
+ENV_PORT = "INVOICE_METRICS_PORT"
+# Histogram bucket upper bounds in seconds, from a fast duplicate scan to a slow API call
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Most recent spans kept for the debug panel
+RECENT_SPANS = 200
+METRIC_NAME = "invoice_stage_duration_seconds"
+EVENT_METRIC_NAME = "invoice_events_total"
+
+_enabled = os.environ.get(ENV_ENABLED, "").lower() in ("1", "true", "yes") or bool(os.environ.get(ENV_PORT))
+_lock = threading.Lock()
+# stage -> [bucket counts..., +Inf count], sum, count
+_histograms = {}
+_recent = deque(maxlen=RECENT_SPANS)
+# event -> count, for outcomes that have no duration (cache hits, fallbacks)
+_counters = {}
+_server = None
+
+
+def enabled():
+    return _enabled
+
+
+def enable(flag=True):
+    """Turn recording on or off at runtime."""
+    global _enabled
+    _enabled = flag
+
+
+def record(stage, seconds):
+    """Add one duration (in seconds) to a stage's histogram."""
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0}
+        histogram["buckets"][bisect_left(BUCKETS, seconds)] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+        _recent.append((time.time(), stage, seconds))
+
+
+def count(event, amount=1):
+    """Count an event (e.g. a template hit); a no-op when recording is off."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[event] = _counters.get(event, 0) + amount
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(stage):
+    """Context manager timing a block as one stage; a shared no-op when recording is off."""
+    return _Span(stage) if _enabled else _NO_SPAN
+
+
+def timed(stage):
+    """Decorator timing every call of a function as one stage."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _quantile(histogram, q):
+    # Upper bound of the bucket holding the q-th observation, as Prometheus' histogram_quantile does
+    target = q * histogram["count"]
+    seen = 0
+    for bound, count in zip(BUCKETS + (float("inf"),), histogram["buckets"]):
+        seen += count
+        if seen >= target:
+            return bound
+    return float("inf")
+
+
+def snapshot():
+    """Per-stage summaries: {stage: {"count", "sum", "mean", "p50", "p95", "buckets"}}."""
+    with _lock:
+        histograms = {stage: dict(h, buckets=list(h["buckets"])) for stage, h in _histograms.items()}
+    return {
+        stage: {
+            "count": h["count"],
+            "sum": h["sum"],
+            "mean": h["sum"] / h["count"],
+            "p50": _quantile(h, 0.5),
+            "p95": _quantile(h, 0.95),
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h["buckets"])),
+        }
+        for stage, h in histograms.items()
+    }
+
+
+def recent_spans(limit=RECENT_SPANS):
+    """The most recent (timestamp, stage, seconds) spans, newest first."""
+    with _lock:
+        spans = list(_recent)
+    return spans[::-1][:limit]
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _recent.clear()
+        _counters.clear()
+
+
+def prometheus_text():
+    """All stage histograms in the Prometheus text exposition format."""
+    lines = [f"# HELP {METRIC_NAME} Time spent in each invoice ingestion stage.",
+             f"# TYPE {METRIC_NAME} histogram"]
+    with _lock:
+        histograms = sorted((stage, dict(h, buckets=list(h["buckets"]))) for stage, h in _histograms.items())
+    for stage, h in histograms:
+        cumulative = 0
+        for bound, count in zip([str(b) for b in BUCKETS] + ["+Inf"], h["buckets"]):
+            cumulative += count
+            lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {h["sum"]}')
+        lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {h["count"]}')
+    events = sorted(counters().items())
+    if events:
+        lines += [f"# HELP {EVENT_METRIC_NAME} Ingestion events such as template hits and fallbacks.",
+                  f"# TYPE {EVENT_METRIC_NAME} counter"]
+        lines += [f'{EVENT_METRIC_NAME}{{event="{event}"}} {value}' for event, value in events]
+    return "\n".join(lines) + "\n"
+
+
+def json_text():
+    return json.dumps({"stages": snapshot(), "events": counters()}, indent=2)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = prometheus_text(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json_text(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port=None):
+    """
+    Serve /metrics (Prometheus text) and /metrics.json from a background thread.
+    The port defaults to INVOICE_METRICS_PORT; does nothing if neither is set or it's already running.
+    """
+    global _server
+    port = port or os.environ.get(ENV_PORT)
+    with _lock:
+        if _server is not None or not port:
+            return _server
+        _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="invoice-metrics", daemon=True).start()
+    return _server
@@ -0,0 +1,188 @@
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+
+def parse_invoice_date(value):
+    """Parse a DD/MM/YYYY invoice date; returns None for missing or malformed dates."""
+    try:
+        day, month, year = str(value).strip().split("/")
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def parse_amount(value):
+    """Parse an invoice total; returns None if it isn't a number."""
+    try:
+        return float(str(value).replace(",", "").replace("₹", "").strip())
+    except ValueError:
+        return None
+
+
+def normalize_key(value):
+    """Case- and whitespace-insensitive key used by the store and category indexes."""
+    return " ".join(str(value or "").split()).casefold()
+
+
+def normalize_gstin(value):
+    return "".join(str(value or "").split()).upper()
+
+
+class InvoiceIndex:
+    """
+    Secondary indexes over a list of invoice dicts, kept up to date as invoices are added.
+
+    Dates and amounts are kept in sorted key lists searched with bisect; stores, categories
+    and GSTINs in inverted indexes (key -> positions). A query starts from the filter that
+    matches the fewest invoices and checks the remaining filters only on those candidates,
+    so its cost follows the number of matches rather than the size of the invoice set.
+    """
+
+    def __init__(self, invoices=()):
+        self.invoices = []
+        # Per-position parsed values, used to check filters on candidates
+        self._dates, self._amounts = [], []
+        self._store_keys, self._category_keys, self._gstins = [], [], []
+        # Sorted (value, position) keys with the positions alongside
+        self._date_keys, self._date_positions = [], []
+        self._amount_keys, self._amount_positions = [], []
+        # Inverted indexes: normalized value -> positions
+        self._by_store, self._by_category, self._by_gstin = {}, {}, {}
+        for invoice in invoices:
+            self.add(invoice, keep_sorted=False)
+        # Bulk loads sort once instead of inserting every key in order
+        self._date_keys.sort()
+        self._date_positions = [position for _, position in self._date_keys]
+        self._amount_keys.sort()
+        self._amount_positions = [position for _, position in self._amount_keys]
+
+    def __len__(self):
+        return len(self.invoices)
+
+    def add(self, invoice, keep_sorted=True):
+        """Index one more invoice (appended after the existing ones)."""
+        position = len(self.invoices)
+        self.invoices.append(invoice)
+
+        invoice_date = parse_invoice_date(invoice.get("date"))
+        ordinal = invoice_date.toordinal() if invoice_date is not None else None
+        self._dates.append(ordinal)
+        if ordinal is not None:
+            self._insert(self._date_keys, self._date_positions, (ordinal, position), keep_sorted)
+
+        amount = parse_amount(invoice.get("total_amount"))
+        self._amounts.append(amount)
+        if amount is not None:
+            self._insert(self._amount_keys, self._amount_positions, (amount, position), keep_sorted)
+
+        store = normalize_key(invoice.get("store_name"))
+        category = normalize_key(invoice.get("category"))
+        gstin = normalize_gstin(invoice.get("gstin"))
+        self._store_keys.append(store)
+        self._category_keys.append(category)
+        self._gstins.append(gstin)
+        self._by_store.setdefault(store, []).append(position)
+        self._by_category.setdefault(category, []).append(position)
+        if gstin:
+            self._by_gstin.setdefault(gstin, []).append(position)
+
+    @staticmethod
+    def _insert(keys, positions, key, keep_sorted):
+        if not keep_sorted:
+            keys.append(key)
+            return
+        # (value, position) keys keep equal values in insertion order
+        index = bisect_right(keys, key)
+        keys.insert(index, key)
+        positions.insert(index, key[1])
+
+    def _range(self, keys, low, high):
+        """Slice bounds of the sorted keys whose value lies within [low, high]."""
+        start = 0 if low is None else bisect_left(keys, (low, -1))
+        end = len(keys) if high is None else bisect_right(keys, (high, len(self.invoices)))
+        return start, max(start, end)
+
+    def by_gstin(self, gstin):
+        """All invoices issued under a GSTIN."""
+        return [self.invoices[position] for position in self._by_gstin.get(normalize_gstin(gstin), [])]
+
+    def stores(self):
+        """Distinct store names, as first seen (invoices without one can't be picked by name)."""
+        return [self.invoices[positions[0]].get("store_name") for key, positions in self._by_store.items() if key]
+
+    def categories(self):
+        """Distinct categories, as first seen (invoices without one can't be picked by name)."""
+        return [self.invoices[positions[0]].get("category") for key, positions in self._by_category.items() if key]
+
+    def date_bounds(self):
+        """Earliest and latest invoice dates, or (None, None) if no invoice has a valid date."""
+        if not self._date_keys:
+            return None, None
+        return date.fromordinal(self._date_keys[0][0]), date.fromordinal(self._date_keys[-1][0])
+
+    def amount_bounds(self):
+        """Smallest and largest invoice totals, or (None, None) if no invoice has a valid amount."""
+        if not self._amount_keys:
+            return None, None
+        return self._amount_keys[0][0], self._amount_keys[-1][0]
+
+    def query(self, start=None, end=None, categories=None, stores=None, gstin=None, min_amount=None, max_amount=None):
+        """
+        Invoices matching every given filter, in the order they were added. Dates are
+        inclusive datetime.date bounds; categories and stores are collections of names.
+        """
+        # Each filter is (number of matches, positions it matches, per-position check)
+        filters = []
+        if start is not None or end is not None:
+            low = start.toordinal() if start is not None else None
+            high = end.toordinal() if end is not None else None
+            first, last = self._range(self._date_keys, low, high)
+            filters.append((last - first, lambda: self._date_positions[first:last],
+                            lambda p: self._dates[p] is not None
+                            and (low is None or self._dates[p] >= low)
+                            and (high is None or self._dates[p] <= high)))
+        if min_amount is not None or max_amount is not None:
+            first_amount, last_amount = self._range(self._amount_keys, min_amount, max_amount)
+            filters.append((last_amount - first_amount, lambda: self._amount_positions[first_amount:last_amount],
+                            lambda p: self._amounts[p] is not None
+                            and (min_amount is None or self._amounts[p] >= min_amount)
+                            and (max_amount is None or self._amounts[p] <= max_amount)))
+        for values, inverted, position_keys in ((categories, self._by_category, self._category_keys),
+                                                (stores, self._by_store, self._store_keys)):
+            if values is not None:
+                keys = {normalize_key(value) for value in values}
+                filters.append((sum(len(inverted.get(key, [])) for key in keys),
+                                lambda keys=keys, inverted=inverted: [p for key in keys for p in inverted.get(key, [])],
+                                lambda p, keys=keys, position_keys=position_keys: position_keys[p] in keys))
+        if gstin:
+            gstin_key = normalize_gstin(gstin)
+            filters.append((len(self._by_gstin.get(gstin_key, [])),
+                            lambda: self._by_gstin.get(gstin_key, []),
+                            lambda p: self._gstins[p] == gstin_key))
+
+        if not filters:
+            return list(self.invoices)
+
+        # Drive the query from the most selective filter; the others are checked per candidate
+        filters.sort(key=lambda f: f[0])
+        _, positions, _ = filters[0]
+        checks = [check for _, _, check in filters[1:]]
+        matches = sorted(p for p in positions() if all(check(p) for check in checks))
+        return [self.invoices[p] for p in matches]
+
+
+def sync_invoice_index(state, invoices):
+    """Return the session's invoice index, rebuilding it if it no longer matches the invoices."""
+    index = state.get("invoice_index")
+    if index is None or len(index) != len(invoices) or (invoices and index.invoices[-1] is not invoices[-1]):
+        index = state["invoice_index"] = InvoiceIndex(invoices)
+    return index
+
+
+def record_indexed_invoice(state, invoices, invoice):
+    """Add a newly saved invoice to the session's index if it is otherwise up to date."""
+    index = state.get("invoice_index")
+    if index is not None and len(index) == len(invoices) - 1:
+        index.add(invoice)
+    else:
+        state.pop("invoice_index", None)
@@ -1,7 +1,9 @@
 import streamlit as st
-import pandas as pd
 from st_aggrid import AgGrid, GridOptionsBuilder
-import google.generativeai as genai
+from anomaly import flagged_invoices, sync_anomaly_state
+from insights import get_insights, insights_cache_key, insights_scope, pending_changes, request_insights
+from invoice_index import sync_invoice_index
+from utils import invoice_kpis, invoice_table, sync_from_service
 
 st.set_page_config(page_title="Dashboard", page_icon="📊", layout="wide")
 
@@ -21,31 +23,42 @@ st.markdown(
 
 # Ensure session state is initialized
 st.session_state.setdefault("invoices", [])
+sync_from_service()
 
-if "invoices" in st.session_state and st.session_state.invoices:
-    df = pd.DataFrame(st.session_state.invoices)
-    
-    # Ensure total_amount is numeric
-    df["total_amount"] = pd.to_numeric(df["total_amount"], errors="coerce")
-    
-    # Total invoices
-    total_invoices = len(df)
-    
-    # Total spending
-    total_spending = df["total_amount"].sum()
-    
-    # Average invoice value
-    average_invoice = total_spending / total_invoices if total_invoices else 0
-    
-    # Highest expense category calculation: group by category and sum amounts
-    category_totals = df.groupby("category")["total_amount"].sum().reset_index()
-    if not category_totals.empty:
-        highest = category_totals.loc[category_totals["total_amount"].idxmax()]
-        highest_category = highest["category"]
-        highest_amount = highest["total_amount"]
-    else:
-        highest_category = "N/A"
-        highest_amount = 0
+
+def filter_invoices(index):
+    """Sidebar filters scoping the whole Dashboard; returns the invoices in the current view and its insights scope."""
+    st.sidebar.header("Filters")
+    start = end = min_amount = max_amount = None
+
+    first_date, last_date = index.date_bounds()
+    if first_date is not None and first_date < last_date:
+        date_range = st.sidebar.date_input("Date range", value=(first_date, last_date),
+                                           min_value=first_date, max_value=last_date)
+        # Only filter (and so drop undated invoices) once the user narrows the range
+        if len(date_range) == 2 and tuple(date_range) != (first_date, last_date):
+            start, end = date_range
+
+    categories = st.sidebar.multiselect("Category", sorted(map(str, index.categories()))) or None
+    stores = st.sidebar.multiselect("Store", sorted(map(str, index.stores()))) or None
+    gstin = st.sidebar.text_input("GSTIN").strip() or None
+
+    lowest, highest = index.amount_bounds()
+    if lowest is not None and lowest < highest:
+        amount_range = st.sidebar.slider("Total amount (₹)", min_value=float(lowest), max_value=float(highest),
+                                         value=(float(lowest), float(highest)))
+        if amount_range != (float(lowest), float(highest)):
+            min_amount, max_amount = amount_range
+
+    filters = dict(start=start, end=end, categories=categories, stores=stores, gstin=gstin,
+                   min_amount=min_amount, max_amount=max_amount)
+    return index.query(**filters), insights_scope(**filters)
+
+
+invoices, scope = filter_invoices(sync_invoice_index(st.session_state, st.session_state.invoices))
+
+if invoices:
+    total_invoices, total_spending, average_invoice, highest_category, highest_amount = invoice_kpis(invoices)
 
     # Create 4 columns for the KPI cards
     col1, col2, col3, col4 = st.columns(4)
@@ -57,37 +70,22 @@ else:
     st.info("No invoice data available to compute KPIs.")
 
 # Create Tabs
-tab1, tab2, tab3 = st.tabs(["📈 Charts", "📋 Tables", "🤖 AI Insights"])
+tab1, tab2, tab3, tab4 = st.tabs(["📈 Charts", "📋 Tables", "🤖 AI Insights", "🚩 Anomalies"])
 
 with tab1:
     st.subheader("Spending Trends")
     
-    if st.session_state.invoices:
+    if invoices:
         from utils import spending_trends
-        spending_trends()
+        spending_trends(invoices=invoices)
     else:
         st.warning("No invoice data available. Upload invoices to view spending trends.")
 
 with tab2:
     st.subheader("Interactive Invoice Data")
     
-    if st.session_state.invoices:
-        df = pd.DataFrame(st.session_state.invoices)
-        columns_order = ["id", "store_name", "gstin", "date", "category", "total_amount"]
-        df = df[columns_order]
-        
-        # Rename columns for display
-        df = df.rename(columns={
-            "id": "Bill ID",
-            "store_name": "Store Name",
-            "gstin": "GSTIN",
-            "date": "Date",
-            "category": "Category",
-            "total_amount": "Total Amount"
-        })
-        
-        # Convert "Total Amount" column to numeric type
-        df["Total Amount"] = pd.to_numeric(df["Total Amount"], errors="coerce")
+    if invoices:
+        df = invoice_table(invoices)
         
         gb = GridOptionsBuilder.from_dataframe(df)
         gb.configure_pagination(paginationAutoPageSize=True)
@@ -108,34 +106,80 @@ with tab2:
         gridOptions["domLayout"] = "autoHeight"
         
         AgGrid(df, gridOptions=gridOptions, height=500, fit_columns_on_grid_load=True)
+
+        # Summary PDF scoped to the sidebar filters
+        from utils import generate_invoice_pdf, show_invoice_pdf
+        if st.button("Generate Invoice Summary PDF for this View", key="generate_filtered_pdf"):
+            generate_invoice_pdf(invoices)
+        show_invoice_pdf(invoices, key="download_filtered_invoice_summary")
     else:
         st.info("No invoice data available.")
 
 
 with tab3:
     st.subheader("AI Insights")
-    
-    def generate_ai_insights(invoices):
-        if not invoices:
-            return "No data available for insights."
-        
-        invoice_df = pd.DataFrame(invoices)
-        invoice_text = invoice_df.to_string(index=False)
-        
-        # Revised prompt: provide insights and recommendations relevant to the client's spending patterns.
-        prompt = (
-            "Analyze the following invoice data and provide 5 to 10 bullet-point insights along with actionable recommendations for the client. "
-            "Focus on identifying key spending trends, anomalies, and cost drivers, and include only those insights that are directly useful for "
-            "making financial decisions (e.g., high spending areas, opportunities for vendor negotiation, unusual spikes in costs). "
-            "Exclude suggestions about internal data standardization, invoice formatting issues, or unclear notations unless they significantly impact "
-            "the spending or payment process. Output only bullet points.\n\n"
-            "Invoice Data:\n"
-            f"{invoice_text}"
-        )
-        
-        response = genai.GenerativeModel("gemini-1.5-flash").generate_content(prompt)
-        insight = response.text.strip()
-        return insight
 
-    insights = generate_ai_insights(st.session_state.invoices)
-    st.markdown(insights)
+    @st.fragment(run_every=2)
+    def poll_ai_insights(key):
+        """Wait for the background insights job and rerun the page once it finishes."""
+        status, _ = get_insights(st.session_state, key)
+        if status == "pending":
+            st.info("⏳ Generating AI insights in the background...")
+        else:
+            st.rerun()
+
+    if invoices:
+        insights_key = insights_cache_key(invoices)
+        status, insights = get_insights(st.session_state, insights_key)
+
+        if status == "missing":
+            # Show the last analysis until the user asks for it to be brought up to date
+            previous = pending_changes(st.session_state, invoices, scope)
+            if previous:
+                previous_summary, changed_count, removed_count = previous
+                st.caption(f"Last analysis is out of date: {changed_count} new or changed, {removed_count} removed invoice(s) since it ran.")
+                st.markdown(previous_summary)
+            label = "Update AI Insights" if previous else "Generate AI Insights"
+            if st.button(label, key="generate_ai_insights"):
+                insights_key = request_insights(st.session_state, invoices, scope)
+                status, insights = get_insights(st.session_state, insights_key)
+
+        if status == "ready":
+            st.markdown(insights)
+        elif status == "pending":
+            poll_ai_insights(insights_key)
+        elif status == "error":
+            st.error(f"Error generating AI insights: {insights}")
+            if st.button("Retry", key="retry_ai_insights"):
+                request_insights(st.session_state, invoices, scope)
+                st.rerun()
+    else:
+        st.info("No data available for insights.")
+
+
+with tab4:
+    st.subheader("Flagged Invoices")
+
+    if invoices:
+        # Scores always use the full history; the filter only scopes which flags are listed
+        engine = sync_anomaly_state(st.session_state, st.session_state.invoices)
+        flagged = flagged_invoices(engine)
+        flagged = flagged[flagged["id"].isin([invoice.get("id") for invoice in invoices])]
+        if flagged.empty:
+            st.success("No unusual invoices detected.")
+        else:
+            st.caption(f"{len(flagged)} of {len(invoices)} invoices flagged by amount outliers, round amounts, unusual weekdays and vendor frequency spikes.")
+            flagged = flagged.rename(columns={
+                "id": "Bill ID",
+                "store_name": "Store Name",
+                "category": "Category",
+                "date": "Date",
+                "total_amount": "Total Amount",
+                "store_z": "Store Z-Score",
+                "category_z": "Category Z-Score",
+                "reasons": "Reasons"
+            })
+            flagged["Date"] = flagged["Date"].dt.strftime("%d/%m/%Y")
+            st.dataframe(flagged.round(2), hide_index=True, use_container_width=True)
+    else:
+        st.info("No invoice data available.")
@@ -0,0 +1,351 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+# INVOICE_PROVIDERS=local swaps Google Vision and Gemini for the in-process stand-ins below,
+# so the ingestion path can be load-tested without API quota. The other variables tune them.
+ENV_PROVIDERS = "INVOICE_PROVIDERS"
+ENV_LATENCY_MS = "INVOICE_LOCAL_LATENCY_MS"
+ENV_LATENCY_SIGMA = "INVOICE_LOCAL_LATENCY_SIGMA"
+ENV_ERROR_RATE = "INVOICE_LOCAL_ERROR_RATE"
+ENV_RATE_LIMIT_RATE = "INVOICE_LOCAL_RATE_LIMIT_RATE"
+ENV_SEED = "INVOICE_LOCAL_SEED"
+ENV_STALL_RATE = "INVOICE_LOCAL_STALL_RATE"
+ENV_STALL_MS = "INVOICE_LOCAL_STALL_MS"
+# Comma-separated LLMs to route entity extraction across (gemini, groq); see routing.py
+ENV_LLM_PROVIDERS = "INVOICE_LLM_PROVIDERS"
+
+# Service account used for both Vision and Gemini inside the container
+GOOGLE_CREDS_PATH = "/app/credentials.json"
+GEMINI_MODEL = "gemini-1.5-flash"
+# Llama on Groq, the alternative LLM; the client reads GROQ_API_KEY
+GROQ_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+# Retries for rate-limited calls: exponential backoff from RETRY_BACKOFF seconds
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+
+class ProviderError(Exception):
+    """A provider call failed in a way that may succeed on retry."""
+
+
+class RateLimitError(ProviderError):
+    """The provider answered 429 / quota exhausted."""
+
+    def __init__(self, message="429 Resource has been exhausted", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CallCancelled(Exception):
+    """The call was cancelled (a hedged request whose other copy answered first)."""
+
+
+def _check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise CallCancelled()
+
+
+def call_with_retry(func, *args, retries=RETRIES, backoff=RETRY_BACKOFF, **kwargs):
+    """Call func, retrying rate-limited calls with exponential backoff (or the provider's retry_after)."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except RateLimitError as e:
+            if attempt == retries:
+                raise
+            time.sleep(e.retry_after if e.retry_after is not None else backoff * 2 ** attempt)
+
+
+def _google_credentials():
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_file(GOOGLE_CREDS_PATH)
+
+
+class VisionOCR:
+    """Google Cloud Vision text detection."""
+
+    def __init__(self, credentials=None):
+        from google.cloud import vision
+        self._vision = vision
+        self.client = vision.ImageAnnotatorClient(credentials=credentials)
+
+    def extract_text(self, image_bytes):
+        from google.api_core.exceptions import ResourceExhausted
+        try:
+            response = self.client.text_detection(image=self._vision.Image(content=image_bytes))
+        except ResourceExhausted as e:
+            raise RateLimitError(str(e)) from e
+        texts = response.text_annotations
+        return texts[0].description if texts else ""
+
+
+class GeminiLLM:
+    """
+    Google Gemini text generation. json_output asks for a JSON-only answer, schema (a JSON
+    schema dict) for one that follows it. A cancel event set before the request is sent skips
+    it; the SDK can't abort a request already in flight.
+    """
+
+    # Instrumentation stage its calls are timed under
+    stage = "gemini"
+
+    def __init__(self, credentials=None, model=GEMINI_MODEL):
+        import google.generativeai as genai
+        if credentials is not None:
+            genai.configure(credentials=credentials)
+        self.model = genai.GenerativeModel(model)
+
+    def generate(self, prompt, json_output=False, cancel=None, schema=None):
+        from google.api_core.exceptions import ResourceExhausted
+        _check_cancelled(cancel)
+        config = {"response_mime_type": "application/json"} if json_output or schema else None
+        if schema:
+            config["response_schema"] = schema
+        try:
+            return self.model.generate_content(prompt, generation_config=config).text
+        except ResourceExhausted as e:
+            raise RateLimitError(str(e)) from e
+
+
+class GroqLLM:
+    """Llama on Groq (the prompt sketched in test.py); same interface as GeminiLLM, but a schema only gets JSON mode."""
+
+    stage = "groq"
+
+    def __init__(self, model=GROQ_MODEL, api_key=None):
+        from groq import Groq
+        self.client = Groq(api_key=api_key)
+        self.model = model
+
+    def generate(self, prompt, json_output=False, cancel=None, schema=None):
+        import groq
+        _check_cancelled(cancel)
+        options = {"response_format": {"type": "json_object"}} if json_output or schema else {}
+        try:
+            completion = self.client.chat.completions.create(
+                model=self.model, messages=[{"role": "user", "content": prompt}],
+                temperature=0.18, max_completion_tokens=1024, top_p=1, stream=False, **options)
+        except groq.RateLimitError as e:
+            raise RateLimitError(str(e)) from e
+        return completion.choices[0].message.content
+
+
+class _StandIn:
+    """
+    Shared behaviour of the local stand-ins: log-normal latency around latency_ms, stalls of
+    stall_ms added to stall_rate of the calls (the slow tail of a real API), random failures at
+    error_rate and simulated 429s at rate_limit_rate. A seed makes a run repeatable. A call
+    waiting on its latency returns at once, with CallCancelled, when its cancel event is set.
+    """
+
+    def __init__(self, latency_ms=0.0, latency_sigma=0.5, error_rate=0.0, rate_limit_rate=0.0, seed=None,
+                 stall_rate=0.0, stall_ms=0.0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.calls = 0
+        self.cancelled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _simulate(self, cancel=None):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency_ms / 1000 * self._random.lognormvariate(0, self.latency_sigma) if self.latency_ms else 0.0
+            if self._random.random() < self.stall_rate:
+                delay += self.stall_ms / 1000
+            roll = self._random.random()
+        if cancel is not None:
+            if cancel.wait(delay):
+                with self._lock:
+                    self.cancelled += 1
+                raise CallCancelled()
+        elif delay:
+            time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            raise RateLimitError(retry_after=0.0)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise ProviderError("503 Service unavailable (simulated)")
+
+
+# Pieces for invoice text derived from an image when no canned texts are given
+_STAND_IN_STORES = ["Big Bazaar Delhi", "IRCTC", "Croma Mumbai", "Tata Power", "Cafe Coffee Day Pune", "Apollo Pharmacy"]
+_STAND_IN_ITEMS = ["Item A", "Service Charge", "Ticket Fare", "A4 Paper Ream", "Energy Charges", "Veg Thali"]
+
+
+class LocalOCR(_StandIn):
+    """
+    Stand-in for Vision. Returns one of the canned texts (picked by a hash of the image bytes)
+    or, without canned texts, a plausible invoice derived from that hash, so the same image
+    always reads the same.
+    """
+
+    def __init__(self, texts=None, ms_per_mb=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.texts = list(texts or [])
+        # Simulated upload time on top of the latency, per MB of image sent
+        self.ms_per_mb = ms_per_mb
+        self.bytes_received = 0
+
+    def extract_text(self, image_bytes):
+        with self._lock:
+            self.bytes_received += len(image_bytes)
+        if self.ms_per_mb:
+            time.sleep(self.ms_per_mb * len(image_bytes) / 1e6 / 1000)
+        self._simulate()
+        digest = int.from_bytes(hashlib.sha256(image_bytes).digest()[:8], "big")
+        if self.texts:
+            return self.texts[digest % len(self.texts)]
+        rng = random.Random(digest)
+        lines = [rng.choice(_STAND_IN_STORES),
+                 f"GSTIN: {rng.randint(1, 37):02d}ABCDE{rng.randint(1000, 9999)}F1Z{rng.randint(0, 9)}",
+                 f"Bill No: {rng.randint(1000, 99999)}",
+                 f"Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.choice([2023, 2024])}"]
+        total = 0.0
+        for item in rng.sample(_STAND_IN_ITEMS, 3):
+            amount = round(rng.uniform(50, 2000), 2)
+            total += amount
+            lines.append(f"{item}  {amount:.2f}")
+        lines.append(f"Total Amount  ₹{total:.2f}")
+        return "\n".join(lines)
+
+
+class LocalLLM(_StandIn):
+    """
+    Stand-in for Gemini. Entity-extraction prompts get a JSON answer pulled from the invoice
+    text with regular expressions; any other prompt gets the canned response. malformed_rate
+    of the JSON answers come back broken: cut off, or with one field in an unusable form.
+    """
+
+    CATEGORY_KEYWORDS = {
+        "Food": ("restaurant", "cafe", "grocery", "food", "bakery", "bazaar", "thali"),
+        "Travel": ("irctc", "flight", "airline", "hotel", "taxi", "fuel", "petrol", "uber", "ola", "fare"),
+        "Office Supplies": ("stationery", "printer", "ink", "paper", "croma", "laptop", "keyboard"),
+        "Utilities": ("electricity", "power", "energy", "water", "broadband", "gas", "mobile"),
+    }
+
+    # Timed as the provider it stands in for
+    stage = "gemini"
+    MALFORMED_VALUES = {"date": "32/13/2024", "total_amount": "approx. see bill", "category": "Food & Drinks",
+                        "gstin": "GSTIN not clear", "store_name": ["?"], "bill_no": {"no": None}}
+
+    def __init__(self, response="- Spending is concentrated in a few stores (local stand-in).", malformed_rate=0.0,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.response = response
+        self.malformed_rate = malformed_rate
+
+    def generate(self, prompt, json_output=False, cancel=None, schema=None):
+        self._simulate(cancel)
+        marker = prompt.rfind("Invoice text:")
+        if marker < 0:
+            return self.response
+        entities = self.entities(prompt[marker + len("Invoice text:"):])
+        if not self.malformed_rate:
+            return json.dumps(entities)
+        with self._lock:
+            malformed = self._random.random() < self.malformed_rate
+            field = self._random.choice(list(self.MALFORMED_VALUES))
+            truncate = self._random.random() < 0.25
+        if not malformed:
+            return json.dumps(entities)
+        if truncate:
+            return json.dumps(entities)[:40]
+        return json.dumps({**entities, field: self.MALFORMED_VALUES[field]})
+
+    def entities(self, text):
+        lines = [line.strip() for line in text.strip().splitlines() if line.strip()]
+        date = re.search(r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})", text)
+        bill = re.search(r"(?:bill|invoice)\s*(?:no|number)\.?\s*:?\s*([A-Za-z0-9-]+)", text, re.IGNORECASE)
+        gstin = re.search(r"\b\d{2}[A-Z0-9]{10}\d?[A-Z0-9]Z[A-Z0-9]\b", text)
+        total = re.search(r"total[^\d\n]*([\d,]+\.\d{2})", text, re.IGNORECASE)
+        lowered = text.lower()
+        category = next((name for name, words in self.CATEGORY_KEYWORDS.items() if any(w in lowered for w in words)), "Others")
+        return {
+            "store_name": lines[0] if lines else "N/A",
+            "date": f"{int(date.group(1)):02d}/{int(date.group(2)):02d}/{date.group(3)}" if date else "N/A",
+            "bill_no": bill.group(1) if bill else "N/A",
+            "total_amount": total.group(1).replace(",", "") if total else "0",
+            "category": category,
+            "gstin": gstin.group(0) if gstin else "N/A",
+        }
+
+
+class Providers:
+    """The OCR and LLM providers used by extraction and insights."""
+
+    def __init__(self, ocr, llm):
+        self.ocr = ocr
+        self.llm = llm
+
+
+_providers = None
+_providers_lock = threading.Lock()
+
+
+def local_providers_from_env():
+    """Local stand-ins configured from the INVOICE_LOCAL_* environment variables."""
+    settings = {
+        "latency_ms": float(os.environ.get(ENV_LATENCY_MS, 0)),
+        "latency_sigma": float(os.environ.get(ENV_LATENCY_SIGMA, 0.5)),
+        "error_rate": float(os.environ.get(ENV_ERROR_RATE, 0)),
+        "rate_limit_rate": float(os.environ.get(ENV_RATE_LIMIT_RATE, 0)),
+        "stall_rate": float(os.environ.get(ENV_STALL_RATE, 0)),
+        "stall_ms": float(os.environ.get(ENV_STALL_MS, 0)),
+    }
+    seed = os.environ.get(ENV_SEED)
+    seed = int(seed) if seed is not None else None
+    names = llm_provider_names()
+    llms = {name: LocalLLM(seed=None if seed is None else seed + 1 + i, **settings) for i, name in enumerate(names)}
+    return Providers(LocalOCR(seed=seed, **settings), _route(llms))
+
+
+def llm_provider_names():
+    return [name.strip().lower() for name in os.environ.get(ENV_LLM_PROVIDERS, "gemini").split(",") if name.strip()]
+
+
+def _route(llms):
+    """The only LLM, or a RoutedLLM over several."""
+    if len(llms) == 1:
+        return next(iter(llms.values()))
+    from routing import RoutedLLM
+    return RoutedLLM(llms)
+
+
+def google_providers():
+    """Vision and Gemini sharing the container's service account, plus any other LLMs in INVOICE_LLM_PROVIDERS."""
+    credentials = _google_credentials()
+    factories = {"gemini": lambda: GeminiLLM(credentials), "groq": GroqLLM}
+    llms = {}
+    for name in llm_provider_names():
+        if name not in factories:
+            raise ValueError(f"Unknown LLM provider {name!r} in {ENV_LLM_PROVIDERS} (expected one of {', '.join(factories)})")
+        llms[name] = factories[name]()
+    return Providers(VisionOCR(credentials), _route(llms))
+
+
+def get_providers():
+    """The process-wide providers, created on first use from INVOICE_PROVIDERS (google or local)."""
+    global _providers
+    with _providers_lock:
+        if _providers is None:
+            kind = os.environ.get(ENV_PROVIDERS, "google").lower()
+            _providers = local_providers_from_env() if kind == "local" else google_providers()
+        return _providers
+
+
+def set_providers(providers):
+    """Replace the process-wide providers (e.g. with stand-ins in a benchmark); returns the previous ones."""
+    global _providers
+    with _providers_lock:
+        previous, _providers = _providers, providers
+    return previous
@@ -0,0 +1,442 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fpdf import FPDF
+from PIL import Image
+
+# Finished reports stay in memory up to this size and spill to a temporary file beyond it
+SPOOL_MAX_MEMORY = 16 * 1024 * 1024
+
+# Summary table layout: [Bill ID, Store Name, GSTIN, Date, Category, Total Amount]
+COL_WIDTHS = [15, 50, 42, 25, 30, 30]
+HEADERS = ["Bill ID", "Store Name", "GSTIN", "Date", "Category", "Total Amount"]
+LINE_HEIGHT = 5  # Height for each line of text
+
+# Invoice images are placed at x=10, y=10 within this box (mm), resampled to IMAGE_DPI
+IMAGE_BOX = (180, 277)
+IMAGE_DPI = 150
+JPEG_QUALITY = 75
+# Below this many images the process pool costs more than it saves
+PARALLEL_IMAGE_THRESHOLD = 4
+# Before an image is pickled to the pool it's box-reduced (fast, integer factors) to within this
+# factor of its placement size; the workers do the LANCZOS resample and JPEG encode
+PREREDUCE_GAP = 1.0
+
+# Relative cost of each stage, used to turn finished work into progress fractions
+CHART_WORK = 20
+IMAGE_WORK = 10
+FINISH_WORK = 10
+
+# Finished reports kept per session, keyed by data version; the oldest is dropped first
+REPORT_CACHE_SIZE = 4
+# One build at a time: a report already uses every core for its images
+_report_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="invoice-report")
+
+
+class _SpoolBuffer:
+    """
+    Stand-in for FPDF's string buffer. FPDF appends each finished line with `+=` and uses
+    len() for object offsets, so writing straight into a spooled file keeps the document
+    out of one ever-growing string.
+    """
+
+    def __init__(self, max_size=SPOOL_MAX_MEMORY):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.size = 0
+
+    def __iadd__(self, text):
+        data = text.encode("latin1")
+        self.file.write(data)
+        self.size += len(data)
+        return self
+
+    def __len__(self):
+        return self.size
+
+
+class SpooledPDF(FPDF):
+    """FPDF that writes the finished document into a spooled temporary file."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffer = _SpoolBuffer()
+
+    def jpeg_image(self, name, data, width, height, gray, x, y, w, h):
+        """
+        Place JPEG bytes already in memory. FPDF's image() only reads files, so the image
+        info is registered directly and the JPEG data is embedded as-is (DCTDecode).
+        """
+        if name not in self.images:
+            self.images[name] = {
+                "i": len(self.images) + 1,
+                "w": width,
+                "h": height,
+                "cs": "DeviceGray" if gray else "DeviceRGB",
+                "bpc": 8,
+                "f": "DCTDecode",
+                "data": data,
+            }
+        self.image(name, x=x, y=y, w=w, h=h)
+
+    def finish(self):
+        """Close the document and return the spooled file, rewound for reading."""
+        self.close()
+        spool = self.buffer.file
+        spool.seek(0)
+        return spool
+
+
+# Per-font caches of measured widths: (family, style, size) -> {glyph or word: width}
+_GLYPH_WIDTHS = {}
+_WORD_WIDTHS = {}
+WORD_CACHE_LIMIT = 50000
+
+
+def _font_key(pdf):
+    return (pdf.font_family, pdf.font_style, pdf.font_size_pt)
+
+
+def string_width(text, pdf):
+    """Width of text in the current font, summed from a cached per-font glyph-width table."""
+    glyphs = _GLYPH_WIDTHS.setdefault(_font_key(pdf), {})
+    width = 0.0
+    for char in text:
+        char_width = glyphs.get(char)
+        if char_width is None:
+            char_width = glyphs[char] = pdf.get_string_width(char)
+        width += char_width
+    return width
+
+
+def _word_width(word, pdf, words):
+    width = words.get(word)
+    if width is None:
+        if len(words) > WORD_CACHE_LIMIT:
+            words.clear()
+        width = words[word] = string_width(word, pdf)
+    return width
+
+
+def wrap_lines(text, max_width, pdf):
+    """
+    Greedily wrap text into lines narrower than max_width. Each word is measured once
+    (and cached per font), so wrapping is linear in the length of the text.
+    A single word wider than max_width is kept on a line of its own.
+    """
+    words_cache = _WORD_WIDTHS.setdefault(_font_key(pdf), {})
+    space = string_width(" ", pdf)
+    lines = []
+    current_line = ""
+    current_width = 0.0
+    for word in text.split(" "):
+        word_width = _word_width(word, pdf, words_cache)
+        if not current_line:
+            current_line, current_width = word, word_width
+        elif current_width + space + word_width <= max_width:
+            current_line += " " + word
+            current_width += space + word_width
+        else:
+            lines.append(current_line)
+            current_line, current_width = word, word_width
+    if current_line:
+        lines.append(current_line)
+    return lines
+
+
+def wrap_text(text, max_width, pdf):
+    """
+    Wrap text so that each line's width is less than max_width.
+    Returns a string with newline characters inserted.
+    """
+    return "\n".join(wrap_lines(text, max_width, pdf))
+
+
+def _row_data(invoice):
+    # Retrieve each field with fallback
+    return [
+        str(invoice.get("id") or "N/A"),
+        invoice.get("store_name") or "N/A",
+        invoice.get("gstin") or "N/A",
+        invoice.get("date") or "N/A",
+        invoice.get("category") or "N/A",
+        f"{float(invoice.get('total_amount') or 0):.2f}"
+    ]
+
+
+def layout_rows(pdf, rows, col_widths=COL_WIDTHS, line_height=LINE_HEIGHT):
+    """
+    Wrap every cell of every row in one pass with the current font.
+    Returns a list of (cell lines, row height) pairs.
+    """
+    # Subtracting a small padding from col_width if needed.
+    limits = [width - 2 for width in col_widths]
+    laid_out = []
+    for row in rows:
+        cells = [wrap_lines(cell, limit, pdf) for cell, limit in zip(row, limits)]
+        laid_out.append((cells, line_height * max(1, max(len(lines) for lines in cells))))
+    return laid_out
+
+
+def _draw_header(pdf, headers, col_widths):
+    pdf.set_font("Arial", style='B', size=10)
+    # Draw table headers using normal cell since they are short
+    for i, header in enumerate(headers):
+        pdf.cell(col_widths[i], 8, header, border=1, align="C")
+    pdf.ln()
+    pdf.set_font("Arial", size=10)
+
+
+def draw_table(pdf, laid_out, headers=HEADERS, col_widths=COL_WIDTHS, line_height=LINE_HEIGHT, on_row=None):
+    """
+    Draw rows produced by layout_rows. Rows never split across pages: a row that doesn't
+    fit starts a new page, and the header is repeated at the top of every page.
+    """
+    auto_page_break = pdf.auto_page_break
+    pdf.set_auto_page_break(False, pdf.b_margin)
+    _draw_header(pdf, headers, col_widths)
+    # Baseline offset used by FPDF's cell() for vertically centred text
+    baseline = 0.5 * line_height + 0.3 * pdf.font_size
+    for cells, row_height in laid_out:
+        if pdf.get_y() + row_height > pdf.page_break_trigger:
+            pdf.add_page()
+            _draw_header(pdf, headers, col_widths)
+        x = pdf.l_margin
+        y = pdf.get_y()
+        for width, lines in zip(col_widths, cells):
+            for line_number, line in enumerate(lines):
+                if line:
+                    pdf.text(x + pdf.c_margin, y + line_number * line_height + baseline, line)
+            pdf.rect(x, y, width, row_height)
+            x += width
+        pdf.set_y(y + row_height)
+        if on_row:
+            on_row()
+    pdf.set_auto_page_break(auto_page_break, pdf.b_margin)
+
+
+def add_summary_table(pdf, invoices, on_row=None):
+    """Draw the invoice summary table with wrapped cells and a total row."""
+    pdf.set_font("Arial", size=10)
+    laid_out = layout_rows(pdf, (_row_data(invoice) for invoice in invoices))
+    draw_table(pdf, laid_out, on_row=on_row)
+
+    # Draw total amount row
+    total_sum = sum(float(invoice.get("total_amount") or 0) for invoice in invoices)
+    pdf.set_font("Arial", style='B', size=10)
+    pdf.cell(sum(COL_WIDTHS[:-1]), 8, "Total Amount", border=1, align="R")
+    pdf.cell(COL_WIDTHS[-1], 8, f"{total_sum:.2f}", border=1, align="C")
+    pdf.ln(10)
+
+
+def add_chart_pages(pdf, chart_paths):
+    """Add the pie, line and bar charts rendered by utils.spending_trends(silent=True)."""
+    pie_chart_path, line_chart_path, bar_chart_path = chart_paths
+    pdf.add_page()
+    pdf.set_font("Arial", style='B', size=14)
+    pdf.cell(200, 10, "Spending Trends", ln=True, align="C")
+    pdf.ln(10)
+    pdf.image(pie_chart_path, x=10, y=30, w=180)
+    pdf.ln(100)
+    pdf.image(line_chart_path, x=10, y=140, w=180)
+    pdf.ln(100)
+    pdf.add_page()
+    pdf.set_font("Arial", style='B', size=14)
+    pdf.image(bar_chart_path, x=10, y=30, w=180)
+
+
+def image_placement(width, height, box=IMAGE_BOX):
+    """Size (mm) of an image scaled to the full box width, or to the box height if it is too tall."""
+    box_width, box_height = box
+    scale = min(box_width / width, box_height / height)
+    return width * scale, height * scale
+
+
+def encode_invoice_image(img, dpi=IMAGE_DPI, quality=JPEG_QUALITY):
+    """
+    Resample an invoice image to its placement size at the given DPI and encode it as JPEG.
+    Returns (jpeg bytes, pixel width, pixel height, is grayscale).
+    """
+    gray = img.mode in ("1", "L", "LA", "I", "I;16", "F")
+    img = img.convert("L" if gray else "RGB")
+    w_mm, h_mm = image_placement(*img.size)
+    target = (max(1, round(w_mm / 25.4 * dpi)), max(1, round(h_mm / 25.4 * dpi)))
+    if target[0] < img.width:
+        img = img.resize(target, Image.LANCZOS, reducing_gap=3.0)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue(), img.width, img.height, gray
+
+
+def _encode_image_job(args):
+    img, dpi, quality = args
+    return encode_invoice_image(img, dpi, quality)
+
+
+def prereduce(img, dpi=IMAGE_DPI):
+    """The image shrunk by an integer factor to at least PREREDUCE_GAP times its size at dpi (or unchanged)."""
+    w_mm, _ = image_placement(*img.size)
+    factor = int(img.width / max(1.0, w_mm / 25.4 * dpi) / PREREDUCE_GAP)
+    if factor < 2 or img.mode not in ("L", "LA", "RGB", "RGBA", "I", "F"):
+        return img
+    return img.reduce(factor)
+
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+
+def _get_image_pool():
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None:
+            # Spawned, not forked: the pool is started from a report thread of the multi-threaded
+            # Streamlit server, and a forked child can inherit locks other threads were holding
+            _image_pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                              mp_context=multiprocessing.get_context("spawn"))
+    return _image_pool
+
+
+def encode_invoice_images(images, dpi=IMAGE_DPI, quality=JPEG_QUALITY):
+    """
+    Encode invoice images, spreading the work across a process pool for larger batches.
+    Yields (invoice_id, encoded) in order, as soon as each image is ready.
+    """
+    jobs = [(img, dpi, quality) for img in images.values()]
+    if len(jobs) < PARALLEL_IMAGE_THRESHOLD or (os.cpu_count() or 1) < 2:
+        encoded = map(_encode_image_job, jobs)
+    else:
+        jobs = [(prereduce(img, dpi), dpi, quality) for img, dpi, quality in jobs]
+        encoded = _get_image_pool().map(_encode_image_job, jobs)
+    yield from zip(images.keys(), encoded)
+
+
+def add_invoice_image(pdf, invoice_id, encoded):
+    """Add one encoded invoice image on its own page."""
+    data, width, height, gray = encoded
+    w, h = image_placement(width, height)
+    pdf.add_page()
+    pdf.jpeg_image(f"invoice_{invoice_id}", data, width, height, gray, x=10, y=10, w=w, h=h)
+
+
+def build_invoice_report(invoices, images, chart_paths=None, progress=None, image_dpi=IMAGE_DPI, jpeg_quality=JPEG_QUALITY):
+    """
+    Build the invoice summary PDF: summary table, spending charts and invoice images.
+
+    images maps invoice IDs to PIL images; chart_paths is the (pie, line, bar) tuple from
+    utils.spending_trends(silent=True). progress, if given, is called with a fraction in
+    [0, 1] and a short message as work completes. Images are downscaled to image_dpi and
+    embedded as JPEG at jpeg_quality. Returns a spooled file positioned at the start of
+    the finished PDF.
+    """
+    total_work = len(invoices) + (CHART_WORK if chart_paths else 0) + IMAGE_WORK * len(images) + FINISH_WORK
+    done = 0
+    reported = -1
+
+    def advance(amount, message):
+        # Only report whole-percent changes so long tables don't flood the UI with updates
+        nonlocal done, reported
+        done += amount
+        percent = min(100 * done // total_work, 100)
+        if progress and percent != reported:
+            reported = percent
+            progress(percent / 100, message)
+
+    pdf = SpooledPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.set_font("Arial", style='B', size=14)
+    pdf.cell(200, 10, "Invoice Summary", ln=True, align="C")
+    pdf.ln(10)
+
+    # Step 1: Summary table
+    add_summary_table(pdf, invoices, on_row=lambda: advance(1, "Adding invoice summary table..."))
+
+    # Step 2: Spending trends charts
+    if chart_paths:
+        add_chart_pages(pdf, chart_paths)
+        advance(CHART_WORK, "Adding spending charts...")
+
+    # Step 3: Invoice images
+    for invoice_id, encoded in encode_invoice_images(images, image_dpi, jpeg_quality):
+        add_invoice_image(pdf, invoice_id, encoded)
+        advance(IMAGE_WORK, f"Adding invoice image {invoice_id}...")
+
+    # Step 4: Write out the document
+    spool = pdf.finish()
+    advance(FINISH_WORK, "Finishing PDF...")
+    return spool
+
+
+def report_cache_key(invoices, images):
+    """Data version of a report: a hash of the invoices and of the images going into it."""
+    payload = json.dumps({
+        "invoices": invoices,
+        # Saved images never change, so their ID, size and mode identify them well enough
+        "images": [[str(invoice_id), img.size, img.mode] for invoice_id, img in images.items()],
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _run_report_job(invoices, images, render_charts, job):
+    """Build a report in the background, recording progress in the job dict. Returns the PDF bytes."""
+    def progress(fraction, message):
+        job["progress"] = (fraction, message)
+
+    progress(0.0, "Rendering spending charts...")
+    chart_paths = render_charts(invoices) if render_charts and invoices else None
+    try:
+        with build_invoice_report(invoices, images, chart_paths, progress=progress) as pdf_file:
+            return pdf_file.read()
+    finally:
+        for path in chart_paths or ():
+            os.remove(path)
+
+
+def request_report(state, invoices, images, render_charts=None):
+    """
+    Start building a report in the background unless a cached result or a running job
+    already exists for the same data. render_charts(invoices), if given, returns the chart
+    paths to include; they are removed once the report is built. Returns the cache key.
+    """
+    cache = state.setdefault("report_cache", {})
+    jobs = state.setdefault("report_jobs", {})
+    key = report_cache_key(invoices, images)
+    if key not in cache and key not in jobs:
+        # Snapshot the inputs so later uploads don't change what the job sees
+        job = {"progress": (0.0, "Waiting for another report to finish...")}
+        job["future"] = _report_executor.submit(
+            _run_report_job, [dict(inv) for inv in invoices], dict(images), render_charts, job)
+        jobs[key] = job
+    return key
+
+
+def get_report(state, key):
+    """
+    Look up a report by cache key, collecting finished background jobs.
+    Returns (status, result) where status is "ready" (PDF bytes), "pending"
+    ((fraction, message) progress), "error" (message) or "missing".
+    """
+    cache = state.setdefault("report_cache", {})
+    jobs = state.setdefault("report_jobs", {})
+    if key in cache:
+        return "ready", cache[key]
+    job = jobs.get(key)
+    if job is None:
+        return "missing", None
+    if not job["future"].done():
+        return "pending", job["progress"]
+    del jobs[key]
+    try:
+        result = job["future"].result()
+    except Exception as e:
+        return "error", str(e)
+    cache[key] = result
+    while len(cache) > REPORT_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    return "ready", result
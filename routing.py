@@ -0,0 +1,186 @@
+"""
+Latency-aware routing and hedging of LLM calls across several providers (Gemini, Groq, local
+stand-ins). Each call goes to the provider with the lowest recent median latency (failures
+count against it). If it hasn't produced a valid answer by its own p90 latency, the same
+prompt goes to the next provider as well, and the first valid answer wins. The other call is
+cancelled: stand-ins stop at once; an HTTP request already sent can't be aborted, so its
+answer is discarded.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from instrumentation import count, span
+from providers import CallCancelled
+
+# Recent calls per provider that its latency estimates and error rate are taken from
+LATENCY_WINDOW = 100
+# Calls a provider needs before its estimates are trusted; until then it ranks last (a backup
+# warms up on the hedges and failovers it serves)
+MIN_SAMPLES = 10
+HEDGE_QUANTILE = 0.9
+# Hedge delay while the primary's p90 isn't known yet, and the floor under a measured one
+DEFAULT_HEDGE_DELAY = float(os.environ.get("INVOICE_HEDGE_DELAY_MS", 2000)) / 1000
+MIN_HEDGE_DELAY = 0.05
+# Each point of recent error rate adds this share to a provider's median latency when ranking
+ERROR_PENALTY = 4.0
+# Calls in flight across all routed LLMs (hedges included)
+ROUTING_WORKERS = 16
+
+_pool = ThreadPoolExecutor(max_workers=ROUTING_WORKERS, thread_name_prefix="llm-route")
+
+
+def json_object(text):
+    """True if the answer holds a JSON object (bare or with text around it)."""
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    if not match:
+        return False
+    try:
+        return isinstance(json.loads(match.group(0)), dict)
+    except json.JSONDecodeError:
+        return False
+
+
+class LatencyStats:
+    """Recent latencies and outcomes of one provider."""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.failures = deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, seconds, failed=False):
+        self.latencies.append(seconds)
+        self.failures.append(failed)
+
+    def quantile(self, q):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def error_rate(self):
+        return sum(self.failures) / len(self.failures) if self.failures else 0.0
+
+    def score(self):
+        """Ranking key, lower is better; providers still warming up go last."""
+        if len(self.latencies) < MIN_SAMPLES:
+            return float("inf")
+        return self.quantile(0.5) * (1 + ERROR_PENALTY * self.error_rate())
+
+
+class RoutedLLM:
+    """
+    Several LLMs behind the single-LLM interface, in preference order (a dict of name -> LLM).
+    With hedge=False calls still go to the fastest provider, and to the next one only on failure.
+    """
+
+    # A routed call (hedges included) is timed as one stage; each provider's calls under its name
+    stage = "llm"
+
+    def __init__(self, llms, hedge=True):
+        self.llms = dict(llms)
+        self.hedge = hedge
+        self.stats = {name: LatencyStats() for name in self.llms}
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        """Provider names, best first (ties keep the configured order)."""
+        with self._lock:
+            return sorted(self.llms, key=lambda name: self.stats[name].score())
+
+    def hedge_delay(self, name):
+        """How long to wait on a provider before hedging: its p90 latency once known."""
+        with self._lock:
+            stats = self.stats[name]
+            if len(stats.latencies) < MIN_SAMPLES:
+                return DEFAULT_HEDGE_DELAY
+            return max(MIN_HEDGE_DELAY, stats.quantile(HEDGE_QUANTILE))
+
+    def _record(self, name, seconds, failed=False):
+        with self._lock:
+            self.stats[name].add(seconds, failed)
+
+    def _call(self, name, prompt, json_output, schema, cancel):
+        started = time.perf_counter()
+        try:
+            with span(name):
+                answer = self.llms[name].generate(prompt, json_output=json_output, cancel=cancel, schema=schema)
+        except CallCancelled:
+            # Lost the race: it would have taken at least this long. Only a lower bound above the
+            # median says anything (that the provider is slow), so shorter ones aren't recorded.
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats = self.stats[name]
+                if stats.latencies and elapsed >= stats.quantile(0.5):
+                    stats.add(elapsed)
+            raise
+        except Exception:
+            self._record(name, time.perf_counter() - started, failed=True)
+            raise
+        valid = bool(answer and answer.strip()) and (not (json_output or schema) or json_object(answer))
+        self._record(name, time.perf_counter() - started, failed=not valid)
+        return answer, valid
+
+    def generate(self, prompt, json_output=False, cancel=None, schema=None):
+        """
+        The first valid answer (with json_output or a schema, one holding a JSON object). When every
+        provider answers but none validly, the first answer is returned for the caller to
+        handle; when every provider fails, the last error is raised (so 429s still reach
+        call_with_retry).
+        """
+        waiting = self.ranked()
+        running = {}
+        answers, error = [], None
+
+        def launch():
+            name = waiting.pop(0)
+            event = threading.Event()
+            running[_pool.submit(self._call, name, prompt, json_output, schema, event)] = (name, event)
+            count(f"llm_route_{name}")
+            return name
+
+        primary = launch()
+        deadline = time.perf_counter() + self.hedge_delay(primary)
+        try:
+            while running:
+                timeout = max(0.0, deadline - time.perf_counter()) if self.hedge and waiting else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if cancel is not None and cancel.is_set():
+                    raise CallCancelled()
+                if not done:
+                    hedge = launch()
+                    count("llm_hedged")
+                    deadline = time.perf_counter() + self.hedge_delay(hedge)
+                    continue
+                for future in done:
+                    name, _ = running.pop(future)
+                    try:
+                        answer, valid = future.result()
+                    except CallCancelled:
+                        continue
+                    except Exception as e:
+                        error = e
+                        count(f"llm_failed_{name}")
+                        continue
+                    if valid:
+                        if name != primary:
+                            count("llm_hedge_won")
+                        return answer
+                    answers.append(answer)
+                    count(f"llm_invalid_{name}")
+                if not running and waiting:
+                    # The call in flight failed before the hedge delay: go to the next provider now
+                    name = launch()
+                    deadline = time.perf_counter() + self.hedge_delay(name)
+        finally:
+            for future, (name, event) in running.items():
+                event.set()
+                future.cancel()
+                count("llm_cancelled")
+        if answers:
+            return answers[0]
+        raise error
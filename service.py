@@ -0,0 +1,271 @@
+"""
+HTTP ingestion service: the extraction and duplicate-detection core behind a bounded job
+queue and a worker pool, independent of Streamlit sessions.
+
+    uvicorn service:app --port 8000
+
+Uploads are accepted with 202 and a job ID and processed by INVOICE_SERVICE_WORKERS threads;
+when INVOICE_SERVICE_QUEUE jobs are already waiting, new uploads get 503 with Retry-After
+so clients back off instead of piling up work. Set INVOICE_API_URL for the Streamlit pages
+to use the service (see service_client.py).
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Optional
+
+from fastapi import FastAPI, File, HTTPException, Query, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+from duplicates import DuplicateIndex
+from extraction import PDF_PAGE_WORKERS, decode_upload, encode_png, extract_entities, extract_pdf_text, extract_text
+from instrumentation import prometheus_text, span
+from invoice_index import InvoiceIndex
+from templates import TemplateRegistry
+from vendors import VendorRegistry
+
+WORKERS = int(os.environ.get("INVOICE_SERVICE_WORKERS", 4))
+QUEUE_SIZE = int(os.environ.get("INVOICE_SERVICE_QUEUE", 64))
+# Finished jobs kept for status lookups; the oldest are forgotten first
+JOB_HISTORY = 10000
+# Suggested wait (seconds) for clients turned away by a full queue
+RETRY_AFTER = 5
+
+
+class InvoiceStore:
+    """Saved invoices, their images and the indexes over them, shared by all workers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.invoices = []
+        self.images = {}
+        self.duplicates = DuplicateIndex()
+        self.index = InvoiceIndex()
+        self.vendors = VendorRegistry()
+        self.templates = TemplateRegistry()
+
+    def save(self, invoice_data, png_bytes, check_duplicates=True):
+        """
+        Save an invoice unless it duplicates a stored one. Checking and saving happen under
+        one lock, so two copies of the same invoice uploaded together can't both get in.
+        Returns (invoice_id, duplicate_id, similarity_score); invoice_id is None for a duplicate.
+        """
+        with self.lock:
+            if check_duplicates:
+                with span("duplicate_check"):
+                    duplicate_id, similarity_score = self.duplicates.find(invoice_data["extracted_text"])
+                if duplicate_id:
+                    return None, duplicate_id, similarity_score
+            with span("save"):
+                invoice_id = len(self.invoices) + 1
+                invoice_data["id"] = invoice_id
+                self.invoices.append(invoice_data)
+                self.images[invoice_id] = png_bytes
+                self.duplicates.add(invoice_id, invoice_data["extracted_text"])
+                self.index.add(invoice_data)
+                self.vendors.add(invoice_data)
+                self.templates.add(invoice_data)
+            return invoice_id, None, 0
+
+    def get(self, invoice_id):
+        with self.lock:
+            if 1 <= invoice_id <= len(self.invoices):
+                return self.invoices[invoice_id - 1]
+        return None
+
+
+class JobQueue:
+    """Bounded queue of upload jobs worked off by a fixed pool of threads."""
+
+    def __init__(self, store, workers=WORKERS, size=QUEUE_SIZE):
+        self.store = store
+        self.pending = queue.Queue(maxsize=size)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name=f"ingest-{i}", daemon=True) for i in range(workers)]
+        # PDF pages of all workers' uploads, so page concurrency scales with the worker count
+        self.page_pool = ThreadPoolExecutor(max_workers=workers * PDF_PAGE_WORKERS, thread_name_prefix="ingest-page")
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, file_name, data):
+        """Queue an upload; returns the job, or None when the queue is full."""
+        job = {"id": uuid.uuid4().hex, "file_name": file_name, "status": "queued", "submitted": time.time(),
+               "finished": None, "invoice_id": None, "duplicate_of": None, "similarity_score": 0, "error": None}
+        with self.lock:
+            self.jobs[job["id"]] = job
+            self._forget_old_jobs()
+        try:
+            self.pending.put_nowait((job, data))
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job["id"]]
+            return None
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def accept(self, job_id):
+        """Save a job's invoice despite the duplicate warning (the UI's "Proceed to Save Anyway")."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "duplicate":
+                return None
+            invoice_data, png_bytes = job.pop("pending_invoice")
+            # A second accept while this one saves gets None (409), not a missing pending_invoice
+            job["status"] = "saving"
+        invoice_id, _, _ = self.store.save(invoice_data, png_bytes, check_duplicates=False)
+        self._update(job, status="done", invoice_id=invoice_id)
+        return self.get(job_id)
+
+    def discard(self, job_id):
+        """Drop a job's held-back duplicate (the UI's "Discard") instead of keeping it until the job is forgotten."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "duplicate":
+                return None
+            job.pop("pending_invoice", None)
+            job["status"] = "discarded"
+            return dict(job)
+
+    def _forget_old_jobs(self):
+        while len(self.jobs) > JOB_HISTORY:
+            oldest = next(iter(self.jobs))
+            if self.jobs[oldest]["status"] in ("queued", "running", "saving"):
+                break
+            del self.jobs[oldest]
+
+    def _update(self, job, **changes):
+        with self.lock:
+            job.update(changes)
+
+    def _work(self):
+        while True:
+            job, data = self.pending.get()
+            self._update(job, status="running")
+            try:
+                if job["file_name"].lower().endswith(".pdf"):
+                    text, image = extract_pdf_text(data, page_pool=self.page_pool)
+                    png_bytes = encode_png(image)
+                else:
+                    image = decode_upload(job["file_name"], data)
+                    png_bytes = encode_png(image)
+                    text = extract_text(image, png_bytes=png_bytes)
+                invoice_data = extract_entities(text, vendors=self.store.vendors, templates=self.store.templates)
+                invoice_data["extracted_text"] = text
+                invoice_id, duplicate_id, similarity_score = self.store.save(invoice_data, png_bytes)
+                if invoice_id is None:
+                    self._update(job, status="duplicate", duplicate_of=duplicate_id, similarity_score=similarity_score,
+                                 pending_invoice=(invoice_data, png_bytes))
+                else:
+                    self._update(job, status="done", invoice_id=invoice_id)
+            except Exception as e:
+                self._update(job, status="failed", error=f"{type(e).__name__}: {e}")
+            finally:
+                self._update(job, finished=time.time())
+                self.pending.task_done()
+
+
+def _public_job(job):
+    job.pop("pending_invoice", None)
+    return job
+
+
+store = InvoiceStore()
+jobs = JobQueue(store)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    jobs.start()
+    yield
+
+
+app = FastAPI(title="Invoice ingestion service", lifespan=lifespan)
+
+
+@app.post("/invoices", status_code=202)
+async def upload_invoice(file: UploadFile = File(...)):
+    """Queue an invoice image or PDF for extraction; poll /jobs/{id} for the result."""
+    job = jobs.submit(file.filename or "upload", await file.read())
+    if job is None:
+        return JSONResponse({"detail": "Ingestion queue is full, retry later."}, status_code=503,
+                            headers={"Retry-After": str(RETRY_AFTER)})
+    return _public_job(dict(job))
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job")
+    return _public_job(job)
+
+
+@app.post("/jobs/{job_id}/accept")
+def accept_duplicate(job_id: str):
+    """Save an invoice that was held back as a duplicate."""
+    job = jobs.accept(job_id)
+    if job is None:
+        raise HTTPException(409, "Job is not waiting on a duplicate decision")
+    return _public_job(job)
+
+
+@app.post("/jobs/{job_id}/discard")
+def discard_duplicate(job_id: str):
+    """Drop an invoice that was held back as a duplicate."""
+    job = jobs.discard(job_id)
+    if job is None:
+        raise HTTPException(409, "Job is not waiting on a duplicate decision")
+    return _public_job(job)
+
+
+@app.get("/invoices")
+def query_invoices(start: Optional[date] = None, end: Optional[date] = None,
+                   category: Optional[List[str]] = Query(None), store_name: Optional[List[str]] = Query(None),
+                   gstin: Optional[str] = None, min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                   after_id: int = 0):
+    """Saved invoices matching every given filter (as on the Dashboard), optionally only those after an ID."""
+    with store.lock:
+        matches = store.index.query(start=start, end=end, categories=category, stores=store_name, gstin=gstin,
+                                    min_amount=min_amount, max_amount=max_amount)
+    return [invoice for invoice in matches if invoice["id"] > after_id]
+
+
+@app.get("/invoices/{invoice_id}")
+def get_invoice(invoice_id: int):
+    invoice = store.get(invoice_id)
+    if invoice is None:
+        raise HTTPException(404, "Unknown invoice")
+    return invoice
+
+
+@app.get("/invoices/{invoice_id}/image")
+def get_invoice_image(invoice_id: int):
+    with store.lock:
+        png_bytes = store.images.get(invoice_id)
+    if png_bytes is None:
+        raise HTTPException(404, "Unknown invoice")
+    return Response(png_bytes, media_type="image/png")
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "queued": jobs.pending.qsize(), "queue_size": QUEUE_SIZE,
+            "workers": len(jobs.threads), "invoices": len(store.invoices)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return prometheus_text()
@@ -0,0 +1,78 @@
+import io
+import os
+
+import requests
+from PIL import Image
+
+# Base URL of the ingestion service (service.py); when unset the pages process uploads themselves
+API_URL = os.environ.get("INVOICE_API_URL", "").rstrip("/")
+TIMEOUT = 30
+
+
+def enabled():
+    return bool(API_URL)
+
+
+class QueueFullError(Exception):
+    """The service turned the upload away; retry after retry_after seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"The ingestion service is busy, retry in {retry_after} s.")
+        self.retry_after = retry_after
+
+
+def submit_invoice(file_name, data, content_type=None):
+    """Upload an invoice file; returns the queued job."""
+    response = requests.post(f"{API_URL}/invoices", files={"file": (file_name, data, content_type)}, timeout=TIMEOUT)
+    if response.status_code == 503:
+        raise QueueFullError(int(response.headers.get("Retry-After", 5)))
+    response.raise_for_status()
+    return response.json()
+
+
+def job_status(job_id):
+    response = requests.get(f"{API_URL}/jobs/{job_id}", timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def accept_duplicate(job_id):
+    response = requests.post(f"{API_URL}/jobs/{job_id}/accept", timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def discard_duplicate(job_id):
+    response = requests.post(f"{API_URL}/jobs/{job_id}/discard", timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_invoice(invoice_id):
+    response = requests.get(f"{API_URL}/invoices/{invoice_id}", timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_invoice_image(invoice_id):
+    response = requests.get(f"{API_URL}/invoices/{invoice_id}/image", timeout=TIMEOUT)
+    response.raise_for_status()
+    return Image.open(io.BytesIO(response.content))
+
+
+def sync_invoices(state):
+    """
+    Bring the session's invoices and images up to date with the service, fetching only
+    invoices saved since the last sync (so clearing the session's data keeps it cleared).
+    """
+    invoices = state.setdefault("invoices", [])
+    images = state.setdefault("invoice_images", {})
+    response = requests.get(f"{API_URL}/invoices", params={"after_id": state.get("service_last_id", 0)},
+                            timeout=TIMEOUT)
+    response.raise_for_status()
+    new_invoices = response.json()
+    for invoice in new_invoices:
+        invoices.append(invoice)
+        images[invoice["id"]] = get_invoice_image(invoice["id"])
+        state["service_last_id"] = invoice["id"]
+    return new_invoices
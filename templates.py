@@ -0,0 +1,223 @@
+"""
+Per-vendor extraction templates learned from earlier LLM results. For a vendor (GSTIN) with
+enough saved invoices, each of bill number, date and total is found at the same anchor every
+time: the label before it on its line ("Total Amount"), or the label line just above it.
+When all three anchors match a new invoice and the values pass the consistency checks, the
+LLM call is skipped; a sample of template results is still sent to the LLM to measure accuracy.
+"""
+import os
+import random
+import re
+import threading
+from collections import Counter, deque
+from datetime import datetime
+
+from instrumentation import count
+from vendors import valid_gstin
+
+TEMPLATE_FIELDS = ("bill_no", "date", "total_amount")
+# LLM-extracted invoices of a vendor needed before a template is learned, and how many are kept
+MIN_TEMPLATE_INVOICES = 3
+MAX_TEMPLATE_EXAMPLES = 20
+# Share of a vendor's examples that must put a field at the same anchor
+MIN_ANCHOR_AGREEMENT = 0.8
+# Words of the label kept as the anchor
+ANCHOR_WORDS = 3
+# Share of template hits also sent to the LLM to measure template accuracy
+AUDIT_RATE = float(os.environ.get("INVOICE_TEMPLATE_AUDIT_RATE", 0.1))
+
+VALUE_PATTERNS = {
+    "bill_no": re.compile(r"[A-Za-z0-9][A-Za-z0-9/-]*"),
+    "date": re.compile(r"\d{1,2}[/.-]\d{1,2}[/.-]\d{4}"),
+    "total_amount": re.compile(r"(?:₹|rs\.?|inr)?\s*\d[\d,]*(?:\.\d{1,2})?", re.IGNORECASE),
+}
+
+
+def _label(prefix):
+    """The last ANCHOR_WORDS words of a label, lowercased, without punctuation or numbers."""
+    return " ".join(re.findall(r"[a-z]+", prefix.lower())[-ANCHOR_WORDS:])
+
+
+def normalize_value(field, value):
+    """A field value in the form it's stored in (amount without currency or commas, DD/MM/YYYY dates)."""
+    value = str(value).strip()
+    if field == "total_amount":
+        value = re.sub(r"(?i)₹|rs\.?|inr|,|\s", "", value)
+        try:
+            return f"{float(value):.2f}"
+        except ValueError:
+            return None
+    if field == "date":
+        parts = re.split(r"[/.-]", value)
+        if len(parts) != 3 or not all(part.isdigit() for part in parts):
+            return None
+        return f"{int(parts[0]):02d}/{int(parts[1]):02d}/{parts[2]}"
+    return value or None
+
+
+def value_shape(value):
+    """Character classes of a bill number, runs collapsed: "INV-2024/0012" -> "A-9/9"."""
+    return re.sub(r"([A9])\1+", r"\1", re.sub(r"\d", "9", re.sub(r"[A-Za-z]", "A", value)))
+
+
+def _lines(text):
+    return [line.strip() for line in (text or "").splitlines() if line.strip()]
+
+
+def find_anchor(text, field, value):
+    """Where value sits in the text: ("same", label) or ("next", label line), or None if it isn't there."""
+    expected = normalize_value(field, value)
+    if not expected:
+        return None
+    lines = _lines(text)
+    for i, line in enumerate(lines):
+        for match in VALUE_PATTERNS[field].finditer(line):
+            if normalize_value(field, match.group(0)) != expected:
+                continue
+            label = _label(line[:match.start()])
+            if label:
+                return "same", label
+            if i and match.start() == 0 and _label(lines[i - 1]):
+                return "next", _label(lines[i - 1])
+    return None
+
+
+def apply_anchor(text, field, anchor):
+    """The field's value at the anchor in the text, normalized, or None."""
+    position, label = anchor
+    lines = _lines(text)
+    for i, line in enumerate(lines):
+        if position == "same":
+            for match in VALUE_PATTERNS[field].finditer(line):
+                if _label(line[:match.start()]) == label:
+                    return normalize_value(field, match.group(0))
+        elif _label(line) == label and i + 1 < len(lines):
+            match = VALUE_PATTERNS[field].match(lines[i + 1])
+            if match:
+                return normalize_value(field, match.group(0))
+    return None
+
+
+def learn_template(examples):
+    """
+    A template from a vendor's LLM-extracted invoices: per field the anchor at least
+    MIN_ANCHOR_AGREEMENT of them agree on, plus the bill-number shapes seen. None if any
+    field has no such anchor.
+    """
+    if len(examples) < MIN_TEMPLATE_INVOICES:
+        return None
+    template = {"anchors": {}, "bill_shapes": set()}
+    for field in TEMPLATE_FIELDS:
+        anchors = Counter(find_anchor(example["extracted_text"], field, example.get(field)) for example in examples)
+        anchor, agreeing = anchors.most_common(1)[0]
+        if anchor is None or agreeing < MIN_ANCHOR_AGREEMENT * len(examples):
+            return None
+        template["anchors"][field] = anchor
+    template["bill_shapes"] = {value_shape(str(example["bill_no"])) for example in examples}
+    return template
+
+
+def consistent(fields, template):
+    """Consistency rules for a template result: a positive total, a real past date, a bill number of a known shape."""
+    try:
+        if not 0 < float(fields["total_amount"]) < 1e9:
+            return False
+        invoice_date = datetime.strptime(fields["date"], "%d/%m/%Y")
+    except (TypeError, ValueError):
+        return False
+    if not datetime(2000, 1, 1) <= invoice_date <= datetime.now():
+        return False
+    bill_no = fields["bill_no"]
+    return value_shape(bill_no) in template["bill_shapes"] and bill_no not in (fields["date"], fields["total_amount"])
+
+
+class TemplateRegistry:
+    """LLM-extracted examples per vendor and the templates learned from them; safe to use from worker threads."""
+
+    def __init__(self, invoices=()):
+        self.examples = {}
+        self.templates = {}
+        self.recorded = 0
+        self.last_invoice = None
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        for invoice in invoices:
+            self.add(invoice)
+
+    def __len__(self):
+        return self.recorded
+
+    def add(self, invoice):
+        """Record a saved invoice; only LLM results with a valid GSTIN become examples."""
+        gstin = valid_gstin(invoice.get("gstin"))
+        with self._lock:
+            self.recorded += 1
+            self.last_invoice = invoice
+            if gstin is None or invoice.get("extracted_by") == "template" or not invoice.get("extracted_text"):
+                return
+            self.examples.setdefault(gstin, deque(maxlen=MAX_TEMPLATE_EXAMPLES)).append(
+                {field: invoice.get(field) for field in TEMPLATE_FIELDS + ("extracted_text",)})
+            # Relearned on next use
+            self.templates.pop(gstin, None)
+
+    def template(self, gstin):
+        with self._lock:
+            if gstin not in self.templates:
+                self.templates[gstin] = learn_template(list(self.examples.get(gstin, ())))
+            return self.templates[gstin]
+
+    def apply(self, gstin, text):
+        """Bill number, date and total for the vendor's invoice text, or None if the template doesn't apply cleanly."""
+        template = self.template(gstin)
+        if template is None:
+            count("template_unavailable")
+            return None
+        fields = {field: apply_anchor(text, field, anchor) for field, anchor in template["anchors"].items()}
+        if None in fields.values():
+            count("template_miss")
+            return None
+        if not consistent(fields, template):
+            count("template_rejected")
+            return None
+        count("template_hit")
+        return fields
+
+    def should_audit(self):
+        with self._lock:
+            return self._random.random() < AUDIT_RATE
+
+
+def record_audit(template_fields, llm_fields):
+    """Compare a template result with the LLM's answer for the same invoice."""
+    agrees = all(normalize_value(field, llm_fields.get(field, "")) == value for field, value in template_fields.items())
+    count("template_audit_agree" if agrees else "template_audit_disagree")
+    return agrees
+
+
+def template_stats(events):
+    """Hit rate among attempts and audited accuracy, from instrumentation counters."""
+    attempts = sum(events.get(f"template_{outcome}", 0) for outcome in ("hit", "miss", "rejected", "unavailable"))
+    audits = events.get("template_audit_agree", 0) + events.get("template_audit_disagree", 0)
+    return {
+        "attempts": attempts,
+        "hit_rate": events.get("template_hit", 0) / attempts if attempts else None,
+        "audits": audits,
+        "accuracy": events.get("template_audit_agree", 0) / audits if audits else None,
+    }
+
+
+def sync_template_registry(state, invoices):
+    """Return the session's template registry, rebuilding it if it no longer matches the invoices."""
+    registry = state.get("template_registry")
+    if registry is None or len(registry) != len(invoices) or (invoices and registry.last_invoice is not invoices[-1]):
+        registry = state["template_registry"] = TemplateRegistry(invoices)
+    return registry
+
+
+def record_template_example(state, invoices, invoice):
+    """Add a newly saved invoice to the session's template registry if it is otherwise up to date."""
+    registry = state.get("template_registry")
+    if registry is not None and len(registry) == len(invoices) - 1:
+        registry.add(invoice)
+    else:
+        state.pop("template_registry", None)
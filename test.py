@@ -2,8 +2,6 @@ import io
 import json
 import os
 import re
-import base64
-import requests
 from fpdf import FPDF
 from PIL import Image
 from pdf2image import convert_from_bytes
@@ -17,7 +15,8 @@ import time
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import replicate
+from concurrent.futures import ThreadPoolExecutor
+from forgery import HEATMAP_THRESHOLD, detect_forgery_replicate, find_duplicate_image, heatmap_image, image_fingerprint, screen_invoice
 from utils import spending_trends
 
 
@@ -29,6 +28,9 @@ vision_client = vision.ImageAnnotatorClient(credentials=credentials)
 # Required columns
 REQUIRED_COLUMNS = ["store_name", "date", "bill_no", "total_amount", "extracted_text"]
 
+# Upload stages run side by side, so an invoice takes as long as its slowest stage
+_pipeline = ThreadPoolExecutor(max_workers=3, thread_name_prefix="invoice-upload")
+
 # Initialize session state
 if "invoices" not in st.session_state:
     st.session_state.invoices = []
@@ -85,9 +87,9 @@ def extract_entities(text):
             "category": "Others"
         }
 
-def check_duplicate(extracted_text, threshold=90):
-    """Compare extracted text with session state invoices for duplicate detection."""
-    for stored_invoice in st.session_state.invoices:
+def check_duplicate(extracted_text, threshold=90, invoices=None):
+    """Compare extracted text with session state (or the given) invoices for duplicate detection."""
+    for stored_invoice in st.session_state.invoices if invoices is None else invoices:
         similarity_score = fuzz.ratio(extracted_text, stored_invoice["extracted_text"])
         if similarity_score >= threshold:
             return stored_invoice["id"], similarity_score
@@ -115,6 +117,8 @@ def clear_session_state_data():
     """Clear all invoices and images from session state."""
     st.session_state.invoices.clear()
     st.session_state.invoice_images.clear()
+    st.session_state.pop("invoice_fingerprints", None)
+    st.session_state.pop("upload_key", None)
 
 def spending_trends():
     invoices_df = pd.DataFrame(st.session_state.invoices)
@@ -257,27 +261,50 @@ def generate_invoice_pdf():
     if os.path.exists(pdf_path):
         os.remove(pdf_path)
 
-# NEW FUNCTION: Automated fake invoice detection using Replicate's ManTra-Net API
-def detect_forgery_replicate(image):
-    """Detect forgery in the invoice image using Replicate's ManTra-Net API via the official Python client."""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    data_url = f"data:image/png;base64,{img_str}"
-    
-    # Extract API key correctly
-    API_KEY = st.secrets["REPLICATE_API_KEY"]["value"]
-    client = replicate.Client(api_token=API_KEY)
-    
-    # Use the correct model identifier (verify on Replicate's model page)
-    model_identifier = "highwaywu/image-forgery-detection:ab6f81afdf0de95354d44b61c18f4dfe31dc0ad83da8b0406d57afff8f6ace08"
-    
-    try:
-        output = client.run(model_identifier, input={"image": data_url})
-        return output
-    except Exception as e:
-        st.error("Error running forgery detection model: " + str(e))
-        return None
+def invoice_fingerprints():
+    """Perceptual fingerprints of the saved invoice images, computed once per image."""
+    fingerprints = st.session_state.setdefault("invoice_fingerprints", {})
+    for invoice_id, img in st.session_state.invoice_images.items():
+        if invoice_id not in fingerprints:
+            fingerprints[invoice_id] = image_fingerprint(img)
+    return dict(fingerprints)
+
+def screen_for_forgery(image, api_token=None):
+    """Local forgery screen, escalated to the remote model for borderline results when a token is given."""
+    screening = screen_invoice(image)
+    screening["remote"] = screening["remote_error"] = None
+    if screening["escalate"] and api_token:
+        try:
+            screening["remote"] = detect_forgery_replicate(image, api_token)
+        except Exception as e:
+            screening["remote_error"] = str(e)
+    return screening
+
+def read_invoice(image, invoices):
+    """OCR, entity extraction and the text duplicate check for one invoice image."""
+    extracted_text = extract_text(image)
+    invoice_data = extract_entities(extracted_text)
+    invoice_data["extracted_text"] = extracted_text
+    return invoice_data, check_duplicate(extracted_text, invoices=invoices)
+
+def process_upload(image):
+    """
+    Run forgery screening, OCR and the image duplicate check at the same time and wait
+    for all of them. Background threads can't read st.session_state, so each stage gets
+    a snapshot of what it needs.
+    """
+    api_token = st.secrets["REPLICATE_API_KEY"]["value"] if "REPLICATE_API_KEY" in st.secrets else None
+    screening = _pipeline.submit(screen_for_forgery, image, api_token)
+    reading = _pipeline.submit(read_invoice, image, list(st.session_state.invoices))
+    image_duplicate = _pipeline.submit(find_duplicate_image, image, invoice_fingerprints())
+    invoice_data, text_duplicate = reading.result()
+    return {
+        "screening": screening.result(),
+        "invoice_data": invoice_data,
+        "text_duplicate": text_duplicate,
+        "image_duplicate": image_duplicate.result(),
+        "saved_id": None,
+    }
 
 # Streamlit UI
 st.title("Invoice Management System")
@@ -291,69 +318,52 @@ if uploaded_file:
     elif file_type == "pdf":
         image = process_pdf(uploaded_file)
     
-    # First: Send the image for forgery detection
+    # Results are kept per upload so the override buttons' reruns don't repeat the work; file_id
+    # is new for every upload, so a different file with the same name and size is processed afresh
+    upload_key = uploaded_file.file_id
+    if st.session_state.get("upload_key") != upload_key:
+        st.session_state.upload_key = upload_key
+        st.session_state.upload_results = process_upload(image)
+    results = st.session_state.upload_results
+    screening = results["screening"]
+
+    # Decision point: the forgery verdict, with the option to accept the invoice anyway
     st.subheader("Forgery Detection Result")
-    forgery_output = detect_forgery_replicate(image)
-    
-    forgery_image = None
-    if forgery_output:
-        # Convert the output to a PIL image if necessary
-        if hasattr(forgery_output, "read"):
-            try:
-                image_data = forgery_output.read()
-                forgery_image = Image.open(io.BytesIO(image_data))
-            except Exception as e:
-                st.error("Error processing output image: " + str(e))
-        elif isinstance(forgery_output, str) and forgery_output.startswith("http"):
-            try:
-                response = requests.get(forgery_output)
-                forgery_image = Image.open(io.BytesIO(response.content))
-            except Exception as e:
-                st.error("Error downloading output image: " + str(e))
-        elif isinstance(forgery_output, Image.Image):
-            forgery_image = forgery_output
-        else:
-            # If the output is a URL-like string, try downloading it
-            try:
-                response = requests.get(forgery_output)
-                forgery_image = Image.open(io.BytesIO(response.content))
-            except Exception as e:
-                st.error("Error processing forgery detection output: " + str(e))
-    
-    if forgery_image is not None:
-        st.image(forgery_image, caption="Forgery Detection Heatmap", use_column_width=True)
-        # Analyze heatmap intensity
-        try:
-            heatmap_response = requests.get(forgery_output)
-            heatmap_img = Image.open(io.BytesIO(heatmap_response.content))
-            gray_heatmap = heatmap_img.convert("L")
-            pixels = list(gray_heatmap.getdata())
-            avg_intensity = sum(pixels) / len(pixels)
-            st.write(f"Heatmap average intensity: {avg_intensity:.2f}")
-        except Exception as e:
-            st.error("Error analyzing heatmap intensity: " + str(e))
-            avg_intensity = 0
-        THRESHOLD_INTENSITY = 150  # Adjust as needed
-        if avg_intensity > THRESHOLD_INTENSITY:
-            st.error("Invoice appears to be forged based on heatmap intensity!")
-            if not st.button("Proceed to Accept Invoice Anyway"):
-                st.stop()  # Stop processing if user does not override
-        else:
-            st.success("No significant forgery detected.")
+    forged = screening["forged"]
+    st.image(heatmap_image(screening, image.size), caption="Forgery Detection Heatmap", use_column_width=True)
+    st.write(f"Inconsistent blocks in the densest region: {screening['region_share']:.0%}")
+    if screening["remote_error"]:
+        st.error("Error running forgery detection model: " + screening["remote_error"])
+    if screening["remote"] is not None:
+        # Borderline results got a second opinion from the remote model
+        forgery_image, avg_intensity = screening["remote"]
+        st.image(forgery_image, caption="ManTra-Net Heatmap", use_column_width=True)
+        st.write(f"Heatmap average intensity: {avg_intensity:.2f}")
+        forged = avg_intensity > HEATMAP_THRESHOLD
+
+    if forged:
+        st.error("Invoice appears to be forged based on the forgery heatmap!")
+        if not st.button("Proceed to Accept Invoice Anyway"):
+            st.stop()  # Stop processing if user does not override
     else:
-        st.success("No forgery detected.")
+        st.success("No significant forgery detected.")
 
-    # If forgery check passed (or user overrode), proceed with invoice processing
-    extracted_text = extract_text(image)
+    # If forgery check passed (or user overrode), show the invoice read in parallel with it
+    invoice_data = results["invoice_data"]
     st.subheader("Extracted Invoice Raw Text")
-    st.text(extracted_text)
-    invoice_data = extract_entities(extracted_text)
-    invoice_data["extracted_text"] = extracted_text
+    st.text(invoice_data["extracted_text"])
     st.subheader("Extracted Invoice Details")
     st.json(invoice_data)
-    duplicate_id, similarity_score = check_duplicate(extracted_text)
-    if duplicate_id:
-        st.warning(f"⚠ Duplicate Invoice Detected! (ID: {duplicate_id}, Similarity Score: {similarity_score}%)")
+    duplicate_id, similarity_score = results["text_duplicate"]
+    image_duplicate_id, distance = results["image_duplicate"]
+    if results["saved_id"]:
+        st.success(f"✅ Invoice saved with ID: {results['saved_id']}.")
+    elif duplicate_id or image_duplicate_id:
+        if duplicate_id:
+            st.warning(f"⚠ Duplicate Invoice Detected! (ID: {duplicate_id}, Similarity Score: {similarity_score}%)")
+        else:
+            duplicate_id = image_duplicate_id
+            st.warning(f"⚠ Duplicate Invoice Detected! (ID: {duplicate_id}, image fingerprint differs in {distance} of 64 bits)")
         existing_image = st.session_state.invoice_images[duplicate_id]
         col1, col2 = st.columns(2)
         with col1:
@@ -361,11 +371,11 @@ if uploaded_file:
         with col2:
             st.image(existing_image, caption="Existing Invoice", use_column_width=True)
         if st.button("Proceed to Save Anyway"):
-            saved_id = save_to_session_state(invoice_data, image)
-            st.success(f"Invoice saved with ID: {saved_id}.")
+            results["saved_id"] = save_to_session_state(invoice_data, image)
+            st.success(f"Invoice saved with ID: {results['saved_id']}.")
     else:
-        saved_id = save_to_session_state(invoice_data, image)
-        st.success(f"✅ Invoice saved with ID: {saved_id}.")
+        results["saved_id"] = save_to_session_state(invoice_data, image)
+        st.success(f"✅ Invoice saved with ID: {results['saved_id']}.")
 
 if st.button("Sum of All Invoices"):
     total_sum = calculate_total_amount()
@@ -380,7 +390,9 @@ if st.button("Clear All Data (Invoices & Images)"):
     st.rerun()
 
 if st.button("Generate Invoice Summary PDF"):
-    generate_invoice_pdf()from groq import Groq
+    generate_invoice_pdf()
+
+# from groq import Groq
 
 # client = Groq()
 # completion = client.chat.completions.create(
@@ -0,0 +1,103 @@
+"""
+Shrinks OCR text before it goes into the entity-extraction prompt. Lines are scored by how
+likely they are to carry a field we extract (totals, GSTIN, bill number, date, amounts, the
+store name at the top); repeated lines and legal boilerplate are dropped, and if the text is
+still over the token budget only the best-scoring lines are kept, in their original order.
+"""
+import os
+import re
+
+from categories import CATEGORY_KEYWORDS
+
+# Prompt budget for the invoice text; INVOICE_PROMPT_TOKENS=0 turns pruning off
+PROMPT_TOKEN_BUDGET = int(os.environ.get("INVOICE_PROMPT_TOKENS", 400))
+# Rough size of a token for Latin-script invoice text
+CHARS_PER_TOKEN = 4
+# The store name is nearly always in the first few lines and rarely has anything else to score on
+HEADER_LINES = 3
+# Lines this long without an amount are almost always terms and conditions
+LONG_LINE_CHARS = 90
+
+FIELD_KEYWORDS = [
+    (re.compile(r"\b(?:grand\s+)?total\b|\bnet\s+(?:amount|payable)\b|\bamount\s+(?:due|payable)\b|\bbalance\s+due\b",
+                re.IGNORECASE), 6),
+    (re.compile(r"\bgst\s*in\b|\bgstin\b", re.IGNORECASE), 5),
+    (re.compile(r"\b(?:bill|invoice|receipt|txn|transaction)\s*(?:no|num|number|#|id)\b|\bpnr\b", re.IGNORECASE), 5),
+    (re.compile(r"\bdate\b|\bdated\b", re.IGNORECASE), 4),
+    (re.compile(r"\b(?:amount|fare|price|tax|cgst|sgst|igst|qty|rate)\b", re.IGNORECASE), 2),
+    # Category hints, from the editable keyword table in categories.py
+    (re.compile(r"\b(?:" + "|".join(re.escape(word) for words in CATEGORY_KEYWORDS.values()
+                                     for word in sorted(words, key=len, reverse=True)) + r")\b", re.IGNORECASE), 2),
+]
+GSTIN_VALUE = re.compile(r"\b\d{2}[A-Z0-9]{10}[0-9A-Z]Z[0-9A-Z]\b")
+DATE_VALUE = re.compile(r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b|\b\d{1,2}[ -][A-Za-z]{3,9}[ ,-]+\d{2,4}\b")
+CURRENCY = re.compile(r"₹|\brs\.?(?=\s|\d)|\binr\b", re.IGNORECASE)
+AMOUNT = re.compile(r"\d[\d,]*\.\d{2}\b")
+DIGIT = re.compile(r"\d")
+DISCLAIMER = re.compile(
+    r"terms\s*(?:&|and)\s*conditions|\bliable\b|\boffence\b|\bpenali[sz]ed\b|\bjurisdiction\b|computer[- ]generated"
+    r"|does not require|\bsignature\b|thank\s*you|visit (?:again|us)|\bplease\b|\bprescribed\b|\bapplicable\b"
+    r"|\bcharged per\b|\bno (?:exchange|refund)|subject to|\bnot valid\b|\bE\.?\s*&\s*O\.?E\b",
+    re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def line_score(line, position):
+    """Relevance of one line for entity extraction; boilerplate scores below zero."""
+    score = sum(weight for pattern, weight in FIELD_KEYWORDS if pattern.search(line))
+    if GSTIN_VALUE.search(line):
+        score += 6
+    if DATE_VALUE.search(line):
+        score += 4
+    if CURRENCY.search(line):
+        score += 3
+    if AMOUNT.search(line):
+        score += 2
+    elif DIGIT.search(line):
+        score += 1
+    if position < HEADER_LINES:
+        score += 5
+    if DISCLAIMER.search(line):
+        score -= 8
+    elif len(line) > LONG_LINE_CHARS and not AMOUNT.search(line):
+        score -= 4
+    return score
+
+
+def prune_text(text, max_tokens=PROMPT_TOKEN_BUDGET):
+    """
+    The lines of text worth sending to the LLM, at most max_tokens long (the best-scoring lines
+    win). A value on the line after its label ("GSTIN:" then the number) scores with the label.
+    max_tokens of 0 or None returns text unchanged.
+    """
+    if not max_tokens or not text:
+        return text
+    lines, seen = [], set()
+    for line in text.splitlines():
+        line = line.strip()
+        key = re.sub(r"\W+", "", line.lower())
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+
+    scores = [line_score(line, position) for position, line in enumerate(lines)]
+    for i in range(1, len(lines)):
+        # Vision often splits "label" and "value" across lines; the value inherits the label's relevance
+        if scores[i - 1] > 0 and scores[i] >= 0 and DIGIT.search(lines[i]) and not DIGIT.search(lines[i - 1]):
+            scores[i] = max(scores[i], scores[i - 1])
+    kept = [i for i, score in enumerate(scores) if score >= 0]
+
+    budget = max_tokens * CHARS_PER_TOKEN
+    if sum(len(lines[i]) + 1 for i in kept) > budget:
+        chosen, used = [], 0
+        # Highest score first; ties go to the earlier line
+        for i in sorted(kept, key=lambda i: (-scores[i], i)):
+            if used + len(lines[i]) + 1 <= budget:
+                chosen.append(i)
+                used += len(lines[i]) + 1
+        kept = sorted(chosen)
+    return "\n".join(lines[i] for i in kept)
@@ -1,16 +1,89 @@
-<<<<<<< HEAD
 import pandas as pd
+import requests
 import matplotlib.pyplot as plt
 import seaborn as sns
 import streamlit as st
 import tempfile
+from fuzzywuzzy import fuzz
+from forecast import DEFAULT_SEASON_LENGTH, forecast_frame
+from instrumentation import counters, enabled, json_text, prometheus_text, recent_spans, snapshot, timed
+from report import get_report, report_cache_key, request_report
+from templates import template_stats
+import service_client
+from vendors import canonical_store_names
 
-def spending_trends(silent=False):
+@timed("duplicate_check")
+def check_duplicate(extracted_text, threshold=90, invoices=None):
+    """Compare extracted text with session state (or the given) invoices for duplicate detection."""
+    for stored_invoice in st.session_state.invoices if invoices is None else invoices:
+        stored_text = stored_invoice.get("extracted_text", "")
+        similarity_score = fuzz.ratio(extracted_text, stored_text)
+        if similarity_score >= threshold:
+            return stored_invoice["id"], similarity_score
+    return None, 0
+
+
+def calculate_total_amount(invoices=None):
+    """Calculate the sum of total_amount from session state (or the given) invoices."""
+    total = sum(float(invoice.get("total_amount") or 0) for invoice in (st.session_state.invoices if invoices is None else invoices))
+    return total
+
+
+def invoice_kpis(invoices):
+    """KPI figures shown at the top of the Dashboard."""
+    df = pd.DataFrame(invoices)
+    
+    # Ensure total_amount is numeric
+    df["total_amount"] = pd.to_numeric(df["total_amount"], errors="coerce")
+    
+    # Total invoices
+    total_invoices = len(df)
+    
+    # Total spending
+    total_spending = df["total_amount"].sum()
+    
+    # Average invoice value
+    average_invoice = total_spending / total_invoices if total_invoices else 0
+    
+    # Highest expense category calculation: group by category and sum amounts
+    category_totals = df.groupby("category")["total_amount"].sum().reset_index()
+    if not category_totals.empty:
+        highest = category_totals.loc[category_totals["total_amount"].idxmax()]
+        highest_category = highest["category"]
+        highest_amount = highest["total_amount"]
+    else:
+        highest_category = "N/A"
+        highest_amount = 0
+    return total_invoices, total_spending, average_invoice, highest_category, highest_amount
+
+
+def invoice_table(invoices):
+    """Invoice table with display column names, as shown in the Dashboard grid."""
+    df = pd.DataFrame(invoices)
+    columns_order = ["id", "store_name", "gstin", "date", "category", "total_amount"]
+    df = df[columns_order]
+    
+    # Rename columns for display
+    df = df.rename(columns={
+        "id": "Bill ID",
+        "store_name": "Store Name",
+        "gstin": "GSTIN",
+        "date": "Date",
+        "category": "Category",
+        "total_amount": "Total Amount"
+    })
+    
+    # Convert "Total Amount" column to numeric type
+    df["Total Amount"] = pd.to_numeric(df["Total Amount"], errors="coerce")
+    return df
+
+
+def spending_trends(silent=False, invoices=None):
     """
-    Generates charts based on invoice data from st.session_state.invoices.
+    Generates charts based on invoice data from st.session_state.invoices (or the given invoices).
     If silent=True, returns file paths for PDF generation; otherwise, displays charts.
     """
-    invoices_df = pd.DataFrame(st.session_state.invoices)
+    invoices_df = pd.DataFrame(st.session_state.invoices if invoices is None else invoices)
     
     # Clean and convert date strings (assuming DD/MM/YYYY format)
     invoices_df['date'] = invoices_df['date'].astype(str)
@@ -19,6 +92,8 @@ def spending_trends(silent=False):
     # Convert total_amount to numeric and drop invalid rows
     invoices_df['total_amount'] = pd.to_numeric(invoices_df['total_amount'], errors='coerce')
     invoices_df = invoices_df.dropna(subset=['total_amount'])
+    # Spelling variants of a store (same GSTIN) are one bar
+    invoices_df['store_name'] = canonical_store_names(invoices_df)
 
     # Pie Chart: Spending by Category
     pie_chart_path = tempfile.mkstemp(suffix=".png")[1]
@@ -37,11 +112,19 @@ def spending_trends(silent=False):
     fig2, ax2 = plt.subplots(figsize=(10, 6))
     spending_by_date = invoices_df.groupby('date')['total_amount'].sum().reset_index()
     spending_by_date = spending_by_date.dropna(subset=['date']).sort_values(by='date')
-    ax2.plot(spending_by_date['date'], spending_by_date['total_amount'], marker='o')
+    ax2.plot(spending_by_date['date'], spending_by_date['total_amount'], marker='o', label="Actual")
+
+    # Forecast band, once there are at least two seasons of history to backtest on
+    if len(spending_by_date) > 1 and (spending_by_date['date'].max() - spending_by_date['date'].min()).days >= 2 * DEFAULT_SEASON_LENGTH:
+        forecast = forecast_frame(invoices_df)
+        ax2.plot(forecast['date'], forecast['forecast'], linestyle='--', label="Forecast")
+        ax2.fill_between(forecast['date'], forecast['lower'], forecast['upper'], alpha=0.2, label="Forecast range")
+        ax2.legend()
     ax2.set_title("Spending Trends Over Time")
     ax2.set_xlabel("Date")
     ax2.set_ylabel("Total Amount (₹)")
-    plt.xticks(rotation=45)
+    # Rotate on the axes rather than through pyplot's current figure, which report jobs share
+    ax2.tick_params(axis='x', labelrotation=45)
     fig2.tight_layout()
     fig2.savefig(line_chart_path, format="png")
     plt.close(fig2)
@@ -52,7 +135,7 @@ def spending_trends(silent=False):
     spending_by_store = invoices_df.groupby('store_name')['total_amount'].sum().reset_index()
     sns.barplot(x='store_name', y='total_amount', data=spending_by_store, ax=ax3, palette='viridis')
     ax3.set_title("Spending by Store")
-    plt.xticks(rotation=45)
+    ax3.tick_params(axis='x', labelrotation=45)
     fig3.tight_layout()
     fig3.savefig(bar_chart_path, format="png")
     plt.close(fig3)
@@ -64,70 +147,99 @@ def spending_trends(silent=False):
     st.image(pie_chart_path, caption="Spending by Category")
     st.image(line_chart_path, caption="Spending Trends Over Time")
     st.image(bar_chart_path, caption="Spending by Store")
-=======
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import streamlit as st
-import tempfile
 
-def spending_trends(silent=False):
+
+def _report_inputs(invoices, images):
+    # Default to every invoice in the session and the images of the invoices in the report
+    if invoices is None:
+        invoices = st.session_state.invoices
+    if images is None:
+        invoice_ids = {invoice.get("id") for invoice in invoices}
+        images = {invoice_id: img for invoice_id, img in st.session_state.invoice_images.items() if invoice_id in invoice_ids}
+    return invoices, images
+
+
+def _render_report_charts(invoices):
+    return spending_trends(silent=True, invoices=invoices)
+
+
+def generate_invoice_pdf(invoices=None, images=None):
     """
-    Generates charts based on invoice data from st.session_state.invoices.
-    If silent=True, returns file paths for PDF generation; otherwise, displays charts.
+    Start building the invoice summary PDF in the background and return its cache key.
+    Reports already built for the same data are reused instead of rebuilt.
+    Defaults to every invoice and image in the session.
     """
-    invoices_df = pd.DataFrame(st.session_state.invoices)
-    
-    # Clean and convert date strings (assuming DD/MM/YYYY format)
-    invoices_df['date'] = invoices_df['date'].astype(str)
-    invoices_df['date'] = pd.to_datetime(invoices_df['date'], format='%d/%m/%Y', errors='coerce')
-    
-    # Convert total_amount to numeric and drop invalid rows
-    invoices_df['total_amount'] = pd.to_numeric(invoices_df['total_amount'], errors='coerce')
-    invoices_df = invoices_df.dropna(subset=['total_amount'])
+    invoices, images = _report_inputs(invoices, images)
+    return request_report(st.session_state, invoices, images, render_charts=_render_report_charts)
 
-    # Pie Chart: Spending by Category
-    pie_chart_path = tempfile.mkstemp(suffix=".png")[1]
-    fig1, ax1 = plt.subplots(figsize=(8, 6))
-    spending_by_category = invoices_df.groupby('category')['total_amount'].sum().reset_index()
-    ax1.pie(spending_by_category['total_amount'],
-            labels=spending_by_category['category'],
-            autopct='%1.1f%%',
-            startangle=140)
-    ax1.set_title("Spending by Category")
-    fig1.savefig(pie_chart_path, format="png")
-    plt.close(fig1)
 
-    # Line Chart: Spending Trends Over Time
-    line_chart_path = tempfile.mkstemp(suffix=".png")[1]
-    fig2, ax2 = plt.subplots(figsize=(10, 6))
-    spending_by_date = invoices_df.groupby('date')['total_amount'].sum().reset_index()
-    spending_by_date = spending_by_date.dropna(subset=['date']).sort_values(by='date')
-    ax2.plot(spending_by_date['date'], spending_by_date['total_amount'], marker='o')
-    ax2.set_title("Spending Trends Over Time")
-    ax2.set_xlabel("Date")
-    ax2.set_ylabel("Total Amount (₹)")
-    plt.xticks(rotation=45)
-    fig2.tight_layout()
-    fig2.savefig(line_chart_path, format="png")
-    plt.close(fig2)
+@st.fragment(run_every=1)
+def _poll_invoice_pdf(key):
+    """Show the progress of a background report and rerun the page once it finishes."""
+    status, progress = get_report(st.session_state, key)
+    if status == "pending":
+        fraction, message = progress
+        st.progress(fraction, text=message)
+    else:
+        st.rerun()
 
-    # Bar Chart: Spending by Store
-    bar_chart_path = tempfile.mkstemp(suffix=".png")[1]
-    fig3, ax3 = plt.subplots(figsize=(10, 6))
-    spending_by_store = invoices_df.groupby('store_name')['total_amount'].sum().reset_index()
-    sns.barplot(x='store_name', y='total_amount', data=spending_by_store, ax=ax3, palette='viridis')
-    ax3.set_title("Spending by Store")
-    plt.xticks(rotation=45)
-    fig3.tight_layout()
-    fig3.savefig(bar_chart_path, format="png")
-    plt.close(fig3)
 
-    if silent:
-        return pie_chart_path, line_chart_path, bar_chart_path
+def show_invoice_pdf(invoices=None, images=None, key="download_invoice_summary"):
+    """
+    Show the invoice summary PDF for the current data: build progress while it is
+    being generated, then a download button. Shows nothing if it hasn't been requested.
+    """
+    invoices, images = _report_inputs(invoices, images)
+    report_key = report_cache_key(invoices, images)
+    status, result = get_report(st.session_state, report_key)
+    if status == "pending":
+        _poll_invoice_pdf(report_key)
+    elif status == "error":
+        st.error(f"Error generating the invoice summary PDF: {result}")
+    elif status == "ready":
+        st.success("✅ Invoice Summary PDF generated successfully!")
+        st.download_button(
+            label="📄 Download Invoice Summary PDF",
+            data=result,
+            file_name="invoices_summary.pdf",
+            mime="application/pdf",
+            key=key
+        )
 
-    # Otherwise, display the charts in the UI
-    st.image(pie_chart_path, caption="Spending by Category")
-    st.image(line_chart_path, caption="Spending Trends Over Time")
-    st.image(bar_chart_path, caption="Spending by Store")
->>>>>>> f6db6249f44dc85188b1a8210287ca895249bcbc
+
+def show_metrics_panel():
+    """Sidebar debug panel with per-stage upload timings; shown only while instrumentation is on."""
+    if not enabled():
+        return
+    with st.sidebar.expander("⏱️ Stage timings", expanded=False):
+        stats = snapshot()
+        if not stats:
+            st.caption("No uploads timed yet.")
+            return
+        st.dataframe(pd.DataFrame([
+            {"Stage": stage, "Count": s["count"], "Mean (ms)": s["mean"] * 1000,
+             "p50 ≤ (ms)": s["p50"] * 1000, "p95 ≤ (ms)": s["p95"] * 1000, "Total (s)": s["sum"]}
+            for stage, s in sorted(stats.items(), key=lambda item: -item[1]["sum"])
+        ]), hide_index=True)
+        st.caption("Most recent spans")
+        st.dataframe(pd.DataFrame(
+            [{"Stage": stage, "ms": seconds * 1000} for _, stage, seconds in recent_spans(20)]
+        ), hide_index=True)
+        stats = template_stats(counters())
+        if stats["attempts"]:
+            st.caption("Vendor templates")
+            hit_rate = f"{stats['hit_rate']:.0%}"
+            accuracy = f"{stats['accuracy']:.0%} of {stats['audits']} audited" if stats["audits"] else "not audited yet"
+            st.write(f"Hit rate {hit_rate} of {stats['attempts']} known-vendor uploads; accuracy {accuracy}.")
+        st.download_button("Prometheus text", prometheus_text(), file_name="metrics.txt", mime="text/plain")
+        st.download_button("JSON", json_text(), file_name="metrics.json", mime="application/json")
+
+
+def sync_from_service():
+    """Pull invoices saved by the ingestion service into the session, when one is configured."""
+    if not service_client.enabled():
+        return
+    try:
+        service_client.sync_invoices(st.session_state)
+    except requests.RequestException as e:
+        st.error(f"⚠️ Couldn't reach the ingestion service at {service_client.API_URL}: {e}")
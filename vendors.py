@@ -0,0 +1,138 @@
+"""
+Vendor master keyed by GSTIN. Every saved invoice with a valid GSTIN (format and check
+character) adds to its vendor's entry: the store-name spellings and categories seen. Known
+vendors' store name and category are filled in from the registry instead of being asked of
+the LLM, and store-name variants are merged under the vendor's canonical (most common) spelling.
+"""
+import re
+import string
+import threading
+from collections import Counter
+from functools import lru_cache
+
+GSTIN_CHARSET = string.digits + string.ascii_uppercase
+# State code, PAN (5 letters, 4 digits, 1 letter), entity number, "Z", check character
+GSTIN_FORMAT = re.compile(r"\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]")
+GSTIN_IN_TEXT = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]\b")
+# Invoices a vendor needs before its registry entry replaces the LLM's answer
+MIN_VENDOR_INVOICES = 2
+
+
+def gstin_checksum(body):
+    """Check character for the first 14 characters of a GSTIN (mod-36 weighted sum)."""
+    total = 0
+    for position, char in enumerate(body):
+        product = GSTIN_CHARSET.index(char) * (2 if position % 2 else 1)
+        total += product // 36 + product % 36
+    return GSTIN_CHARSET[(36 - total % 36) % 36]
+
+
+@lru_cache(maxsize=4096)
+def valid_gstin(value):
+    """The GSTIN normalised (upper case, no spaces), or None if it's malformed or its check character is wrong."""
+    if not isinstance(value, str):
+        return None
+    gstin = re.sub(r"[\s-]", "", value).upper()
+    if not GSTIN_FORMAT.fullmatch(gstin) or gstin_checksum(gstin[:14]) != gstin[14]:
+        return None
+    return gstin
+
+
+def find_gstin(text):
+    """The first valid GSTIN in OCR text, or None."""
+    for match in GSTIN_IN_TEXT.finditer(text or ""):
+        gstin = valid_gstin(match.group(0))
+        if gstin:
+            return gstin
+    return None
+
+
+def _known_name(name):
+    name = (name or "").strip() if isinstance(name, str) else ""
+    return name if name and name != "N/A" else None
+
+
+class VendorRegistry:
+    """Vendors seen in saved invoices, keyed by validated GSTIN; safe to read from worker threads."""
+
+    def __init__(self, invoices=()):
+        self.vendors = {}
+        self.recorded = 0
+        self.last_invoice = None
+        self._lock = threading.Lock()
+        for invoice in invoices:
+            self.add(invoice)
+
+    def __len__(self):
+        return self.recorded
+
+    def add(self, invoice):
+        """Record a saved invoice; returns its vendor's GSTIN, or None if it has no valid GSTIN."""
+        gstin = valid_gstin(invoice.get("gstin"))
+        with self._lock:
+            self.recorded += 1
+            self.last_invoice = invoice
+            if gstin is None:
+                return None
+            vendor = self.vendors.setdefault(gstin, {"names": Counter(), "categories": Counter(), "invoices": 0})
+            vendor["invoices"] += 1
+            name = _known_name(invoice.get("store_name"))
+            if name:
+                vendor["names"][name] += 1
+            if invoice.get("category"):
+                vendor["categories"][invoice["category"]] += 1
+        return gstin
+
+    def lookup(self, gstin):
+        """
+        The vendor's entry (gstin, store_name, category, invoices) once it has
+        MIN_VENDOR_INVOICES invoices with a store name; None for unknown or invalid GSTINs.
+        """
+        gstin = valid_gstin(gstin)
+        with self._lock:
+            vendor = self.vendors.get(gstin)
+            if vendor is None or vendor["invoices"] < MIN_VENDOR_INVOICES or not vendor["names"]:
+                return None
+            # most_common keeps first-seen order among ties
+            return {
+                "gstin": gstin,
+                "store_name": vendor["names"].most_common(1)[0][0],
+                "category": vendor["categories"].most_common(1)[0][0] if vendor["categories"] else None,
+                "invoices": vendor["invoices"],
+            }
+
+
+def canonical_store_names(frame):
+    """
+    The frame's store names with every spelling seen for a valid GSTIN replaced by that
+    GSTIN's most common spelling (the first seen on ties). Rows without a valid GSTIN keep their name.
+    """
+    names = frame["store_name"]
+    if "gstin" not in frame or frame.empty:
+        return names
+    valid = {gstin: valid_gstin(gstin) for gstin in frame["gstin"].dropna().unique()}
+    keys = frame["gstin"].map(valid)
+    known = names.map(_known_name)
+    pairs = frame.assign(_key=keys, _name=known).dropna(subset=["_key", "_name"])
+    if pairs.empty:
+        return names
+    counts = pairs.groupby(["_key", "_name"], sort=False).size()
+    canonical = dict(counts.groupby(level=0, sort=False).idxmax().tolist())
+    return keys.map(canonical).fillna(names)
+
+
+def sync_vendor_registry(state, invoices):
+    """Return the session's vendor registry, rebuilding it if it no longer matches the invoices."""
+    registry = state.get("vendor_registry")
+    if registry is None or len(registry) != len(invoices) or (invoices and registry.last_invoice is not invoices[-1]):
+        registry = state["vendor_registry"] = VendorRegistry(invoices)
+    return registry
+
+
+def record_vendor(state, invoices, invoice):
+    """Add a newly saved invoice to the session's vendor registry if it is otherwise up to date."""
+    registry = state.get("vendor_registry")
+    if registry is not None and len(registry) == len(invoices) - 1:
+        registry.add(invoice)
+    else:
+        state.pop("vendor_registry", None)